@@ -2,7 +2,9 @@ from fastapi import APIRouter, Request
 from fastapi.responses import HTMLResponse , JSONResponse
 from fastapi.templating import Jinja2Templates
 
+import asyncio
 import json
+import os
 import pathlib
 import httpx
 import re
@@ -13,22 +15,24 @@ from datetime import datetime
 from core.led_controller import set_led
 
 # --- Import จากไฟล์ที่เราสร้างขึ้น ---
-from core.models import APILEDcommand, JobRequest, ErrorRequest, LEDPositionRequest, LEDPositionsRequest, LEDClearAndBatch, LMSCheckShelfRequest, LMSCheckShelfResponse, ShelfComplete, ShelfState, BlockState, LotData, LayoutRequest, LayoutResponse, SlotData, GatewayLEDcommand
+from core.models import APILEDcommand, JobRequest, ErrorRequest, LEDPositionRequest, LEDPositionsRequest, LEDClearAndBatch, LMSCheckShelfRequest, LMSCheckShelfResponse, ShelfComplete, ShelfState, BlockState, LotData, LayoutRequest, LayoutResponse, SlotData, GatewayLEDcommand, LEDEffectRequest, LEDPowerConfig
 from core.database import (
-    DB, get_job_by_id, get_lots_in_position, add_lot_to_position, remove_lot_from_position, update_lot_quantity, validate_position, get_shelf_info, SHELF_CONFIG, update_lot_biz, get_cell_capacity, update_layout_from_gateway, get_layout_info, is_layout_loaded_from_gateway, log_current_layout, get_layout_status
+    DB, get_job_by_id, get_job_queue, next_job_id, enqueue_job, complete_job_entry, cancel_jobs_by_lot, update_job, reset_db, reset_shelf_state, get_lots_in_position, add_lot_to_position, remove_lot_from_position, update_lot_quantity, validate_position, get_shelf_info, SHELF_CONFIG, set_cell_lots, find_lot_locations, is_lot_in_position, update_lot_biz, get_cell_capacity, update_layout_from_gateway, replace_shelf_lots, get_layout_info, is_layout_loaded_from_gateway, log_current_layout, get_layout_status
 )
-from api.websockets import manager # <-- import websocket manager
+from api.websockets import manager, WS_FULL_STATE_EVENTS # <-- import websocket manager
+from core.outbox import outbox, PermanentDeliveryError, is_permanent_http_failure
+from core.sync_scheduler import shelf_sync_scheduler
 
 # === Push Button Integration ===
 try:
-    from core.pushbutton_reader import PushButtonReader
+    from core.pushbutton_reader import PushButtonReader, BUTTON_MAP, build_button_mapping, parse_button_map
     BUTTON_READER_AVAILABLE = True
 except ImportError as e:
     print(f"⚠️ Button reader not available: {e}")
     BUTTON_READER_AVAILABLE = False
 
-# Gateway Configuration  
-GATEWAY_BASE_URL = "http://43.72.20.238:8000"  # Gateway server URL
+# Gateway Configuration (shared pooled client - core/gateway.py)
+from core.gateway import GATEWAY_BASE_URL, get_gateway_client, gateway_timeout, delta_sync_enabled, note_shelf_sync_response, get_delta_sync_status
 
 # Global shelf information (filled during startup)
 GLOBAL_SHELF_INFO = {
@@ -36,6 +40,45 @@ GLOBAL_SHELF_INFO = {
     "local_ip": None
 }
 
+# สถานะการบูต (main.py: startup_event / reconcile_with_gateway) - แสดงใน GET /api/system/storage
+STARTUP_STATUS = {
+    "phase": "booting",          # booting -> serving (cache) -> reconciling -> ready
+    "boot_ms": None,
+    "source": None,              # "cache" | "gateway" | "fallback"
+    "shelf_info": None,
+    "layout": None,
+    "state": None,
+    "reconcile_ms": None
+}
+
+# shelf_id ล่าสุดที่ได้จาก Gateway (ใช้ตอนบูตก่อน Gateway ตอบ)
+from core.journal import DATA_DIR
+SHELF_INFO_CACHE_FILE = DATA_DIR / "shelf_info.json"
+
+def load_cached_shelf_info():
+    """โหลด shelf_id / local_ip ล่าสุดจากไฟล์ cache เข้า GLOBAL_SHELF_INFO (คืน dict หรือ None)"""
+    try:
+        with open(SHELF_INFO_CACHE_FILE, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not cached.get("shelf_id"):
+        return None
+    GLOBAL_SHELF_INFO["shelf_id"] = cached["shelf_id"]
+    GLOBAL_SHELF_INFO["local_ip"] = cached.get("local_ip")
+    return cached
+
+def save_cached_shelf_info():
+    """บันทึก GLOBAL_SHELF_INFO ลงไฟล์ cache (atomic)"""
+    try:
+        SHELF_INFO_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = SHELF_INFO_CACHE_FILE.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({**GLOBAL_SHELF_INFO, "saved_at": time.time()}, f, ensure_ascii=False)
+        os.replace(tmp_path, SHELF_INFO_CACHE_FILE)
+    except OSError as e:
+        print(f"⚠️ Failed to cache shelf info: {e}")
+
 # === Global Button Reader Instance ===
 button_reader = None
 
@@ -95,7 +138,7 @@ def init_button_reader():
                 asyncio.set_event_loop(loop)
                 
                 # Run the broadcast
-                loop.run_until_complete(manager.broadcast(json.dumps(button_event)))
+                loop.run_until_complete(manager.broadcast(button_event))
                 loop.close()
                 
                 print(f"📡 Button press broadcasted: {position}")
@@ -124,37 +167,44 @@ def init_button_reader():
         return False
 
 def update_button_mapping():
-    """Update button position mapping based on current shelf configuration"""
+    """
+    Update button position mapping based on current shelf configuration
+    
+    ปุ่มทุกตัวของ expander ที่พบ (0x20-0x27, ตัวละ 8 ปุ่ม) ถูกจับคู่กับ cell ตามลำดับ layout
+    (L1B1, L1B2, ... แล้วชั้นถัดไป) - SMART_SHELF_BUTTON_MAP กำหนดปุ่มเฉพาะตัวทับได้
+    """
     global button_reader
     
     if not button_reader:
         return
     
     try:
-        # Create dynamic mapping based on shelf config
-        button_mapping = {}
-        button_index = 0
-        
-        # Map buttons to first 3 positions in shelf
-        for level in sorted(SHELF_CONFIG.keys()):
-            max_blocks = SHELF_CONFIG[level]
-            for block in range(1, min(max_blocks + 1, 4)):  # Limit to first 3 positions
-                if button_index < 3:  # Max 3 hardware buttons
-                    button_mapping[button_index] = f"L{level}B{block}"
-                    button_index += 1
-                    
-                    if button_index >= 3:
-                        break
-            if button_index >= 3:
-                break
+        positions = [f"L{level}B{block}" for level in sorted(SHELF_CONFIG.keys())
+                     for block in range(1, int(SHELF_CONFIG[level]) + 1)]
+        button_mapping = build_button_mapping(positions, button_reader.button_indices(), parse_button_map(BUTTON_MAP))
         
-        # Update button reader mapping
-        button_reader.update_position_mapping(button_mapping)
-        print(f"📍 Button mapping updated: {button_mapping}")
+        # Update button reader mapping (แทนที่ทั้งหมด - layout อาจลดจำนวน cell)
+        button_reader.update_position_mapping(button_mapping, replace=True)
+        print(f"📍 Button mapping updated: {len(button_mapping)} buttons -> {len(positions)} cells")
+        if len(positions) > len(button_mapping):
+            print(f"⚠️ {len(positions) - len(button_mapping)} cells have no hardware button")
         
     except Exception as e:
         print(f"⚠️ Button mapping update failed: {e}")
 
+def refresh_layout_hardware():
+    """
+    Layout เปลี่ยน (โหลดจาก storage ตอนบูต หรือรับจาก Gateway) -> สร้าง LED lookup table ใหม่
+    และจับคู่ปุ่มกับ cell ตาม SHELF_CONFIG ปัจจุบัน
+    """
+    try:
+        from core.led_controller import refresh_led_config
+        refresh_led_config()
+        print("💡 LED configuration refreshed for current layout")
+    except Exception as led_error:
+        print(f"⚠️ LED refresh failed: {led_error}")
+    update_button_mapping()
+
 def stop_button_reader():
     """Stop button reader"""
     global button_reader
@@ -209,24 +259,25 @@ async def fetch_layout_from_gateway(shelf_id: str = None):
         print(f"🔄 Fetching layout from Gateway: {GATEWAY_BASE_URL}/IoTManagement/shelf/layout")
         print(f"📦 Payload: {gateway_payload}")
         
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.post(
-                f"{GATEWAY_BASE_URL}/IoTManagement/shelf/layout",
-                json=gateway_payload,
-                headers=headers
-            )
+        client = get_gateway_client()
+        response = await client.post(
+            f"{GATEWAY_BASE_URL}/IoTManagement/shelf/layout",
+            timeout=gateway_timeout("layout"),
+            json=gateway_payload,
+            headers=headers
+        )
             
-            print(f"📡 Gateway Response Status: {response.status_code}")
+        print(f"📡 Gateway Response Status: {response.status_code}")
             
-            if response.status_code == 200:
-                response_data = response.json()
-                print(f"✅ Layout fetched successfully")
-              #  print(f"📦 Layout data: {response_data}")
+        if response.status_code == 200:
+            response_data = response.json()
+            print(f"✅ Layout fetched successfully")
+          #  print(f"📦 Layout data: {response_data}")
                 
-                return response_data
-            else:
-                print(f"⚠️ Gateway layout fetch failed: {response.status_code} - {response.text}")
-                return None
+            return response_data
+        else:
+            print(f"⚠️ Gateway layout fetch failed: {response.status_code} - {response.text}")
+            return None
                 
     except Exception as e:
         print(f"⚠️ Layout fetch error: {e}")
@@ -254,21 +305,22 @@ async def sync_layout_to_gateway(layout_data: dict, shelf_id: str = None):
         print(f"🔄 Syncing layout to Gateway: {GATEWAY_BASE_URL}/IoTManagement/shelf/layout")
         print(f"📦 Payload: {gateway_payload}")
         
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.post(
-                f"{GATEWAY_BASE_URL}/IoTManagement/shelf/layout",
-                json=gateway_payload,
-                headers=headers
-            )
+        client = get_gateway_client()
+        response = await client.post(
+            f"{GATEWAY_BASE_URL}/IoTManagement/shelf/layout",
+            timeout=gateway_timeout("layout"),
+            json=gateway_payload,
+            headers=headers
+        )
             
-            print(f"📡 Gateway Response Status: {response.status_code}")
+        print(f"📡 Gateway Response Status: {response.status_code}")
             
-            if response.status_code == 200:
-                print(f"✅ Layout synced successfully")
-                return True
-            else:
-                print(f"⚠️ Gateway layout sync failed: {response.status_code} - {response.text}")
-                return False
+        if response.status_code == 200:
+            print(f"✅ Layout synced successfully")
+            return True
+        else:
+            print(f"⚠️ Gateway layout sync failed: {response.status_code} - {response.text}")
+            return False
                 
     except Exception as e:
         print(f"⚠️ Layout sync error: {e}")
@@ -291,16 +343,17 @@ async def get_logs_from_gateway(limit: int = 20, event_type: str = None):
             params["event_type"] = event_type
             
         # ✅ ใช้ endpoint ใหม่ที่ Gateway auto-detect shelf จาก IP
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(
-                f"{GATEWAY_BASE_URL}/IoTManagement/shelf/requestID",
-                params=params
-            )
+        client = get_gateway_client()
+        response = await client.get(
+            f"{GATEWAY_BASE_URL}/IoTManagement/shelf/requestID",
+            timeout=gateway_timeout("logs"),
+            params=params
+        )
             
-            if response.status_code == 200:
-                return response.json()
-            else:
-                return {"error": f"Gateway returned {response.status_code}: {response.text}"}
+        if response.status_code == 200:
+            return response.json()
+        else:
+            return {"error": f"Gateway returned {response.status_code}: {response.text}"}
                 
     except Exception as e:
         return {"error": str(e)}
@@ -309,6 +362,9 @@ async def send_shelf_complete_to_gateway(job: dict):
     """
     ส่งข้อมูล ShelfComplete ไปยัง Gateway API
     ใช้ข้อมูลจาก job (ที่มี biz และ shelf_id ครบถ้วนแล้ว)
+
+    Returns False เมื่อควร retry (network / 5xx / 408 / 429)
+    Raises PermanentDeliveryError เมื่อ Gateway ปฏิเสธถาวร (4xx อื่นๆ) - outbox จะ dead-letter
     """
     try:
         # ตรวจสอบข้อมูลที่จำเป็น
@@ -338,23 +394,28 @@ async def send_shelf_complete_to_gateway(job: dict):
         print(f"🔍 Sending ShelfComplete to Gateway: {GATEWAY_BASE_URL}/shelf/complete")
         print(f"📦 Payload: {shelf_complete_data}")
         
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.post(
-                f"{GATEWAY_BASE_URL}/shelf/complete",
-                json=shelf_complete_data,
-                headers=headers
-            )
+        client = get_gateway_client()
+        response = await client.post(
+            f"{GATEWAY_BASE_URL}/shelf/complete",
+            timeout=gateway_timeout("complete"),
+            json=shelf_complete_data,
+            headers=headers
+        )
             
-            print(f"📡 Gateway Response Status: {response.status_code}")
-            print(f"📄 Gateway Response Body: {response.text}")
+        print(f"📡 Gateway Response Status: {response.status_code}")
+        print(f"📄 Gateway Response Body: {response.text}")
             
-            if response.status_code == 200:
-                print(f"✅ ShelfComplete sent successfully")
-                return True
-            else:
-                print(f"⚠️ Gateway ShelfComplete failed: {response.status_code} - {response.text}")
-                return False
+        if response.status_code == 200:
+            print(f"✅ ShelfComplete sent successfully")
+            return True
+        elif is_permanent_http_failure(response.status_code):
+            raise PermanentDeliveryError(f"Gateway rejected ShelfComplete: {response.status_code} - {response.text[:200]}")
+        else:
+            print(f"⚠️ Gateway ShelfComplete failed: {response.status_code} - {response.text}")
+            return False
                 
+    except PermanentDeliveryError:
+        raise
     except Exception as e:
         print(f"⚠️ ShelfComplete Gateway error: {e}")
         return False
@@ -446,6 +507,8 @@ async def control_led_universal(request: APILEDcommand):
             "mode": "batch",
             "cleared_first": clear_first,
             "count": len(led_commands),
+            "changed": result.get("changed"),     # pixel ที่ต้องเขียนจริง
+            "skipped": result.get("skipped"),     # pixel ที่สีเท่าเดิม (ไม่เขียนซ้ำ)
             "positions": [cmd["position"] for cmd in led_commands],
             "colors": [{"position": cmd["position"], "hex": cmd["hex"]} for cmd in led_commands]
         }
@@ -560,6 +623,85 @@ async def led_control_by_level_block(request: GatewayLEDcommand):
         })
 
 
+@router.post("/api/led/effect", tags=["LED Control"])
+async def start_led_effect(request: LEDEffectRequest):
+    """
+    Server-side LED animation - 1 request แทน setTimeout + fetch หลายรอบ
+
+    ## Example:
+    ```json
+    {"effect": "blink", "positions": ["L1B2"], "color": "blue", "period": 1.0, "ttl": 10}
+    {"effect": "chase", "levels": [2], "r": 0, "g": 255, "b": 0, "period": 2.0}
+    {"effect": "solid", "positions": ["L3B1"], "color": "green", "ttl": 2}
+    ```
+    effect: solid / blink / breathe / chase — ttl (วินาที) ครบแล้ว LED ดับเอง
+    """
+    from core.led_controller import start_effect, LED_COLORS
+    if not request.positions and not request.levels:
+        return JSONResponse(status_code=400, content={"error": "positions or levels is required"})
+
+    if request.color:
+        color = LED_COLORS.get(request.color.lower())
+        if color is None:
+            return JSONResponse(status_code=400, content={
+                "error": "Unknown color",
+                "message": f"Supported colors: {', '.join(LED_COLORS)}"
+            })
+    elif request.r is not None or request.g is not None or request.b is not None:
+        color = (request.r or 0, request.g or 0, request.b or 0)
+    else:
+        color = LED_COLORS["blue"]
+
+    result = start_effect(request.effect, positions=request.positions, levels=request.levels, color=color,
+                          period=request.period, ttl=request.ttl, width=request.width)
+    if not result.get("ok"):
+        return JSONResponse(status_code=400, content={"error": "LED effect failed", **result})
+    print(f"✨ LED effect #{result['effect_id']}: {request.effect} on {result['pixels']} LEDs"
+          f"{f' (ttl {request.ttl}s)' if request.ttl else ''}")
+    return result
+
+
+@router.get("/api/led/effect", tags=["LED Control"])
+def list_led_effects():
+    """effects ที่กำลังทำงาน"""
+    from core.led_controller import list_effects
+    return {"ok": True, "effects": list_effects()}
+
+
+@router.delete("/api/led/effect", tags=["LED Control"])
+def stop_led_effect(effect_id: int = None):
+    """หยุด effect ตาม effect_id (ไม่ระบุ = หยุดทั้งหมด) - LED กลับไปแสดงสีเดิมก่อน effect"""
+    from core.led_controller import stop_effect
+    return stop_effect(effect_id)
+
+
+@router.get("/api/led/power", tags=["LED Control"])
+def get_led_power_api():
+    """gamma / brightness / current budget และกระแสโดยประมาณของ frame ล่าสุด (mA)"""
+    from core.led_controller import get_led_power
+    return {"ok": True, "power": get_led_power()}
+
+
+@router.post("/api/led/power", tags=["LED Control"])
+def configure_led_power_api(request: LEDPowerConfig):
+    """
+    ตั้งค่า brightness / gamma / current budget ของ strip
+
+    ## Example:
+    ```json
+    {"brightness": 0.6, "budget_ma": 1500}
+    ```
+    frame ที่ประมาณว่ากินกระแสเกิน budget_ma จะถูกลดความสว่างทั้ง frame ตามสัดส่วน
+    """
+    from core.led_controller import configure_led_power
+    try:
+        config = configure_led_power(gamma=request.gamma, brightness=request.brightness, budget_ma=request.budget_ma)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": "Invalid LED power config", "detail": str(e)})
+    print(f"🔆 LED power config: {config}")
+    return {"ok": True, "config": config}
+
+
 @router.post("/api/led/debug", tags=["LED Control"])
 async def debug_led_mapping(request: Request):
     """
@@ -603,8 +745,7 @@ async def debug_led_mapping(request: Request):
                     })
                     
                     # Wait and turn off
-                    import time
-                    time.sleep(0.5)
+                    await asyncio.sleep(0.5)
                     set_led(level, block, 0, 0, 0)  # Turn off
         
         elif test_type == "colors":
@@ -632,8 +773,7 @@ async def debug_led_mapping(request: Request):
                             "result": result
                         })
                         
-                        import time
-                        time.sleep(1.0)  # Show each color for 1 second
+                        await asyncio.sleep(1.0)  # Show each color for 1 second
         
         elif test_type == "positions":
             # Test all positions with blue color
@@ -654,8 +794,7 @@ async def debug_led_mapping(request: Request):
                         "result": result
                     })
                     
-                    import time
-                    time.sleep(0.2)  # Brief flash
+                    await asyncio.sleep(0.2)  # Brief flash
                     set_led(level, block, 0, 0, 0)  # Turn off
         
         return {
@@ -701,7 +840,7 @@ async def ask_correct_shelf(request: LMSCheckShelfRequest):
             )
         
         # ตรวจสอบว่า LOT นี้มีอยู่ในคิวหรือไม่
-        existing_job = any(j['lot_no'] == lot_no for j in DB["jobs"])
+        existing_job = get_job_queue().has_lot(lot_no)
         
         if existing_job:
             return JSONResponse(
@@ -728,94 +867,95 @@ async def ask_correct_shelf(request: LMSCheckShelfRequest):
         print(f"🔄 Shelf forwarding to Gateway: {gateway_url}")
         print(f"📦 Payload: {gateway_payload}")
         
-        async with httpx.AsyncClient(timeout=LMS_TIMEOUT) as client:
-            response = await client.post(
-                gateway_url,
-                json=gateway_payload,
-                headers=headers
-            )
+        client = get_gateway_client()
+        response = await client.post(
+            gateway_url,
+            timeout=gateway_timeout("ask_shelf"),
+            json=gateway_payload,
+            headers=headers
+        )
             
-            if response.status_code == 200:
-                gateway_response = response.json()
-                print(f"📋 Gateway response: {gateway_response}")
+        if response.status_code == 200:
+            gateway_response = response.json()
+            print(f"📋 Gateway response: {gateway_response}")
                 
-                # ตรวจสอบว่ามี status และ lot_no
-                if "status" in gateway_response and "lot_no" in gateway_response:
+            # ตรวจสอบว่ามี status และ lot_no
+            if "status" in gateway_response and "lot_no" in gateway_response:
                     
-                    # ตรวจสอบว่า Gateway/LMS ประมวลผลสำเร็จหรือไม่
-                    if gateway_response["status"] == "success":
-                        # รองรับทั้ง correct_shelf และ correct_shelf_name
-                        correct_shelf = (gateway_response.get("correct_shelf_name") or 
-                                       gateway_response.get("correct_shelf") or 
-                                       "UNKNOWN_SHELF")
+                # ตรวจสอบว่า Gateway/LMS ประมวลผลสำเร็จหรือไม่
+                if gateway_response["status"] == "success":
+                    # รองรับทั้ง correct_shelf และ correct_shelf_name
+                    correct_shelf = (gateway_response.get("correct_shelf_name") or 
+                                   gateway_response.get("correct_shelf") or 
+                                   "UNKNOWN_SHELF")
                         
-                        # ตรวจสอบว่ามีข้อมูล shelf หรือไม่
-                        if correct_shelf == "UNKNOWN_SHELF" or correct_shelf == "undefined" or not correct_shelf:
-                            return JSONResponse(
-                                status_code=404,
-                                content={
-                                    "error": "Shelf information not found",
-                                    "message": f"No shelf information found for LOT {gateway_response['lot_no']}",
-                                    "status": "not_found"
-                                }
-                            )
-                        
-                        return {
-                            "status": "success",
-                            "correct_shelf_name": correct_shelf,
-                            "lot_no": gateway_response["lot_no"],
-                            "message": gateway_response.get("message", f"Found correct shelf: {correct_shelf}")
-                        }
-                    else:
-                        # กรณี error response แบบใหม่ที่มี code และ data
-                        error_code = gateway_response.get("code", 400)
+                    # ตรวจสอบว่ามีข้อมูล shelf หรือไม่
+                    if correct_shelf == "UNKNOWN_SHELF" or correct_shelf == "undefined" or not correct_shelf:
                         return JSONResponse(
-                            status_code=error_code,
+                            status_code=404,
                             content={
-                                "error": "Gateway/LMS processing failed",
-                                "message": gateway_response.get("message", "Unknown error from Gateway/LMS"),
-                                "status": gateway_response["status"],
-                                "code": error_code,
-                                "data": gateway_response.get("data", [])
+                                "error": "Shelf information not found",
+                                "message": f"No shelf information found for LOT {gateway_response['lot_no']}",
+                                "status": "not_found"
                             }
                         )
+                        
+                    return {
+                        "status": "success",
+                        "correct_shelf_name": correct_shelf,
+                        "lot_no": gateway_response["lot_no"],
+                        "message": gateway_response.get("message", f"Found correct shelf: {correct_shelf}")
+                    }
                 else:
+                    # กรณี error response แบบใหม่ที่มี code และ data
+                    error_code = gateway_response.get("code", 400)
                     return JSONResponse(
-                        status_code=502,
+                        status_code=error_code,
                         content={
-                            "error": "Invalid Gateway response format",
-                            "message": "Gateway response missing required fields (status, lot_no)",
-                            "received_fields": list(gateway_response.keys()),
-                            "raw_response": gateway_response
+                            "error": "Gateway/LMS processing failed",
+                            "message": gateway_response.get("message", "Unknown error from Gateway/LMS"),
+                            "status": gateway_response["status"],
+                            "code": error_code,
+                            "data": gateway_response.get("data", [])
                         }
                     )
             else:
-                # ตรวจสอบว่าเป็น error response แบบใหม่หรือไม่
-                try:
-                    error_response = response.json()
-                    if "status" in error_response and error_response["status"] == "error":
-                        error_code = error_response.get("code", response.status_code)
-                        return JSONResponse(
-                            status_code=error_code,
-                            content={
-                                "error": "Gateway/LMS error",
-                                "message": error_response.get("message", "Unknown error"),
-                                "status": "error",
-                                "code": error_code,
-                                "data": error_response.get("data", [])
-                            }
-                        )
-                except:
-                    pass  # ไม่สามารถ parse JSON ได้
-                
                 return JSONResponse(
                     status_code=502,
                     content={
-                        "error": "Gateway server error", 
-                        "message": f"Gateway server returned status {response.status_code}",
-                        "detail": response.text
+                        "error": "Invalid Gateway response format",
+                        "message": "Gateway response missing required fields (status, lot_no)",
+                        "received_fields": list(gateway_response.keys()),
+                        "raw_response": gateway_response
                     }
                 )
+        else:
+            # ตรวจสอบว่าเป็น error response แบบใหม่หรือไม่
+            try:
+                error_response = response.json()
+                if "status" in error_response and error_response["status"] == "error":
+                    error_code = error_response.get("code", response.status_code)
+                    return JSONResponse(
+                        status_code=error_code,
+                        content={
+                            "error": "Gateway/LMS error",
+                            "message": error_response.get("message", "Unknown error"),
+                            "status": "error",
+                            "code": error_code,
+                            "data": error_response.get("data", [])
+                        }
+                    )
+            except:
+                pass  # ไม่สามารถ parse JSON ได้
+                
+            return JSONResponse(
+                status_code=502,
+                content={
+                    "error": "Gateway server error", 
+                    "message": f"Gateway server returned status {response.status_code}",
+                    "detail": response.text
+                }
+            )
                 
     except httpx.TimeoutException:
         return JSONResponse(
@@ -845,7 +985,7 @@ async def ask_correct_shelf(request: LMSCheckShelfRequest):
 
 @router.get("/command", tags=["Jobs"])
 def get_all_jobs():
-    return {"jobs": DB["jobs"]}
+    return {"jobs": get_job_queue().to_list()}
 
 @router.get("/api/shelf/config", tags=["Shelf Configuration"])
 def get_shelf_config():
@@ -893,6 +1033,38 @@ def get_shelf_state():
         })
     return {"shelf_state": shelf_state}
 
+@router.get("/api/shelf/lot/{lot_no}", tags=["Jobs"])
+def get_lot_location(lot_no: str):
+    """ค้นหาตำแหน่งของ lot_no ในชั้นวาง (ใช้ lot_no index ไม่ต้องวนทุกช่อง)"""
+    locations = []
+    for level, block in find_lot_locations(lot_no):
+        for lot in get_lots_in_position(level, block):
+            if lot["lot_no"] == lot_no:
+                locations.append({
+                    "position": f"L{level}B{block}",
+                    "level": level,
+                    "block": block,
+                    "tray_count": lot["tray_count"],
+                    "biz": lot.get("biz", "Unknown")
+                })
+    
+    if not locations:
+        return JSONResponse(
+            status_code=404,
+            content={
+                "status": "not_found",
+                "lot_no": lot_no,
+                "locations": [],
+                "message": f"Lot {lot_no} not found in shelf"
+            }
+        )
+    
+    return {
+        "status": "success",
+        "lot_no": lot_no,
+        "locations": locations
+    }
+
 @router.get("/api/shelf/layout/status", tags=["Shelf Layout Management"])
 def get_layout_status_api():
     """
@@ -923,7 +1095,7 @@ def get_layout_status_api():
 @router.post("/command", status_code=201, tags=["Jobs"])
 async def create_job_via_api(job: JobRequest):
     # ตรวจสอบงานซ้ำ
-    existing_lot = any(j['lot_no'] == job.lot_no for j in DB["jobs"])
+    existing_lot = get_job_queue().has_lot(job.lot_no)
     if existing_lot:
          print(f"API: Rejected duplicate job for Lot {job.lot_no}")
          return {"status": "error", "message": f"Job for lot {job.lot_no} already exists in the queue."}
@@ -941,11 +1113,8 @@ async def create_job_via_api(job: JobRequest):
                 "message": f"Invalid position L{level}B{block} does not exist in shelf configuration"
             }
         
-        # ตรวจสอบว่า lot_no มีอยู่ในช่องนั้นหรือไม่
-        lots_in_cell = get_lots_in_position(level, block)
-        lot_exists = any(lot["lot_no"] == job.lot_no for lot in lots_in_cell)
-        
-        if not lot_exists:
+        # ตรวจสอบว่า lot_no มีอยู่ในช่องนั้นหรือไม่ (lot_no index)
+        if not is_lot_in_position(level, block, job.lot_no):
             print(f"API: Rejected pick job for Lot {job.lot_no} - not found in L{level}B{block}")
             return {
                 "status": "error", 
@@ -975,16 +1144,15 @@ async def create_job_via_api(job: JobRequest):
     original_tray_count = int(new_job.get("tray_count", 1))
     new_job["tray_count"] = original_tray_count + 1  # เพิ่ม covertray
     
-    DB["job_counter"] += 1
-    new_job["jobId"] = f"job_{DB['job_counter']}"
-    DB["jobs"].append(new_job)
+    new_job["jobId"] = next_job_id()
+    enqueue_job(new_job)
     
     print(f"✅ Created job {new_job['jobId']} - Biz: {new_job['biz']}, Shelf: {new_job['shelf_id']}, Lot: {new_job['lot_no']}")
     
     # Job creation logged locally only
     print(f"📋 Job created: {new_job['jobId']} - {new_job['lot_no']} (Biz: {new_job['biz']}, Shelf: {new_job['shelf_id']})")
     
-    await manager.broadcast(json.dumps({"type": "new_job", "payload": new_job}))
+    await manager.broadcast({"type": "new_job", "payload": new_job})
     return {"status": "success", "job_data": new_job}
 
 @router.post("/command/{job_id}/complete", tags=["Jobs"])
@@ -1015,56 +1183,34 @@ async def complete_job(job_id: str):
         remove_lot_from_position(level, block, lot_no)
         action = "picked"
     
-    # ส่งข้อมูล ShelfComplete ไปยัง Gateway (job มีข้อมูล biz และ shelf_id แล้ว)
-    gateway_success = await send_shelf_complete_to_gateway(job)
-    
     print(f"📋 Job {job_id} completed - Biz: {biz}, Shelf: {shelf_id}, Lot: {lot_no}, Action: {action}")
     
-    # Job completion logged locally (Gateway data sent via send_shelf_complete_to_gateway)
-    print(f"✅ Job completed: {job_id} - {lot_no} ({action}) - Gateway: {'✅' if gateway_success else '❌'}")
+    # ส่งข้อมูลไป Gateway ผ่าน outbox (ไม่รอ Gateway - worker ส่งตามลำดับและ retry เอง)
+    # 1) ShelfComplete (job มีข้อมูล biz และ shelf_id แล้ว)
+    # 2) auto-sync shelf state - รวมหลาย completion เป็น sync เดียวต่อ window (sync scheduler)
+    outbox.enqueue("shelf_complete", {"job": job})
+    shelf_sync_scheduler.notify()
     
-    # 🔽 AUTO-SYNC SHELF STATE TO GATEWAY AFTER JOB COMPLETION 🔽
-    try:
-        # สร้าง current shelf_state สำหรับส่งไป Gateway
-        current_shelf_state = {}
-        for cell in DB["shelf_state"]:
-            l, b, lots = cell
-            position_key = f"L{l}B{b}"
-            current_shelf_state[position_key] = {
-                "level": l,
-                "block": b, 
-                "lots": lots,
-                "total_trays": sum(lot.get("tray_count", 1) for lot in lots) if lots else 0
-            }
-        
-        # ส่งไป Gateway
-        sync_success = await sync_shelf_state_to_gateway(current_shelf_state)
-        print(f"📡 Shelf state auto-sync after job completion: {'✅' if sync_success else '❌'}")
-        
-    except Exception as e:
-        print(f"⚠️ Auto-sync shelf state failed: {e}")
-        # ไม่ให้ error นี้ขัดขวางการทำงานหลัก
+    print(f"✅ Job completed: {job_id} - {lot_no} ({action}) - Gateway: 📮 queued")
     
     # ลบงานออกจากคิว
-    DB["jobs"] = [j for j in DB["jobs"] if j.get("jobId") != job_id]
+    complete_job_entry(job_id)
     
-    # Broadcast shelf_state as lots per cell
-    shelf_state = []
-    for cell in DB["shelf_state"]:
-        l, b, lots = cell
-        shelf_state.append({"level": l, "block": b, "lots": lots})
-    await manager.broadcast(json.dumps({
-        "type": "job_completed",
-        "payload": {
-            "completedJobId": job_id,
-            "shelf_state": shelf_state,
-            "lot_no": lot_no,
-            "biz": biz,
-            "shelf_id": shelf_id,
-            "action": action,
-            "gateway_success": gateway_success
-        }
-    }))
+    # cell ที่เปลี่ยนถูกส่งเป็น cell_updated ก่อน event นี้อยู่แล้ว (ConnectionManager)
+    completed_payload = {
+        "completedJobId": job_id,
+        "lot_no": lot_no,
+        "biz": biz,
+        "shelf_id": shelf_id,
+        "level": level,
+        "block": block,
+        "action": action,
+        "gateway_queued": True
+    }
+    if WS_FULL_STATE_EVENTS:
+        # Broadcast shelf_state as lots per cell (client รุ่นเก่า)
+        completed_payload["shelf_state"] = [{"level": l, "block": b, "lots": lots} for l, b, lots in DB["shelf_state"]]
+    await manager.broadcast({"type": "job_completed", "payload": completed_payload})
     return {
         "status": "success",
         "lot_no": lot_no,
@@ -1078,29 +1224,80 @@ async def error_job(job_id: str, body: ErrorRequest):
     job = get_job_by_id(job_id)
     if not job: return {"status": "error", "message": "Job not found"}
         
-    job["trn_status"] = "2"
-    job["error"] = True
-    job["errorLocation"] = body.errorLocation
+    update_job(job_id, {
+        "trn_status": "2",
+        "error": True,
+        "errorLocation": body.errorLocation
+    })
     
     # Job error logged locally only
     print(f"❌ Job error: {job_id} - {job['lot_no']} at {body.errorLocation}")
     
-    await manager.broadcast(json.dumps({"type": "job_error", "payload": job}))
+    await manager.broadcast({"type": "job_error", "payload": job})
     return {"status": "success"}
 
 @router.post("/api/system/reset", tags=["System"])
 async def reset_system():
     print("API: Received 'System Reset'")
-    DB["jobs"] = []
-    # Reset shelf_state to empty stacked lots
-    DB["shelf_state"] = []
-    for level, num_blocks in SHELF_CONFIG.items():
-        for block in range(1, num_blocks + 1):
-            DB["shelf_state"].append([level, block, []])
-    DB["job_counter"] = 0
-    await manager.broadcast(json.dumps({"type": "system_reset"}))
+    # Reset job queue and shelf_state to empty stacked lots
+    reset_db()
+    await manager.broadcast({"type": "system_reset"})
     return {"status": "success"}
 
+@router.get("/api/system/storage", tags=["System"])
+def get_storage_status_api():
+    """สถานะ storage backend ในเครื่อง (engine, journal / SQLite stats) + สถานะการบูตจาก cache / Gateway reconcile"""
+    from core.database import get_storage_status
+    return {"status": "success", "storage": get_storage_status(), "startup": STARTUP_STATUS}
+
+@router.get("/api/system/outbox", tags=["System"])
+def get_outbox_status_api():
+    """สถานะ outbox ของข้อความที่รอส่งไป Gateway (pending, retry, errors) + version / scheduler ของ shelf sync"""
+    from core.database import get_shelf_sync_status
+    return {
+        "status": "success",
+        "outbox": outbox.get_status(),
+        "shelf_sync": {**get_shelf_sync_status(), "delta_sync": get_delta_sync_status()},
+        "sync_scheduler": shelf_sync_scheduler.get_status()
+    }
+
+@router.delete("/api/system/outbox/head", tags=["System"])
+def drop_outbox_head_api(seq: int = None):
+    """
+    ทิ้งข้อความหัวคิว outbox ที่ค้าง (ย้ายไป data/outbox/dead/) เพื่อให้ข้อความถัดไปส่งได้
+    seq: ระบุ head_seq จาก GET /api/system/outbox เพื่อกันทิ้งผิดตัว
+    """
+    dropped = outbox.drop_head(seq)
+    if dropped is None:
+        status = outbox.get_status()
+        return JSONResponse(status_code=404 if not status["pending"] else 409, content={
+            "error": "Nothing dropped",
+            "message": "Outbox is empty" if not status["pending"] else f"Head is #{status['head_seq']}, not #{seq}"
+        })
+    return {"status": "success", "dropped": dropped, "outbox": outbox.get_status()}
+
+@router.get("/api/system/websockets", tags=["System"])
+def get_websocket_status_api():
+    """สถานะ WebSocket clients (queue ที่ค้าง และ lag ต่อ client) + encoder ที่ใช้"""
+    from core.encoding import get_encoder_info
+    return {"status": "success", "websockets": manager.get_status(), "encoding": get_encoder_info()}
+
+@router.get("/api/system/led", tags=["System"])
+def get_led_status_api():
+    """สถานะ LED framebuffer + render thread (frames ที่ push, requests ที่ถูกรวม, เวลา push)"""
+    from core.led_controller import get_led_status
+    return {"status": "success", "led": get_led_status()}
+
+@router.get("/api/history/jobs", tags=["System"])
+def get_job_history_api(lot_no: str = None, job_id: str = None, limit: int = 100):
+    """
+    ประวัติ jobs (created / completed / canceled / updated) สำหรับ audit
+    กรองด้วย lot_no หรือ job_id ได้ (ใหม่สุดก่อน)
+    """
+    from core.database import get_job_history
+    history = get_job_history(lot_no=lot_no, job_id=job_id, limit=max(1, min(limit, 1000)))
+    return {"status": "success", "count": len(history), "history": history}
+
 @router.post("/clearCommand", tags=["Gateway Operations"])
 async def clear_command_from_gateway(request: Request):
     """
@@ -1138,11 +1335,8 @@ async def clear_command_from_gateway(request: Request):
             )
         
         # ค้นหางานที่ต้องการยกเลิก
-        job_to_cancel = None
-        for job in DB["jobs"]:
-            if job.get("lot_no") == lot_no:
-                job_to_cancel = job
-                break
+        lot_jobs = get_job_queue().find_by_lot(lot_no)
+        job_to_cancel = lot_jobs[0] if lot_jobs else None
         
         if not job_to_cancel:
             # ไม่พบงานในคิว - อาจจะเสร็จแล้วหรือไม่มี
@@ -1157,7 +1351,7 @@ async def clear_command_from_gateway(request: Request):
             )
         
         # ลบงานออกจากคิว
-        DB["jobs"] = [job for job in DB["jobs"] if job.get("lot_no") != lot_no]
+        cancel_jobs_by_lot(lot_no)
         
         # ล้าง LED สำหรับตำแหน่งนั้น (ถ้ามีการระบุ level, block)
         if level and block:
@@ -1185,7 +1379,7 @@ async def clear_command_from_gateway(request: Request):
         }
         
         print(f"📡 Broadcasting job_canceled: {broadcast_message}")
-        await manager.broadcast(json.dumps(broadcast_message))
+        await manager.broadcast(broadcast_message)
         
         return {
             "status": "success",
@@ -1271,102 +1465,103 @@ async def get_pending_jobs_from_gateway():
             
             # ดึง shelf_id จาก Gateway ก่อน
             local_ip = get_actual_local_ip()
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.post(
-                    'http://43.72.20.238:8000/IoTManagement/shelf/requestID',
-                    headers={
-                        'Accept': 'application/json',
-                        'Content-Type': 'application/json',
-                    },
-                    json={"shelf_ip": local_ip}
-                )
+            client = get_gateway_client()
+            response = await client.post(
+                f'{GATEWAY_BASE_URL}/IoTManagement/shelf/requestID',
+                timeout=gateway_timeout("request_id"),
+                headers={
+                    'Accept': 'application/json',
+                    'Content-Type': 'application/json',
+                },
+                json={"shelf_ip": local_ip}
+            )
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    shelf_id = data.get("shelf_id")
+            if response.status_code == 200:
+                data = response.json()
+                shelf_id = data.get("shelf_id")
                     
-                    # อัพเดท global
-                    GLOBAL_SHELF_INFO["shelf_id"] = shelf_id
-                    GLOBAL_SHELF_INFO["local_ip"] = local_ip
+                # อัพเดท global
+                GLOBAL_SHELF_INFO["shelf_id"] = shelf_id
+                GLOBAL_SHELF_INFO["local_ip"] = local_ip
                     
-                    print(f"✅ Got shelf_id: {shelf_id}")
-                else:
-                    return JSONResponse(
-                        status_code=502,
-                        content={
-                            "error": "Cannot get shelf_id from Gateway",
-                            "status": "gateway_error",
-                            "message": f"Gateway returned {response.status_code}"
-                        }
-                    )
+                print(f"✅ Got shelf_id: {shelf_id}")
+            else:
+                return JSONResponse(
+                    status_code=502,
+                    content={
+                        "error": "Cannot get shelf_id from Gateway",
+                        "status": "gateway_error",
+                        "message": f"Gateway returned {response.status_code}"
+                    }
+                )
         
         # ขั้นตอนที่ 2: ดึงงานที่ค้างอยู่จาก Gateway
         pending_url = f"{GATEWAY_BASE_URL}/IoTManagement/shelf/pending/{shelf_id}"
         print(f"🔄 Fetching pending jobs from: {pending_url}")
         
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(
-                pending_url,
-                headers={'Accept': 'application/json'}
-            )
+        client = get_gateway_client()
+        response = await client.get(
+            pending_url,
+            timeout=gateway_timeout("pending"),
+            headers={'Accept': 'application/json'}
+        )
             
-            if response.status_code == 200:
-                pending_data = response.json()
-                print(f"📦 Gateway pending response: {pending_data}")
+        if response.status_code == 200:
+            pending_data = response.json()
+            print(f"📦 Gateway pending response: {pending_data}")
                 
-                if pending_data.get("status") == "success" and "data" in pending_data:
-                    jobs_data = pending_data["data"]
+            if pending_data.get("status") == "success" and "data" in pending_data:
+                jobs_data = pending_data["data"]
                     
-                    # แปลงข้อมูลเป็น format ที่ใช้ใน Smart Shelf
-                    converted_jobs = []
-                    for gateway_job in jobs_data:
-                        # สร้าง jobId ใหม่ด้วย job_counter ของ local
-                        DB["job_counter"] += 1
-                        local_job_id = f"job_{DB['job_counter']}"
+                # แปลงข้อมูลเป็น format ที่ใช้ใน Smart Shelf
+                converted_jobs = []
+                for gateway_job in jobs_data:
+                    # สร้าง jobId ใหม่ด้วย job_counter ของ local
+                    local_job_id = next_job_id()
                         
-                        converted_job = {
-                            "jobId": local_job_id,  # ใช้ local job_counter สร้าง jobId ใหม่
-                            "lot_no": gateway_job.get("lot_no"),
-                            "level": gateway_job.get("level"),
-                            "block": gateway_job.get("block"),
-                            "place_flg": gateway_job.get("place_flg"),
-                            "tray_count": int(gateway_job.get("tray_count") or 1) + 1,  # แปลงเป็น int ก่อน + covertray
-                            "status": gateway_job.get("status"),
-                            "biz": gateway_job.get("biz", "Unknown"),
-                            "shelf_id": shelf_id,
-                            "create_date": gateway_job.get("create_date"),
-                            "source": "gateway_recovery",
-                            "gateway_job_id": gateway_job.get("job_id")  # เก็บ original job_id ไว้สำหรับส่งกลับ Gateway
-                        }
-                        converted_jobs.append(converted_job)
-                    
-                    print(f"✅ Converted {len(converted_jobs)} pending jobs")
-                    
-                    return {
-                        "status": "success",
-                        "shelf_id": shelf_id,
-                        "total_pending": len(converted_jobs),
-                        "jobs": converted_jobs,
-                        "message": f"Found {len(converted_jobs)} pending jobs for shelf {shelf_id}"
-                    }
-                else:
-                    return {
-                        "status": "success",
+                    converted_job = {
+                        "jobId": local_job_id,  # ใช้ local job_counter สร้าง jobId ใหม่
+                        "lot_no": gateway_job.get("lot_no"),
+                        "level": gateway_job.get("level"),
+                        "block": gateway_job.get("block"),
+                        "place_flg": gateway_job.get("place_flg"),
+                        "tray_count": int(gateway_job.get("tray_count") or 1) + 1,  # แปลงเป็น int ก่อน + covertray
+                        "status": gateway_job.get("status"),
+                        "biz": gateway_job.get("biz", "Unknown"),
                         "shelf_id": shelf_id,
-                        "total_pending": 0,
-                        "jobs": [],
-                        "message": f"No pending jobs found for shelf {shelf_id}"
+                        "create_date": gateway_job.get("create_date"),
+                        "source": "gateway_recovery",
+                        "gateway_job_id": gateway_job.get("job_id")  # เก็บ original job_id ไว้สำหรับส่งกลับ Gateway
                     }
+                    converted_jobs.append(converted_job)
+                    
+                print(f"✅ Converted {len(converted_jobs)} pending jobs")
+                    
+                return {
+                    "status": "success",
+                    "shelf_id": shelf_id,
+                    "total_pending": len(converted_jobs),
+                    "jobs": converted_jobs,
+                    "message": f"Found {len(converted_jobs)} pending jobs for shelf {shelf_id}"
+                }
             else:
-                return JSONResponse(
-                    status_code=502,
-                    content={
-                        "error": "Gateway pending jobs request failed",
-                        "status": "gateway_error",
-                        "message": f"Gateway returned {response.status_code}",
-                        "detail": response.text
-                    }
-                )
+                return {
+                    "status": "success",
+                    "shelf_id": shelf_id,
+                    "total_pending": 0,
+                    "jobs": [],
+                    "message": f"No pending jobs found for shelf {shelf_id}"
+                }
+        else:
+            return JSONResponse(
+                status_code=502,
+                content={
+                    "error": "Gateway pending jobs request failed",
+                    "status": "gateway_error",
+                    "message": f"Gateway returned {response.status_code}",
+                    "detail": response.text
+                }
+            )
                 
     except httpx.TimeoutException:
         return JSONResponse(
@@ -1446,38 +1641,34 @@ async def load_pending_jobs_into_queue():
         # เพิ่มงานเข้า local queue (ข้ามงานซ้ำ)
         loaded_count = 0
         skipped_count = 0
+        loaded_jobs = []
+        queue = get_job_queue()
         
         for pending_job in pending_jobs:
             # ตรวจสอบงานซ้ำ (lot_no, level, block) เท่านั้น ไม่สนใจ gateway_job_id
+            # ใช้ lot_no index ของคิว ไม่ต้องวนทั้งคิวทุกงาน
             job_exists = any(
-                job["lot_no"] == pending_job["lot_no"] and
                 str(job["level"]) == str(pending_job["level"]) and
                 str(job["block"]) == str(pending_job["block"])
-                for job in DB["jobs"]
+                for job in queue.find_by_lot(pending_job["lot_no"])
             )
             
             if not job_exists:
                 # เพิ่มงานใหม่เข้า queue
-                DB["jobs"].append(pending_job)
+                enqueue_job(pending_job)
+                loaded_jobs.append(pending_job)
                 loaded_count += 1
                 print(f"✅ Loaded pending job: {pending_job['jobId']} - {pending_job['lot_no']} (L{pending_job['level']}B{pending_job['block']})")
             else:
                 skipped_count += 1
                 print(f"⚠️ Skipped duplicate job: {pending_job['jobId']} - {pending_job['lot_no']} (L{pending_job['level']}B{pending_job['block']})")
         
-        # Broadcast ไปยัง WebSocket clients
-        if loaded_count > 0:
-            for job in pending_jobs[-loaded_count:]:  # ส่งเฉพาะงานที่เพิ่มจริง
-                if not any(
-                    existing_job["lot_no"] == job["lot_no"] and
-                    str(existing_job["level"]) == str(job["level"]) and
-                    str(existing_job["block"]) == str(job["block"])
-                    for existing_job in DB["jobs"][:-loaded_count]  # ไม่นับงานที่เพิ่มใหม่
-                ):
-                    await manager.broadcast(json.dumps({
-                        "type": "new_job", 
-                        "payload": job
-                    }))
+        # Broadcast ไปยัง WebSocket clients (ส่งเฉพาะงานที่เพิ่มจริง)
+        for job in loaded_jobs:
+            await manager.broadcast({
+                "type": "new_job", 
+                "payload": job
+            })
         
         return {
             "status": "success",
@@ -1541,17 +1732,18 @@ async def manage_shelf_layout(layout_request: LayoutRequest):
                 
                 if update_success:
                     print(f"✅ Local database updated with Gateway layout")
+                    refresh_layout_hardware()
                     
                     # Broadcast layout update to WebSocket clients  
                     try:
-                        await manager.broadcast(json.dumps({
+                        await manager.broadcast({
                             "type": "layout_updated",
                             "payload": {
                                 "shelf_id": shelf_id,
                                 "layout": gateway_layout,
                                 "source": "gateway_fetch"
                             }
-                        }))
+                        })
                         print(f"📡 Broadcasted layout update to WebSocket clients")
                     except Exception as broadcast_error:
                         print(f"⚠️ WebSocket broadcast failed: {broadcast_error}")
@@ -1619,42 +1811,44 @@ async def get_shelf_info_endpoint():
         print(f"🌐 Local IP: {local_ip}")
         
         # เรียก Gateway API
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.post(
-                'http://43.72.20.238:8000/IoTManagement/shelf/requestID',
-                headers={
-                    'Accept': 'application/json',
-                    'Content-Type': 'application/json',
-                },
-                json={
-                    "shelf_ip": local_ip  # ใช้ local IP จริง
-                }
-            )
+        client = get_gateway_client()
+        response = await client.post(
+            f'{GATEWAY_BASE_URL}/IoTManagement/shelf/requestID',
+            timeout=gateway_timeout("request_id"),
+            headers={
+                'Accept': 'application/json',
+                'Content-Type': 'application/json',
+            },
+            json={
+                "shelf_ip": local_ip  # ใช้ local IP จริง
+            }
+        )
             
-            if response.status_code == 200:
-                data = response.json()
-                print(f"✅ Gateway Response: {data}")
+        if response.status_code == 200:
+            data = response.json()
+            print(f"✅ Gateway Response: {data}")
                 
-                # เก็บข้อมูลใน global variable
-                GLOBAL_SHELF_INFO["shelf_id"] = data.get("shelf_id")
-                GLOBAL_SHELF_INFO["local_ip"] = local_ip
+            # เก็บข้อมูลใน global variable
+            GLOBAL_SHELF_INFO["shelf_id"] = data.get("shelf_id")
+            GLOBAL_SHELF_INFO["local_ip"] = local_ip
+            save_cached_shelf_info()
                 
-                print(f"💾 Stored global shelf info: {GLOBAL_SHELF_INFO}")
+            print(f"💾 Stored global shelf info: {GLOBAL_SHELF_INFO}")
                 
-                return {
-                    "success": True,
-                    "shelf_id": data.get("shelf_id"),
-                    "local_ip": local_ip
-                }
-            else:
-                print(f"❌ Gateway Error: {response.status_code}")
-                # ใช้ค่า fallback แต่ไม่เก็บใน global
-                return {
-                    "success": False,
-                    "error": f"Gateway returned {response.status_code}",
-                    "shelf_id": "UNKNOWN",
-                    "local_ip": local_ip
-                }
+            return {
+                "success": True,
+                "shelf_id": data.get("shelf_id"),
+                "local_ip": local_ip
+            }
+        else:
+            print(f"❌ Gateway Error: {response.status_code}")
+            # ใช้ค่า fallback แต่ไม่เก็บใน global
+            return {
+                "success": False,
+                "error": f"Gateway returned {response.status_code}",
+                "shelf_id": "UNKNOWN",
+                "local_ip": local_ip
+            }
                 
     except Exception as e:
         print(f"Error calling Gateway: {e}")
@@ -1667,61 +1861,100 @@ async def get_shelf_info_endpoint():
 
 # === Shelf State Management Functions ===
 
-async def sync_shelf_state_to_gateway(shelf_state_data):
+def _is_version_mismatch(response) -> bool:
+    """Gateway แจ้งว่า base_version ไม่ตรงกับที่มันมี (409 หรือ status: version_mismatch)"""
+    if response.status_code == 409:
+        return True
+    try:
+        body = response.json()
+    except ValueError:
+        return False
+    return isinstance(body, dict) and (body.get("version_mismatch") is True or body.get("status") == "version_mismatch")
+
+async def sync_shelf_delta_to_gateway():
     """
-    ส่ง shelf_state ไปยัง Gateway เพื่อบันทึกสถานะปัจจุบัน
+    ส่งเฉพาะ cells ที่เปลี่ยนไป Gateway พร้อม version
+    - ยังไม่เคย sync / reset / layout เปลี่ยน -> ส่งทั้ง shelf (sync_mode: full)
+    - Gateway แจ้ง version mismatch -> full resync ทันที
+    - Gateway ยังไม่ยืนยันว่ารองรับ delta (core/gateway.py) -> full ทุกครั้ง
     """
-    try:
-        shelf_id = GLOBAL_SHELF_INFO.get("shelf_id", "UNKNOWN")
-        
-        # แปลงเป็น array format สำหรับ Gateway
-        shelf_state_array = []
-        if isinstance(shelf_state_data, dict):
-            # แปลงจาก dict เป็น array
-            for position_key, position_data in shelf_state_data.items():
-                shelf_state_array.append({
-                    "level": position_data["level"],
-                    "block": position_data["block"], 
-                    "lots": position_data["lots"]
-                })
-        else:
-            # ถ้าเป็น array อยู่แล้ว
-            shelf_state_array = shelf_state_data
-        
-        gateway_payload = {
-            "shelf_id": shelf_id,
-            "update_flg": "1",  # เปลี่ยนจาก update เป็น update_flg
-            "shelf_state": shelf_state_array
-        }
-        
-        headers = {
-            "Accept": "application/json", 
-            "Content-Type": "application/json"
-        }
-        
-        print(f"🔄 Syncing shelf state to Gateway: {GATEWAY_BASE_URL}/IoTManagement/shelf/shelfItem")
-        print(f"📦 Payload: {gateway_payload}")
-        
-        async with httpx.AsyncClient(timeout=10.0) as client:
+    from core.database import build_shelf_delta, ack_shelf_delta, request_full_resync
+
+    if not delta_sync_enabled():
+        request_full_resync()
+
+    for attempt in range(2):
+        delta = build_shelf_delta()
+        if delta is None:
+            return True  # Gateway เป็นปัจจุบันแล้ว
+
+        try:
+            gateway_payload = {
+                "shelf_id": GLOBAL_SHELF_INFO.get("shelf_id", "UNKNOWN"),
+                "update_flg": "1",
+                "sync_mode": delta["mode"],
+                "base_version": delta["base_version"],
+                "version": delta["version"],
+                "shelf_state": delta["cells"]
+            }
+            print(f"🔄 Syncing shelf state ({delta['mode']}, v{delta['base_version']}→v{delta['version']}, "
+                  f"{len(delta['cells'])} cells) to Gateway")
+
+            client = get_gateway_client()
             response = await client.post(
                 f"{GATEWAY_BASE_URL}/IoTManagement/shelf/shelfItem",
+                timeout=gateway_timeout("shelf_item"),
                 json=gateway_payload,
-                headers=headers
+                headers={"Accept": "application/json", "Content-Type": "application/json"}
             )
-            
-            print(f"📡 Gateway Response Status: {response.status_code}")
-            
-            if response.status_code == 200:
-                print(f"✅ Shelf state synced successfully")
-                return True
-            else:
-                print(f"⚠️ Gateway sync failed: {response.status_code} - {response.text}")
-                return False
-                
-    except Exception as e:
-        print(f"⚠️ Shelf state sync error: {e}")
+        except Exception as e:
+            print(f"⚠️ Shelf state sync error: {e}")
+            return False
+
+        if delta["mode"] == "delta" and _is_version_mismatch(response):
+            print(f"⚠️ Gateway version mismatch at v{delta['base_version']} - full resync")
+            request_full_resync()
+            continue
+
+        if response.status_code == 200:
+            note_shelf_sync_response(response)
+            ack_shelf_delta(delta)
+            print(f"✅ Shelf state synced ({delta['mode']}, v{delta['version']})")
+            return True
+
+        if is_permanent_http_failure(response.status_code):
+            # dirty cells ยังอยู่ - sync ครั้งถัดไปส่งใหม่ แต่ข้อความนี้ไม่ควรขวางคิว outbox
+            raise PermanentDeliveryError(f"Gateway rejected shelf state sync: {response.status_code} - {response.text[:200]}")
+        print(f"⚠️ Gateway sync failed: {response.status_code} - {response.text}")
         return False
 
+    return False
+
+# === Outbox Handlers (ส่งข้อความไป Gateway แบบ background ตามลำดับ) ===
+
+async def deliver_shelf_complete(payload: dict):
+    """Outbox handler: ShelfComplete ของ job ที่ทำเสร็จแล้ว"""
+    job = payload["job"]
+    if not job.get("biz"):
+        # ไม่มี biz -> Gateway ไม่มีทางรับได้ ไม่ต้อง retry (ไม่ให้ค้างหัวคิว)
+        print(f"⚠️ Outbox: skip ShelfComplete for {job.get('jobId', 'unknown')} (missing biz)")
+        return True
+    return await send_shelf_complete_to_gateway(job)
+
+async def deliver_shelf_state_sync(payload: dict):
+    """Outbox handler: sync cells ที่เปลี่ยนตั้งแต่ sync ล่าสุด (สร้าง ณ เวลาที่ส่ง)"""
+    sync_success = await sync_shelf_delta_to_gateway()
+    print(f"📡 Shelf state auto-sync: {'✅' if sync_success else '❌'}")
+    return sync_success
+
+def schedule_shelf_state_sync():
+    """Sync scheduler flush: ส่ง shelf state sync 1 ข้อความต่อ window ผ่าน outbox (ต่อคิวหลัง ShelfComplete)"""
+    outbox.enqueue("shelf_state_sync")
+
+outbox.register_handler("shelf_complete", deliver_shelf_complete)
+outbox.register_handler("shelf_state_sync", deliver_shelf_state_sync)
+shelf_sync_scheduler.set_flush_handler(schedule_shelf_state_sync)
+
 async def restore_shelf_state_from_gateway():
     """
     กู้คืน shelf_state จาก Gateway เมื่อเริ่มต้นระบบ
@@ -1747,27 +1980,28 @@ async def restore_shelf_state_from_gateway():
         print(f"🔄 Restoring shelf state from Gateway: {GATEWAY_BASE_URL}/IoTManagement/shelf/shelfItem")
         print(f"📦 Read Payload: {gateway_payload}")
         
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.post(
-                f"{GATEWAY_BASE_URL}/IoTManagement/shelf/shelfItem",
-                json=gateway_payload,
-                headers=headers
-            )
+        client = get_gateway_client()
+        response = await client.post(
+            f"{GATEWAY_BASE_URL}/IoTManagement/shelf/shelfItem",
+            timeout=gateway_timeout("shelf_item"),
+            json=gateway_payload,
+            headers=headers
+        )
             
-            print(f"📡 Gateway Response Status: {response.status_code}")
+        print(f"📡 Gateway Response Status: {response.status_code}")
             
-            if response.status_code == 200:
-                response_data = response.json()
-                print(f"✅ Shelf state restored successfully")
-                #print(f"📦 Restored state: {response_data}")
+        if response.status_code == 200:
+            response_data = response.json()
+            print(f"✅ Shelf state restored successfully")
+            #print(f"📦 Restored state: {response_data}")
                 
         
-                shelf_state = response_data.get("data", [])
+            shelf_state = response_data.get("data", [])
                 
-                return shelf_state
-            else:
-                print(f"⚠️ Gateway restore failed: {response.status_code} - {response.text}")
-                return None
+            return shelf_state
+        else:
+            print(f"⚠️ Gateway restore failed: {response.status_code} - {response.text}")
+            return None
                 
     except Exception as e:
         print(f"⚠️ Shelf state restore error: {e}")
@@ -1818,41 +2052,21 @@ async def manage_shelf_state(shelf_state_request: ShelfState):
             
             if restored_state is not None and len(restored_state) > 0:
                 # อัปเดต local database ด้วยข้อมูลที่กู้คืนได้
-                # แปลงจาก Gateway array format เป็น local DB format
-                DB["shelf_state"] = []
-                for level, num_blocks in SHELF_CONFIG.items():
-                    for block in range(1, num_blocks + 1):
-                        DB["shelf_state"].append([level, block, []])
-                
-                # อัปเดตด้วยข้อมูลจาก Gateway
+                # แปลงจาก Gateway array format เป็น {(level, block): lots}
+                # เขียนเฉพาะ cells ที่ต่างจาก local (cell_updated ไป WebSocket clients อัตโนมัติ)
+                restored_cells = {}
                 for cell_data in restored_state:
-                    level = cell_data.get("level")
-                    block = cell_data.get("block") 
-                    lots = cell_data.get("lots", [])
-                    
-                    # หา cell ที่ตรงกันใน DB
-                    for i, (l, b, existing_lots) in enumerate(DB["shelf_state"]):
-                        if l == level and b == block:
-                            DB["shelf_state"][i] = [level, block, lots]
-                            break
+                    restored_cells[(cell_data.get("level"), cell_data.get("block"))] = cell_data.get("lots", [])
+                changed_count = replace_shelf_lots(restored_cells)
                 
-                print(f"✅ Local DB updated with restored state")
+                print(f"✅ Local DB updated with restored state ({changed_count} cells changed)")
                 
                 # Broadcast restored state to WebSocket clients
                 try:
-                    websocket_shelf_state = []
-                    for cell in DB["shelf_state"]:
-                        level, block, lots = cell
-                        websocket_shelf_state.append({"level": level, "block": block, "lots": lots})
-                    
-                    await manager.broadcast(json.dumps({
-                        "type": "shelf_state_restored",
-                        "payload": {
-                            "shelf_state": websocket_shelf_state,
-                            "shelf_id": shelf_id,
-                            "source": "gateway_restore"
-                        }
-                    }))
+                    restored_payload = {"shelf_id": shelf_id, "source": "gateway_restore", "changed_cells": changed_count}
+                    if WS_FULL_STATE_EVENTS:
+                        restored_payload["shelf_state"] = [{"level": level, "block": block, "lots": lots} for level, block, lots in DB["shelf_state"]]
+                    await manager.broadcast({"type": "shelf_state_restored", "payload": restored_payload})
                     print(f"📡 Broadcasted restored shelf state to WebSocket clients")
                 except Exception as broadcast_error:
                     print(f"⚠️ WebSocket broadcast failed: {broadcast_error}")
@@ -1888,43 +2102,7 @@ async def manage_shelf_state(shelf_state_request: ShelfState):
             # Write mode - บันทึกสถานะไป Gateway
             print(f"💾 Writing shelf state to Gateway...")
             
-            # อัปเดต local database ด้วยข้อมูลที่ส่งมา
-            if shelf_state_data and len(shelf_state_data) > 0:
-                # รีเซ็ต shelf_state
-                DB["shelf_state"] = []
-                for level, num_blocks in SHELF_CONFIG.items():
-                    for block in range(1, num_blocks + 1):
-                        DB["shelf_state"].append([level, block, []])
-                
-                # อัปเดตด้วยข้อมูลใหม่ (แปลง Pydantic models เป็น dict)
-                for cell_data in shelf_state_data:
-                    # แปลง BlockState object เป็น dict
-                    if hasattr(cell_data, 'dict'):
-                        cell_dict = cell_data.dict()
-                    else:
-                        cell_dict = cell_data
-                        
-                    level = cell_dict.get("level")
-                    block = cell_dict.get("block")
-                    lots = cell_dict.get("lots", [])
-                    
-                    # แปลง LotData objects เป็น dict ถ้าจำเป็น
-                    lots_dict = []
-                    for lot in lots:
-                        if hasattr(lot, 'dict'):
-                            lots_dict.append(lot.dict())
-                        else:
-                            lots_dict.append(lot)
-                    
-                    # หา cell ที่ตรงกันใน DB
-                    for i, (l, b, existing_lots) in enumerate(DB["shelf_state"]):
-                        if l == level and b == block:
-                            DB["shelf_state"][i] = [level, block, lots_dict]
-                            break
-                
-                print(f"✅ Local DB updated with new state")
-            
-            # ส่งไป Gateway (แปลง Pydantic models เป็น dict format)
+            # อัปเดต local database ด้วยข้อมูลที่ส่งมา (แปลง Pydantic models เป็น dict)
             shelf_state_dict = []
             for block_state in shelf_state_data:
                 if hasattr(block_state, 'dict'):
@@ -1932,36 +2110,41 @@ async def manage_shelf_state(shelf_state_request: ShelfState):
                 else:
                     shelf_state_dict.append(block_state)
             
-            sync_success = await sync_shelf_state_to_gateway(shelf_state_dict)
+            changed_count = 0
+            if shelf_state_dict:
+                # เขียนเฉพาะ cells ที่ต่างจาก local - UI ส่ง state เดิมกลับมาหลังทุก job complete
+                # ถ้าไม่มีอะไรเปลี่ยน จะไม่มี cell_updated และไม่มี sync ไป Gateway
+                new_cells = {}
+                for cell_dict in shelf_state_dict:
+                    new_cells[(cell_dict.get("level"), cell_dict.get("block"))] = cell_dict.get("lots", [])
+                changed_count = replace_shelf_lots(new_cells)
+                
+                print(f"✅ Local DB updated with new state ({changed_count} cells changed)")
+            
+            # ส่งไป Gateway ผ่าน sync scheduler -> outbox เหมือนทุกการเปลี่ยนแปลงอื่น
+            # (sync ทีละครั้งตามลำดับ ไม่ชนกับ worker ของ outbox)
+            if changed_count:
+                shelf_sync_scheduler.notify()
             
             # Broadcast shelf state update to WebSocket clients
-            if sync_success:
+            if changed_count:
                 try:
-                    # แปลง shelf_state เป็น format สำหรับ WebSocket
-                    websocket_shelf_state = []
-                    for cell in DB["shelf_state"]:
-                        level, block, lots = cell
-                        websocket_shelf_state.append({"level": level, "block": block, "lots": lots})
-                    
-                    await manager.broadcast(json.dumps({
-                        "type": "shelf_state_updated",
-                        "payload": {
-                            "shelf_state": websocket_shelf_state,
-                            "shelf_id": shelf_id,
-                            "source": "gateway_sync"
-                        }
-                    }))
+                    updated_payload = {"shelf_id": shelf_id, "source": "gateway_sync", "changed_cells": changed_count}
+                    if WS_FULL_STATE_EVENTS:
+                        updated_payload["shelf_state"] = [{"level": level, "block": block, "lots": lots} for level, block, lots in DB["shelf_state"]]
+                    await manager.broadcast({"type": "shelf_state_updated", "payload": updated_payload})
                     print(f"📡 Broadcasted shelf state update to WebSocket clients")
                 except Exception as broadcast_error:
                     print(f"⚠️ WebSocket broadcast failed: {broadcast_error}")
             
             return {
-                "status": "success" if sync_success else "error",
+                "status": "success",
                 "shelf_id": shelf_id,
                 "update_flg": "1", 
                 "shelf_state": shelf_state_dict,
-                "gateway_sync": sync_success,
-                "message": "Shelf state updated and synced" if sync_success else "Gateway sync failed"
+                "gateway_sync": "queued" if changed_count else "up_to_date",
+                "changed_cells": changed_count,
+                "message": "Shelf state updated, Gateway sync queued" if changed_count else "Shelf state unchanged"
             }
             
         else:
@@ -2079,7 +2262,7 @@ async def handle_button_press(request: Request):
         }
         
         # Broadcast to WebSocket clients (UI will handle the logic)
-        await manager.broadcast(json.dumps(button_event))
+        await manager.broadcast(button_event)
         
         print(f"✅ Button press broadcasted: {position} (Button {button_index})")
         
@@ -2152,21 +2335,20 @@ async def simulate_button_press(button_index: int):
                 }
             )
         
-        if button_index not in [0, 1, 2]:
+        position = button_reader.position_mapping.get(button_index)
+        if position is None:
             return JSONResponse(
                 status_code=400,
                 content={
                     "error": "Invalid button index",
-                    "message": "Button index must be 0, 1, or 2"
+                    "message": f"Button {button_index} is not mapped to a cell "
+                               f"(mapped: {sorted(button_reader.position_mapping)})"
                 }
             )
         
         # Simulate button press
         button_reader.simulate_button_press(button_index)
         
-        # Get position for response
-        position = button_reader.position_mapping.get(button_index, f"L1B{button_index+1}")
-        
         return {
             "status": "success",
             "button_index": button_index,
@@ -2235,7 +2417,6 @@ async def debug_led_mapping():
     """
     try:
         from core.led_controller import idx, clear_all_leds, set_led
-        import time
         
         results = []
         
@@ -2259,7 +2440,7 @@ async def debug_led_mapping():
             result = set_led(level, block, 255, 0, 0)
             results.append(f"   Set result: {result}")
             
-            time.sleep(0.1)  # Brief delay
+            await asyncio.sleep(0.1)  # Brief delay
         
         return {
             "ok": True,
@@ -1,33 +1,452 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from typing import List
+from typing import Dict, List
+from collections import deque
+import asyncio
 import json
+import os
+import time
+import uuid
 
-from core.database import DB, get_job_by_id # <-- เพิ่ม import
+from core.database import DB, get_job_by_id, get_job_queue, get_db_snapshot, get_db_revision, complete_job_entry, update_job, get_cell, get_shelf_version, add_shelf_listener, SHELF_CONFIG # <-- เพิ่ม import
+from core.encoding import EncodedMessage, encode_message, encode_json, encode_msgpack, MSGPACK_AVAILABLE
 
 # --- Connection Manager for WebSockets ---
+# แต่ละ client มี outgoing queue + writer task ของตัวเอง
+# broadcast แค่ใส่ข้อความลงทุก queue (ไม่รอ send) - client ที่ช้า/ค้างไม่ถ่วง client อื่น
+# client ที่ค้างเกิน WS_CLIENT_QUEUE_SIZE ข้อความ หรือ send นานเกิน WS_SEND_TIMEOUT จะถูกปิด
+# (UI reconnect อัตโนมัติและได้ initial_state ใหม่)
+WS_CLIENT_QUEUE_SIZE = 256    # ข้อความที่ค้างได้ต่อ client
+WS_SEND_TIMEOUT = 5.0         # วินาที ต่อ 1 send
+
+# การเปลี่ยนแปลงของ shelf ส่งเป็น cell_updated {level, block, lots, version, prev_version} ทีละ cell
+# client ที่พบ prev_version ไม่ตรงกับ version ของตัวเองส่ง resync_request แล้วได้ initial_state ใหม่
+# SMART_SHELF_WS_FULL_STATE=1: แนบ shelf_state ทั้งหมดใน job_completed / shelf_state_* แบบเดิม (client รุ่นเก่า)
+WS_FULL_STATE_EVENTS = os.environ.get("SMART_SHELF_WS_FULL_STATE", "0") == "1"
+
+# ทุก broadcast มี seq เพิ่มขึ้นเรื่อยๆ และเก็บ WS_REPLAY_BUFFER events ล่าสุดไว้
+# client reconnect ด้วย /ws?since=<seq>&session=<id> จะได้เฉพาะ events ที่พลาดไป
+# (gap เก่ากว่า buffer หรือ server restart -> initial_state ทั้งหมดแบบเดิม)
+WS_REPLAY_BUFFER = 200        # ต้องน้อยกว่า WS_CLIENT_QUEUE_SIZE
+
+# Topic subscriptions: client เลือกรับเฉพาะ event ที่ต้องใช้
+#   /ws?topics=jobs,cells&levels=1,2  หรือส่ง {"type": "subscribe", "payload": {"topics": [...], "levels": [...]}}
+#   {"type": "unsubscribe", "payload": {"topics": [...]}} / levels: null = ทุก level
+# ค่าเริ่มต้น: ทุก topic ทุก level (แบบเดิม) - topic "system" ส่งให้ทุก client เสมอ
+# client ที่กรอง level จะเห็น prev_version ของ cell_updated ไม่ต่อเนื่อง (ไม่ควรใช้ตรวจ version gap)
+WS_TOPICS = ("jobs", "cells", "buttons", "layout")
+
+# Encoding: /ws?encoding=msgpack -> ทุก event ส่งเป็น binary frame (MessagePack) แทน JSON text
+# ค่าเริ่มต้น json; ถ้าไม่ได้ติดตั้ง msgpack จะส่ง JSON text ตามเดิม (client ต้องรองรับทั้ง 2 แบบ)
+# ข้อความจาก client -> server ยังเป็น JSON text เสมอ
+WS_ENCODINGS = ("json", "msgpack")
+EVENT_TOPICS = {
+    "new_job": "jobs",
+    "job_completed": "jobs",
+    "job_error": "jobs",
+    "job_warning": "jobs",
+    "job_canceled": "jobs",
+    "jobs_reloaded": "jobs",
+    "cell_updated": "cells",
+    "shelf_snapshot": "cells",
+    "shelf_state_restored": "cells",
+    "shelf_state_updated": "cells",
+    "button_press": "buttons",
+    "layout_updated": "layout",
+}
+
+def event_topic(event: dict) -> str:
+    return EVENT_TOPICS.get(event.get("type"), "system")
+
+def event_level(event: dict):
+    """level ของ event (สำหรับ per-level filter) หรือ None ถ้า event ไม่ผูกกับ level"""
+    payload = event.get("payload")
+    if isinstance(payload, dict):
+        level = payload.get("level")
+        try:
+            return int(level) if level is not None else None
+        except (TypeError, ValueError):
+            return None
+    return None
+
+class ClientConnection:
+    """WebSocket 1 ตัว + queue ขาออก + writer task"""
+
+    def __init__(self, websocket: WebSocket, client_id: int, encoding: str = "json"):
+        self.websocket = websocket
+        self.client_id = client_id
+        self.encoding = encoding
+        self.queue = asyncio.Queue(maxsize=WS_CLIENT_QUEUE_SIZE)
+        self.enqueued_at = deque()     # monotonic time ของแต่ละข้อความใน queue (ลำดับเดียวกัน)
+        self.writer_task = None
+        self.connected_at = time.time()
+        self.closed = False
+        self.sent = 0
+        self.last_send_ms = None
+        self.max_lag_ms = 0.0
+        self.topics = set(WS_TOPICS)
+        self.levels = None             # None = ทุก level
+        self.filtered = 0
+
+    def wants(self, topic: str, level) -> bool:
+        if topic == "system":
+            return True
+        if topic not in self.topics:
+            return False
+        return self.levels is None or level is None or level in self.levels
+
+    def subscribe(self, topics=None, levels=...):
+        if topics is not None:
+            self.topics |= {topic for topic in topics if topic in WS_TOPICS}
+        if levels is not ...:
+            self.levels = {int(level) for level in levels} if levels is not None else None
+
+    def unsubscribe(self, topics=None, levels=None):
+        if topics is not None:
+            self.topics -= set(topics)
+        if levels is not None:
+            if self.levels is None:
+                # None = ทุกชั้น -> ขยายเป็นชั้นที่มีอยู่ตอนนี้ก่อนค่อยตัดออก
+                self.levels = {int(level) for level in SHELF_CONFIG}
+            self.levels -= {int(level) for level in levels}
+
+    def subscription(self) -> dict:
+        return {"topics": sorted(self.topics), "levels": sorted(self.levels) if self.levels is not None else None}
+
+    def put(self, frame):
+        """ใส่ข้อความลง queue (asyncio.QueueFull ถ้าเต็ม)"""
+        self.queue.put_nowait(frame)
+        self.enqueued_at.append(time.monotonic())
+
+    async def get(self):
+        """(เวลาที่ใส่ queue, ข้อความ) ถัดไป"""
+        frame = await self.queue.get()
+        return self.enqueued_at.popleft(), frame
+
+    def lag_ms(self) -> float:
+        """อายุของข้อความเก่าสุดที่ยังไม่ได้ส่ง"""
+        if not self.enqueued_at:
+            return 0.0
+        return round((time.monotonic() - self.enqueued_at[0]) * 1000, 1)
+
+    def get_status(self) -> dict:
+        client = self.websocket.client
+        return {
+            "client_id": self.client_id,
+            "encoding": self.encoding,
+            "address": f"{client.host}:{client.port}" if client else None,
+            "connected_at": self.connected_at,
+            "queued": self.queue.qsize(),
+            "lag_ms": self.lag_ms(),
+            "max_lag_ms": self.max_lag_ms,
+            "last_send_ms": self.last_send_ms,
+            "sent": self.sent,
+            "filtered": self.filtered,
+            **self.subscription()
+        }
+
+def _as_event(message) -> dict:
+    """dict / str / bytes / EncodedMessage -> event dict (เพื่อใส่ seq)"""
+    if isinstance(message, dict):
+        return message
+    if isinstance(message, EncodedMessage):
+        return message.event if message.event is not None else json.loads(message.text)
+    return json.loads(message)
+
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self.clients: Dict[WebSocket, ClientConnection] = {}
+        self._loop = None
+        self._next_client_id = 0
+        self.stats = {"broadcasts": 0, "slow_clients_closed": 0, "send_errors": 0, "cell_events": 0, "shelf_snapshots": 0,
+                      "resumed": 0, "replayed_events": 0, "snapshot_fallbacks": 0}
+
+        # sequence + replay buffer (session เปลี่ยนทุกครั้งที่ server start - seq เริ่มใหม่)
+        self.session = uuid.uuid4().hex[:12]
+        self._seq = 0
+        self._history = deque(maxlen=WS_REPLAY_BUFFER)   # (seq, EncodedMessage, topic, level)
+        self._initial_state_cache = {"key": None, "message": None}
+
+        # shelf changes ที่ยังไม่ได้ส่ง (ส่งก่อน event ถัดไปเสมอ เพื่อให้ลำดับถูกต้อง)
+        self._pending_cells = {}        # (level, block) -> version
+        self._pending_full = False
+        self._flush_scheduled = False
+        self._shelf_version_sent = get_shelf_version()
 
-    async def connect(self, websocket: WebSocket):
+    @property
+    def active_connections(self) -> List[WebSocket]:
+        return list(self.clients)
+
+    async def connect(self, websocket: WebSocket, since: int = None, session: str = None,
+                      topics: list = None, levels: list = None, encoding: str = "json"):
+        """
+        รับ connection แล้วส่ง state เริ่มต้น
+        - since + session ตรงกับ server และ events ยังอยู่ใน buffer -> replay เฉพาะ events หลัง since
+        - ไม่งั้น -> initial_state
+        - topics / levels: subscription เริ่มต้น (None = ทั้งหมด)
+        - encoding: "json" (text frame) หรือ "msgpack" (binary frame)
+        """
         await websocket.accept()
-        self.active_connections.append(websocket)
+        self._loop = asyncio.get_running_loop()
+        # ส่ง shelf changes ที่ค้างให้ clients เดิมก่อนลงทะเบียน client ใหม่ (จะอยู่ใน state เริ่มต้นแล้ว)
+        self.flush_shelf_changes()
+        self._next_client_id += 1
+        client = ClientConnection(websocket, self._next_client_id, encoding)
+        if topics is not None:
+            client.topics = set()
+            client.subscribe(topics)
+        if levels is not None:
+            client.subscribe(levels=levels)
+        client.writer_task = asyncio.create_task(self._writer(client))
+        self.clients[websocket] = client
+
+        # ไม่มี await จากตรงนี้ - broadcast ใหม่จะต่อคิวหลัง state เริ่มต้นเสมอ
+        replay = self._replay_since(since, session)
+        if replay is None:
+            if since is not None:
+                self.stats["snapshot_fallbacks"] += 1
+            self._enqueue(client, self.initial_state_message())
+            return
+        self.stats["resumed"] += 1
+        self.stats["replayed_events"] += len(replay)
+        self._enqueue(client, encode_message({
+            "type": "resumed",
+            "payload": {"session": self.session, "since": since, "seq": self._seq, "replayed": len(replay),
+                        "shelf_version": get_shelf_version()}
+        }))
+        for message, topic, level in replay:
+            if client.wants(topic, level):
+                self._enqueue(client, message)
+
+    def _replay_since(self, since, session):
+        """events ที่ seq > since หรือ None ถ้าต้องส่ง initial_state แทน"""
+        if since is None or session != self.session or since > self._seq:
+            return None
+        if since == self._seq:
+            return []
+        if not self._history or self._history[0][0] > since + 1:
+            return None   # gap เก่ากว่า buffer
+        return [(message, topic, level) for seq, message, topic, level in self._history if seq > since]
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        client = self.clients.pop(websocket, None)
+        if client is None:
+            return
+        client.closed = True
+        if client.writer_task is not None and client.writer_task is not asyncio.current_task():
+            client.writer_task.cancel()
+
+    async def _close_client(self, client: ClientConnection, code: int, reason: str):
+        self.disconnect(client.websocket)
+        try:
+            await asyncio.wait_for(client.websocket.close(code=code, reason=reason), WS_SEND_TIMEOUT)
+        except Exception:
+            pass
+
+    async def _writer(self, client: ClientConnection):
+        """ส่งข้อความใน queue ของ client ตามลำดับ"""
+        try:
+            while True:
+                enqueued_at, message = await client.get()
+                lag_ms = (time.monotonic() - enqueued_at) * 1000
+                client.max_lag_ms = round(max(client.max_lag_ms, lag_ms), 1)
+                start = time.monotonic()
+                send = client.websocket.send_bytes(message) if isinstance(message, bytes) else client.websocket.send_text(message)
+                try:
+                    await asyncio.wait_for(send, WS_SEND_TIMEOUT)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.stats["send_errors"] += 1
+                    print(f"⚠️ WebSocket client #{client.client_id} send failed, closing: {e or type(e).__name__}")
+                    await self._close_client(client, 1011, "send failed")
+                    return
+                client.sent += 1
+                client.last_send_ms = round((time.monotonic() - start) * 1000, 1)
+        except asyncio.CancelledError:
+            pass
+
+    def _enqueue(self, client: ClientConnection, message: EncodedMessage):
+        if client.closed:
+            return
+        frame = message.packed if client.encoding == "msgpack" else message.text
+        try:
+            client.put(frame)
+        except asyncio.QueueFull:
+            # client ตามไม่ทัน - ปิดไปเลย ดีกว่าส่งข้อมูลที่ขาดหาย
+            self.stats["slow_clients_closed"] += 1
+            print(f"🐢 WebSocket client #{client.client_id} is {WS_CLIENT_QUEUE_SIZE} messages behind, closing")
+            client.closed = True
+            asyncio.create_task(self._close_client(client, 1013, "client too slow"))
+
+    def _deliver(self, message: EncodedMessage, topic: str = "system", level=None):
+        for client in list(self.clients.values()):
+            if client.wants(topic, level):
+                self._enqueue(client, message)
+            else:
+                client.filtered += 1
+
+    def _publish(self, event: dict):
+        """ใส่ seq, encode 1 ครั้งต่อ encoding, เก็บใน replay buffer แล้วส่งทุก client"""
+        self._seq += 1
+        topic, level = event_topic(event), event_level(event)
+        event = {**event, "seq": self._seq}
+        packed = None
+        if any(client.encoding == "msgpack" for client in self.clients.values()):
+            packed = encode_msgpack(event)
+        # ไม่เก็บ event dict ไว้ (lots ใน DB อาจถูกแก้ทีหลัง) - replay แบบ msgpack จะ encode จาก JSON bytes ที่บันทึกไว้
+        message = EncodedMessage(data=encode_json(event), packed=packed)
+        self._history.append((self._seq, message, topic, level))
+        self._deliver(message, topic, level)
+
+    def _fanout(self, event: dict):
+        self.flush_shelf_changes()
+        self.stats["broadcasts"] += 1
+        self._publish(event)
+
+    # --- Shelf delta events ---
+    def note_shelf_change(self, level, block, version: int):
+        """shelf listener (core.database): จำ cell ที่เปลี่ยนไว้ ส่งรวมกันใน loop รอบถัดไป"""
+        if level is None:
+            self._pending_full = True
+            self._pending_cells.clear()
+        elif not self._pending_full:
+            self._pending_cells[(level, block)] = version
+        if not self._flush_scheduled and self._loop is not None:
+            self._flush_scheduled = True
+            self._loop.call_soon_threadsafe(self.flush_shelf_changes)
+
+    def flush_shelf_changes(self):
+        """ส่ง cell_updated (หรือ shelf_snapshot ถ้าทั้ง shelf เปลี่ยน) สำหรับ changes ที่ค้าง"""
+        self._flush_scheduled = False
+        if not self._pending_full and not self._pending_cells:
+            return
+        prev_version = self._shelf_version_sent
+        pending_full, pending_cells = self._pending_full, self._pending_cells
+        self._pending_full, self._pending_cells = False, {}
+        # publish แม้ไม่มี client - event ต้องอยู่ใน replay buffer ให้ client ที่ resume ทีหลังได้รับ
+
+        if pending_full:
+            version = get_shelf_version()
+            self.stats["shelf_snapshots"] += 1
+            self._publish({
+                "type": "shelf_snapshot",
+                "payload": {
+                    "shelf_state": DB["shelf_state"],
+                    "version": version,
+                    "prev_version": prev_version
+                }
+            })
+            self._shelf_version_sent = version
+            return
+
+        for (level, block), version in sorted(pending_cells.items(), key=lambda item: item[1]):
+            cell = get_cell(level, block)
+            self.stats["cell_events"] += 1
+            self._publish({
+                "type": "cell_updated",
+                "payload": {
+                    "level": level,
+                    "block": block,
+                    "lots": cell[2] if cell else [],
+                    "version": version,
+                    "prev_version": prev_version
+                }
+            })
+            prev_version = version
+        self._shelf_version_sent = prev_version
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
+    def update_subscription(self, websocket: WebSocket, action: str, payload: dict) -> dict:
+        """subscribe / unsubscribe ของ client (คืน subscription ปัจจุบัน)"""
+        client = self.clients.get(websocket)
+        if client is None:
+            return {}
+        if action == "subscribe":
+            if "levels" in payload:
+                client.subscribe(payload.get("topics"), payload.get("levels"))
+            else:
+                client.subscribe(payload.get("topics"))
+        else:
+            client.unsubscribe(payload.get("topics"), payload.get("levels"))
+        return client.subscription()
+
+    async def send_to(self, websocket: WebSocket, message):
+        """ส่งข้อความถึง client เดียว (ผ่าน queue เดียวกับ broadcast เพื่อรักษาลำดับ)"""
+        client = self.clients.get(websocket)
+        if client is not None:
+            self._enqueue(client, encode_message(message))
+
+    async def broadcast(self, message):
+        """
+        ใส่ข้อความลง queue ของทุก client (เรียกจาก thread อื่นได้ เช่น hardware button)
+        message: dict (encode ที่นี่ 1 ครั้ง), str หรือ EncodedMessage - ทุก client ได้ str ตัวเดียวกัน
+        """
+        if self._loop is None:
+            return
+        event = _as_event(message)
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self._loop:
+            self._fanout(event)
+        else:
+            self._loop.call_soon_threadsafe(self._fanout, event)
+
+    def initial_state_message(self) -> EncodedMessage:
+        """initial_state (jobs + shelf_state + shelf_version + seq) - ส่ง shelf changes ที่ค้างให้ client อื่นก่อน"""
+        self.flush_shelf_changes()
+        key = (get_db_revision(), self._seq)
+        cache = self._initial_state_cache
+        if cache["key"] != key or cache["message"] is None:
+            payload = {**get_db_snapshot(), "shelf_version": get_shelf_version(), "seq": self._seq, "session": self.session}
+            cache["message"] = encode_message({"type": "initial_state", "payload": payload})
+            cache["key"] = key
+        return cache["message"]
+
+    def get_status(self) -> dict:
+        clients = [client.get_status() for client in self.clients.values()]
+        return {
+            "connections": len(clients),
+            "queue_size": WS_CLIENT_QUEUE_SIZE,
+            "send_timeout_s": WS_SEND_TIMEOUT,
+            "max_lag_ms": max((c["lag_ms"] for c in clients), default=0.0),
+            "session": self.session,
+            "seq": self._seq,
+            "msgpack_available": MSGPACK_AVAILABLE,
+            "replay_buffer": {"size": WS_REPLAY_BUFFER, "events": len(self._history),
+                              "oldest_seq": self._history[0][0] if self._history else None},
+            "clients": clients,
+            **self.stats
+        }
 
 manager = ConnectionManager()
+add_shelf_listener(manager.note_shelf_change)
+
 router = APIRouter() # <-- สร้าง router สำหรับไฟล์นี้
 
 @router.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
-    initial_state = {"type": "initial_state", "payload": DB}
-    await websocket.send_text(json.dumps(initial_state))
+    # /ws?since=<seq>&session=<id> : resume หลัง reconnect (replay เฉพาะ events ที่พลาด)
+    # /ws?topics=jobs,cells&levels=1,2 : subscription เริ่มต้น
+    # /ws?encoding=msgpack : รับ events เป็น binary MessagePack
+    params = websocket.query_params
+    try:
+        since = int(params["since"]) if params.get("since") is not None else None
+    except ValueError:
+        since = None
+    topics = params["topics"].split(",") if params.get("topics") else None
+    try:
+        levels = [int(level) for level in params["levels"].split(",")] if params.get("levels") else None
+    except ValueError:
+        levels = None
+    encoding = (params.get("encoding") or "json").lower()
+    if encoding not in WS_ENCODINGS:
+        encoding = "json"
+    if encoding == "msgpack" and not MSGPACK_AVAILABLE:
+        print("⚠️ WebSocket client requested msgpack but msgpack is not installed, using JSON")
+        encoding = "json"
+    await manager.connect(websocket, since=since, session=params.get("session"), topics=topics, levels=levels,
+                          encoding=encoding)
     try:
         while True:
             data = await websocket.receive_text()
@@ -39,7 +458,20 @@ async def websocket_endpoint(websocket: WebSocket):
                 
                 print(f"📩 WebSocket received: {message_type} with payload: {payload}")
                 
-                if message_type == "complete_job":
+                if message_type in ("subscribe", "unsubscribe"):
+                    try:
+                        subscription = manager.update_subscription(websocket, message_type, payload)
+                    except (TypeError, ValueError) as e:
+                        await manager.send_to(websocket, {"type": "error", "payload": {"message": f"Invalid subscription: {e}"}})
+                        continue
+                    await manager.send_to(websocket, {"type": "subscribed", "payload": subscription})
+                    
+                elif message_type == "resync_request":
+                    # client พบ version gap ใน cell_updated - ส่ง state ทั้งหมดให้ client นี้
+                    print(f"🔁 Resync requested (client version {payload.get('version')}, server {get_shelf_version()})")
+                    await manager.send_to(websocket, manager.initial_state_message())
+                    
+                elif message_type == "complete_job":
                     # จัดการคำสั่ง complete job
                     job_id = payload.get("jobId")
                     lot_no = payload.get("lot_no")
@@ -61,11 +493,11 @@ async def websocket_endpoint(websocket: WebSocket):
                                 "jobId": job_id
                             }
                         }
-                        await websocket.send_text(json.dumps(error_response))
+                        await manager.send_to(websocket, error_response)
                         continue
                         
                     # ตรวจสอบว่า job ยังอยู่ใน queue หรือไม่
-                    if job_id not in [j.get("jobId") for j in DB["jobs"]]:
+                    if job_id not in get_job_queue():
                         print(f"⚠️ Job {job_id} has already been completed or removed from queue")
                         warning_response = {
                             "type": "job_warning",
@@ -76,7 +508,7 @@ async def websocket_endpoint(websocket: WebSocket):
                                 "lot_no": lot_no
                             }
                         }
-                        await websocket.send_text(json.dumps(warning_response))
+                        await manager.send_to(websocket, warning_response)
                         continue
                     
                     has_item = 1 if job["place_flg"] == "1" else 0
@@ -89,9 +521,10 @@ async def websocket_endpoint(websocket: WebSocket):
                     
                     # ลบงานออกจากคิว
                     print(f"🗑️ Removing job {job_id} from queue")
-                    jobs_before = len(DB["jobs"])
-                    DB["jobs"] = [j for j in DB["jobs"] if j.get("jobId") != job_id]
-                    jobs_after = len(DB["jobs"])
+                    queue = get_job_queue()
+                    jobs_before = len(queue)
+                    complete_job_entry(job_id)
+                    jobs_after = len(queue)
                     print(f"📋 Jobs count: {jobs_before} -> {jobs_after}")
                     
                     # ส่งข้อมูลกลับไปยัง clients ทั้งหมด
@@ -99,14 +532,15 @@ async def websocket_endpoint(websocket: WebSocket):
                         "type": "job_completed",
                         "payload": {
                             "completedJobId": job_id,
-                            "shelf_state": DB["shelf_state"],
                             "lot_no": job["lot_no"],
                             "action": "placed" if job["place_flg"] == "1" else "picked",
                             "uuid": client_uuid
                         }
                     }
+                    if WS_FULL_STATE_EVENTS:
+                        response["payload"]["shelf_state"] = DB["shelf_state"]
                     print(f"📤 Broadcasting job_completed message: {response}")
-                    await manager.broadcast(json.dumps(response))
+                    await manager.broadcast(response)
                     print(f"✅ Job {job_id} completed successfully")
                         
                 elif message_type == "job_error":
@@ -117,17 +551,18 @@ async def websocket_endpoint(websocket: WebSocket):
                     
                     print(f"🚨 Processing job error: {job_id} - {error_type}")
                     
-                    job = get_job_by_id(job_id)
+                    job = update_job(job_id, {
+                        "error": True,
+                        "errorType": error_type,
+                        "errorMessage": error_message
+                    })
                     if job:
-                        job["error"] = True
-                        job["errorType"] = error_type
-                        job["errorMessage"] = error_message
                         
                         response = {
                             "type": "job_error",
                             "payload": job
                         }
-                        await manager.broadcast(json.dumps(response))
+                        await manager.broadcast(response)
                         print(f"🚨 Job error broadcasted for {job_id}")
                         
             except json.JSONDecodeError as e:
@@ -141,4 +576,6 @@ async def websocket_endpoint(websocket: WebSocket):
                 traceback.print_exc()
                 
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket)
\ No newline at end of file
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Benchmark: ต้นทุนการ encode ต่อ 1 broadcast ที่ขนาด shelf 24 / 200 / 1000 cells
+
+เปรียบเทียบ
+- json (encode ใหม่ทุก client - แบบเดิม)
+- json / orjson / msgspec (encode ครั้งเดียว ใช้ซ้ำทุก client - core/encoding.py)
+- msgpack (/ws?encoding=msgpack) ถ้าติดตั้งไว้ - ขนาด frame และเวลา encode
+
+Usage: python bench_encoding.py [clients]
+"""
+
+import json
+import sys
+import time
+
+from core.encoding import JSON_ENCODER_NAME, MSGPACK_AVAILABLE, _select_encoder, encode_message, encode_msgpack
+
+CELL_COUNTS = [24, 200, 1000]
+LOTS_PER_CELL = 2
+CLIENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+TARGET_SECONDS = 0.5
+
+
+def build_event(cells: int):
+    """job_completed event ที่มี shelf_state ทั้ง shelf (รูปแบบเดียวกับ /ws)"""
+    blocks_per_level = 8
+    shelf_state = []
+    for i in range(cells):
+        level, block = divmod(i, blocks_per_level)
+        lots = [{"lot_no": f"LOT{i:05d}{n}", "tray_count": n + 1, "biz": "IC"} for n in range(LOTS_PER_CELL)]
+        shelf_state.append([level + 1, block + 1, lots])
+    return {
+        "type": "job_completed",
+        "payload": {
+            "completedJobId": "job_42",
+            "shelf_state": shelf_state,
+            "lot_no": "LOT000001",
+            "action": "placed"
+        }
+    }
+
+
+def measure(fn) -> float:
+    """เวลาเฉลี่ย (ms) ต่อการเรียก fn 1 ครั้ง"""
+    fn()
+    runs = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < TARGET_SECONDS:
+        fn()
+        runs += 1
+    return (time.perf_counter() - start) * 1000 / runs
+
+
+def main():
+    encoders = {}
+    for name in ["json", "orjson", "msgspec"]:
+        selected, encode = _select_encoder(name)
+        if selected == name:
+            encoders[name] = encode
+        else:
+            print(f"⚠️ {name} not installed, skipped")
+    if not MSGPACK_AVAILABLE:
+        print("⚠️ msgpack not installed, skipped")
+
+    print(f"📦 Active encoder: {JSON_ENCODER_NAME}, clients per broadcast: {CLIENTS}\n")
+    print(f"{'cells':>6} {'bytes':>9} {'json x clients':>15} " + " ".join(f"{name + ' once':>13}" for name in encoders)
+          + (f" {'msgpack bytes':>13} {'msgpack once':>13}" if MSGPACK_AVAILABLE else ""))
+
+    for cells in CELL_COUNTS:
+        event = build_event(cells)
+        size = len(encode_message(event))
+
+        def per_client_json():
+            for _ in range(CLIENTS):
+                json.dumps(event)
+
+        row = [f"{cells:>6}", f"{size:>9}", f"{measure(per_client_json):>12.3f} ms"]
+        for encode in encoders.values():
+            row.append(f"{measure(lambda: encode(event).decode('utf-8')):>10.3f} ms")
+        if MSGPACK_AVAILABLE:
+            row.append(f"{len(encode_msgpack(event)):>13}")
+            row.append(f"{measure(lambda: encode_msgpack(event)):>10.3f} ms")
+        print(" ".join(row))
+
+
+if __name__ == "__main__":
+    main()
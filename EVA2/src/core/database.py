@@ -1,3 +1,7 @@
+import time
+
+from core.storage import create_storage
+
 # === Fallback Configuration (ใช้เฉพาะเมื่อ Gateway ไม่พร้อม) ===
 FALLBACK_SHELF_CONFIG = {
     1: 6,  # Level 1: 6 blocks (fallback)
@@ -127,22 +131,24 @@ def update_layout_from_gateway(gateway_layout: dict):
         print(f"   Total positions: {sum(SHELF_CONFIG.values())}")
         
         # อัปเดต shelf_state structure ถ้าจำเป็น
-        current_state = DB.get("shelf_state", [])
-        new_state = []
+        current_state = get_shelf_store()
+        new_state = CellStore()
         
         # สร้าง state structure ใหม่ตาม Gateway layout
         for level in sorted(new_shelf_config.keys()):
             for block in range(1, new_shelf_config[level] + 1):
                 # หา existing data
-                existing_lots = []
-                for cell in current_state:
-                    if len(cell) >= 3 and cell[0] == level and cell[1] == block:
-                        existing_lots = cell[2]
-                        break
+                existing_cell = current_state.get(level, block)
+                existing_lots = existing_cell[2] if existing_cell and len(existing_cell) >= 3 else []
                 
                 new_state.append([level, block, existing_lots])
         
         DB["shelf_state"] = new_state
+        _mark_shelf_dirty()
+        _bump_revision()
+        
+        # layout เปลี่ยนโครงสร้าง cells ทั้งหมด - บันทึก snapshot ใหม่แทนการบันทึกทีละ record
+        checkpoint_storage()
         
         print(f"✅ Layout updated from Gateway:")
         print(f"   📊 SHELF_CONFIG: {new_shelf_config}")
@@ -152,14 +158,7 @@ def update_layout_from_gateway(gateway_layout: dict):
         # เพิ่ม detailed logging สำหรับ layout ปัจจุบัน
         log_current_layout()
         
-        # อัปเดต LED configuration ให้สอดคล้องกับ layout ใหม่
-        try:
-            from core.led_controller import refresh_led_config
-            refresh_led_config()
-            print("💡 LED configuration refreshed for new layout")
-        except Exception as led_error:
-            print(f"⚠️ LED refresh failed: {led_error}")
-        
+        # LED / ปุ่ม อัปเดตโดยผู้เรียก (api.jobs.refresh_layout_hardware) - core/database ไม่ยุ่งกับ hardware
         return True
         
     except Exception as e:
@@ -178,24 +177,386 @@ def get_layout_info():
         "default_capacity": DEFAULT_CELL_CAPACITY
     }
 
+class CellStore(list):
+    """
+    shelf_state ที่มี index ตาม (level, block)
+
+    - ยังเป็น list ของ [level, block, lots] เหมือนเดิม (loop / json.dumps เดิมใช้ได้)
+    - get(level, block) เป็น dict lookup แทนการวนหาทั้ง list
+    - cell ใน index เป็น object เดียวกับใน list
+    - มี inverted index lot_no -> {(level, block), ...} สำหรับค้นหา lot
+      (เพิ่ม/ลบ lot ต้องผ่าน helper functions หรือ set_lots เพื่อให้ index ตรงเสมอ)
+    """
+
+    def __init__(self, cells=()):
+        super().__init__(cells)
+        self._index = {}
+        self._lot_index = {}
+        self._reindex()
+
+    def _reindex(self):
+        self._index = {}
+        self._lot_index = {}
+        for cell in self:
+            self._index_cell(cell)
+
+    def _index_cell(self, cell):
+        if len(cell) < 2:
+            return
+        key = (cell[0], cell[1])
+        # ถ้ามีช่องซ้ำ ให้ใช้ช่องแรก (เหมือนการวนหาแบบเดิม)
+        if key in self._index:
+            return
+        self._index[key] = cell
+        if len(cell) >= 3:
+            for lot in cell[2]:
+                self.index_lot(lot.get("lot_no"), cell[0], cell[1])
+
+    def get(self, level: int, block: int):
+        """ดึง cell [level, block, lots] ของตำแหน่งที่กำหนด (O(1))"""
+        return self._index.get((level, block))
+
+    def keys(self):
+        return self._index.keys()
+
+    # --- lot_no index ---
+    def lot_positions(self, lot_no: str) -> set:
+        """ตำแหน่งทั้งหมด (level, block) ที่มี lot_no นี้อยู่"""
+        return set(self._lot_index.get(lot_no, ()))
+
+    def index_lot(self, lot_no: str, level: int, block: int):
+        if lot_no is None:
+            return
+        self._lot_index.setdefault(lot_no, set()).add((level, block))
+
+    def unindex_lot(self, lot_no: str, level: int, block: int):
+        """ลบตำแหน่งออกจาก index ถ้าในช่องไม่มี lot_no นี้เหลืออยู่แล้ว"""
+        positions = self._lot_index.get(lot_no)
+        if not positions:
+            return
+        cell = self.get(level, block)
+        if cell and any(lot.get("lot_no") == lot_no for lot in cell[2]):
+            return
+        positions.discard((level, block))
+        if not positions:
+            del self._lot_index[lot_no]
+
+    def set_lots(self, level: int, block: int, lots: list):
+        """แทนที่ lots ทั้งหมดของช่อง พร้อมอัปเดต lot_no index"""
+        cell = self.get(level, block)
+        if not cell:
+            return False
+        old_lots = cell[2]
+        cell[2] = lots
+        for lot in old_lots:
+            self.unindex_lot(lot.get("lot_no"), level, block)
+        for lot in lots:
+            self.index_lot(lot.get("lot_no"), level, block)
+        return True
+
+    # --- list mutators: อัปเดต index ให้ตรงกับ list เสมอ ---
+    def append(self, cell):
+        super().append(cell)
+        self._index_cell(cell)
+
+    def extend(self, cells):
+        for cell in cells:
+            self.append(cell)
+
+    def __iadd__(self, cells):
+        self.extend(cells)
+        return self
+
+    def insert(self, i, cell):
+        super().insert(i, cell)
+        self._reindex()
+
+    def remove(self, cell):
+        super().remove(cell)
+        self._reindex()
+
+    def pop(self, i=-1):
+        cell = super().pop(i)
+        self._reindex()
+        return cell
+
+    def clear(self):
+        super().clear()
+        self._index = {}
+        self._lot_index = {}
+
+    def __setitem__(self, i, value):
+        super().__setitem__(i, value)
+        self._reindex()
+
+    def __delitem__(self, i):
+        super().__delitem__(i)
+        self._reindex()
+
+class JobQueue:
+    """
+    คิวงาน (jobs) ที่ค้นหา/ลบได้แบบ O(1)
+
+    - เก็บ job ใน dict ตาม jobId (dict ของ Python รักษาลำดับการเพิ่มอยู่แล้ว)
+    - มี index lot_no -> jobIds สำหรับตรวจงานซ้ำและ /clearCommand
+    - to_list() ใช้สำหรับส่งออกเป็น JSON (GET /command, websocket initial_state)
+    """
+
+    def __init__(self, jobs=()):
+        self._jobs = {}
+        self._by_lot = {}
+        for job in jobs:
+            self.append(job)
+
+    def append(self, job: dict):
+        job_id = job.get("jobId")
+        if job_id in self._jobs:
+            self.remove(job_id)
+        self._jobs[job_id] = job
+        # ใช้ dict เป็น ordered set เพื่อให้ลำดับคงที่
+        self._by_lot.setdefault(job.get("lot_no"), {})[job_id] = None
+
+    def get(self, job_id: str):
+        return self._jobs.get(job_id)
+
+    def find_by_lot(self, lot_no: str):
+        """คืน list ของ jobs ที่มี lot_no นี้ (ตามลำดับในคิว)"""
+        return [self._jobs[job_id] for job_id in self._by_lot.get(lot_no, ())]
+
+    def has_lot(self, lot_no: str) -> bool:
+        return lot_no in self._by_lot
+
+    def remove(self, job_id: str):
+        """ลบ job ตาม jobId คืน job ที่ถูกลบ (หรือ None)"""
+        job = self._jobs.pop(job_id, None)
+        if job is None:
+            return None
+        lot_no = job.get("lot_no")
+        lot_jobs = self._by_lot.get(lot_no)
+        if lot_jobs is not None:
+            lot_jobs.pop(job_id, None)
+            if not lot_jobs:
+                del self._by_lot[lot_no]
+        return job
+
+    def remove_by_lot(self, lot_no: str):
+        """ลบทุก job ที่มี lot_no นี้ คืน list ของ jobs ที่ถูกลบ"""
+        return [self.remove(job_id) for job_id in list(self._by_lot.get(lot_no, ()))]
+
+    def clear(self):
+        self._jobs.clear()
+        self._by_lot.clear()
+
+    def to_list(self):
+        return list(self._jobs.values())
+
+    def __iter__(self):
+        return iter(list(self._jobs.values()))
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def __contains__(self, job_id):
+        return job_id in self._jobs
+
+    def __repr__(self):
+        return f"JobQueue({self.to_list()!r})"
+
 def create_initial_shelf_state():
     """สร้างสถานะเริ่มต้นของชั้นวางตาม SHELF_CONFIG (stacked lots)"""
-    shelf_state = []
+    shelf_state = CellStore()
     for level, num_blocks in SHELF_CONFIG.items():
         for block in range(1, num_blocks + 1):
             shelf_state.append([level, block, []])  # [level, block, lots]
     return shelf_state
 
 DB = {
-    "jobs": [],
+    "jobs": JobQueue(),
     "shelf_state": create_initial_shelf_state(),
     "job_counter": 0
 }
 
 # --- Helper Functions ---
+def get_job_queue() -> JobQueue:
+    """
+    ดึงคิวงานเป็น JobQueue
+    ถ้ามีโค้ดไหน assign list ธรรมดาให้ DB["jobs"] จะ wrap ให้มี index อัตโนมัติ
+    """
+    queue = DB["jobs"]
+    if not isinstance(queue, JobQueue):
+        queue = JobQueue(queue)
+        DB["jobs"] = queue
+    return queue
+
 def get_job_by_id(job_id: str):
     """ค้นหา Job จาก ID ใน DB"""
-    return next((job for job in DB["jobs"] if job.get("jobId") == job_id), None)
+    return get_job_queue().get(job_id)
+
+# --- Job Queue Mutations (บันทึกลง storage backend) ---
+
+def next_job_id():
+    """เพิ่ม job_counter และสร้าง jobId ใหม่"""
+    DB["job_counter"] += 1
+    return f"job_{DB['job_counter']}"
+
+def enqueue_job(job: dict):
+    """เพิ่ม job เข้าคิว"""
+    get_job_queue().append(job)
+    _record_change("job_create", job=job, job_counter=DB["job_counter"])
+
+def complete_job_entry(job_id: str):
+    """ลบ job ที่ทำเสร็จแล้วออกจากคิว คืน job ที่ถูกลบ"""
+    job = get_job_queue().remove(job_id)
+    if job is not None:
+        _record_change("job_complete", jobId=job_id, job=job)
+    return job
+
+def cancel_jobs_by_lot(lot_no: str):
+    """ยกเลิกทุก job ของ lot_no คืน list ของ jobs ที่ถูกลบ"""
+    removed = get_job_queue().remove_by_lot(lot_no)
+    if removed:
+        _record_change("job_cancel", lot_no=lot_no, jobs=removed)
+    return removed
+
+def update_job(job_id: str, fields: dict):
+    """อัปเดต field ของ job ในคิว (เช่น error flags)"""
+    job = get_job_by_id(job_id)
+    if job is None:
+        return None
+    job.update(fields)
+    _record_change("job_update", jobId=job_id, fields=fields, job=job)
+    return job
+
+def reset_shelf_state():
+    """สร้าง shelf_state ว่างใหม่ตาม SHELF_CONFIG"""
+    DB["shelf_state"] = create_initial_shelf_state()
+    _mark_shelf_dirty()
+    _record_change("shelf_reset")
+
+def reset_db():
+    """ล้างคิวงานและ shelf_state ทั้งหมด (/api/system/reset)"""
+    DB["jobs"] = JobQueue()
+    DB["shelf_state"] = create_initial_shelf_state()
+    DB["job_counter"] = 0
+    _mark_shelf_dirty()
+    _record_change("reset")
+
+# --- Gateway Sync Tracking (delta sync) ---
+# ทุกการเปลี่ยนแปลงของ cell เพิ่ม version และจำว่า cell ไหนเปลี่ยน
+# sync ครั้งถัดไปส่งเฉพาะ cells ที่เปลี่ยนตั้งแต่ version ที่ Gateway ยืนยันล่าสุด
+# synced_version = None -> ยังไม่เคย sync (หลัง restart) ต้องส่งทั้ง shelf
+
+SHELF_SYNC = {
+    "version": 0,            # version ปัจจุบันของ shelf_state
+    "synced_version": None,  # version ล่าสุดที่ Gateway ยืนยันแล้ว
+    "dirty": {},             # (level, block) -> version ที่เปลี่ยนล่าสุด
+    "full_since": 0          # version ที่ต้อง full resync (None = ไม่ต้อง)
+}
+
+# listener(level, block, version) ถูกเรียกทุกครั้งที่ cell เปลี่ยน (level=None = ทั้ง shelf)
+# ใช้ส่ง cell_updated ไป WebSocket clients (api/websockets.py)
+_SHELF_LISTENERS = []
+
+def add_shelf_listener(listener):
+    _SHELF_LISTENERS.append(listener)
+
+def _notify_shelf_listeners(level, block):
+    for listener in _SHELF_LISTENERS:
+        try:
+            listener(level, block, SHELF_SYNC["version"])
+        except Exception as e:
+            print(f"⚠️ Shelf listener error: {e}")
+
+def _mark_cell_dirty(level: int, block: int):
+    SHELF_SYNC["version"] += 1
+    SHELF_SYNC["dirty"][(level, block)] = SHELF_SYNC["version"]
+    _notify_shelf_listeners(level, block)
+
+def _mark_shelf_dirty():
+    """โครงสร้าง shelf เปลี่ยนทั้งหมด (reset / layout) -> full resync"""
+    SHELF_SYNC["version"] += 1
+    SHELF_SYNC["full_since"] = SHELF_SYNC["version"]
+    SHELF_SYNC["dirty"].clear()
+    _notify_shelf_listeners(None, None)
+
+def request_full_resync():
+    """บังคับให้ sync ครั้งถัดไปส่งทั้ง shelf (เช่น Gateway แจ้ง version mismatch)"""
+    if SHELF_SYNC["full_since"] is None:
+        SHELF_SYNC["full_since"] = SHELF_SYNC["version"]
+
+def get_shelf_version():
+    return SHELF_SYNC["version"]
+
+def _sync_cell(level: int, block: int, lots: list):
+    return {"level": level, "block": block, "lots": lots}
+
+def build_shelf_delta():
+    """
+    สร้างข้อมูลสำหรับ sync ไป Gateway
+
+    Returns:
+        dict: {"mode": "full"|"delta", "base_version", "version", "cells": [...]}
+        หรือ None ถ้า Gateway เป็นปัจจุบันแล้ว
+    """
+    version = SHELF_SYNC["version"]
+    base_version = SHELF_SYNC["synced_version"]
+    if base_version is None or SHELF_SYNC["full_since"] is not None:
+        cells = [_sync_cell(level, block, lots) for level, block, lots in get_shelf_store()]
+        return {"mode": "full", "base_version": base_version, "version": version, "cells": cells}
+
+    if not SHELF_SYNC["dirty"]:
+        return None
+
+    store = get_shelf_store()
+    cells = []
+    for level, block in sorted(SHELF_SYNC["dirty"]):
+        cell = store.get(level, block)
+        if cell is not None:
+            cells.append(_sync_cell(level, block, cell[2]))
+    return {"mode": "delta", "base_version": base_version, "version": version, "cells": cells}
+
+def ack_shelf_delta(delta: dict):
+    """
+    Gateway รับ delta แล้ว - ล้าง dirty เฉพาะ cells ที่อยู่ใน delta และไม่ได้เปลี่ยนอีกหลังสร้าง delta
+    synced_version เดินหน้าอย่างเดียว (ack ที่มาช้ากว่า ack ของ delta ใหม่กว่าไม่ทำให้ถอยหลัง)
+    """
+    version = delta["version"]
+    synced = SHELF_SYNC["synced_version"]
+    SHELF_SYNC["synced_version"] = version if synced is None else max(synced, version)
+    if delta["mode"] == "full" and SHELF_SYNC["full_since"] is not None and SHELF_SYNC["full_since"] <= version:
+        SHELF_SYNC["full_since"] = None
+    dirty = SHELF_SYNC["dirty"]
+    for cell in delta["cells"]:
+        key = (cell["level"], cell["block"])
+        if key in dirty and dirty[key] <= version:
+            del dirty[key]
+
+def get_shelf_sync_status():
+    return {
+        "version": SHELF_SYNC["version"],
+        "synced_version": SHELF_SYNC["synced_version"],
+        "dirty_cells": len(SHELF_SYNC["dirty"]),
+        "full_resync_pending": SHELF_SYNC["synced_version"] is None or SHELF_SYNC["full_since"] is not None
+    }
+
+# revision ของ DB ทั้งหมด (jobs + shelf_state) - เปลี่ยนทุกครั้งที่มีการแก้ไข
+# ใช้เป็น cache key ของข้อมูลที่ encode แล้ว (เช่น initial_state ของ /ws)
+_DB_REVISION = 0
+
+def _bump_revision():
+    global _DB_REVISION
+    _DB_REVISION += 1
+
+def get_db_revision():
+    return _DB_REVISION
+
+def get_db_snapshot():
+    """ส่งคืน DB ในรูปแบบที่ json.dumps ได้ (jobs เป็น list)"""
+    return {
+        "jobs": get_job_queue().to_list(),
+        "shelf_state": DB["shelf_state"],
+        "job_counter": DB["job_counter"]
+    }
 
 
 # --- Stacked Lots Helper Functions ---
@@ -205,11 +566,44 @@ def get_cell_capacity(level: int, block: int):
     cell_key = f"{level}-{block}"
     return CELL_CAPACITIES.get(cell_key, DEFAULT_CELL_CAPACITY)
 
+def get_shelf_store() -> CellStore:
+    """
+    ดึง shelf_state เป็น CellStore
+    ถ้ามีโค้ดไหน assign list ธรรมดาให้ DB["shelf_state"] จะ wrap ให้มี index อัตโนมัติ
+    """
+    store = DB["shelf_state"]
+    if not isinstance(store, CellStore):
+        store = CellStore(store)
+        DB["shelf_state"] = store
+    return store
+
 def get_cell(level: int, block: int):
-    for cell in DB["shelf_state"]:
-        if cell[0] == level and cell[1] == block:
-            return cell
-    return None
+    return get_shelf_store().get(level, block)
+
+def set_cell_lots(level: int, block: int, lots: list):
+    """แทนที่ lots ทั้งหมดของช่อง (ใช้ตอน restore จาก Gateway)"""
+    if not get_shelf_store().set_lots(level, block, lots):
+        return False
+    _mark_cell_dirty(level, block)
+    _record_change("cell_set", level=level, block=block, lots=lots)
+    return True
+
+def replace_shelf_lots(cells: dict):
+    """
+    แทนที่ lots ทั้ง shelf ด้วย cells {(level, block): lots} - cell ที่ไม่อยู่ใน cells จะถูกล้าง
+    ผลเหมือน reset_shelf_state() + set_cell_lots() ทุกช่อง แต่เขียนเฉพาะ cell ที่เปลี่ยนจริง
+    (ไม่ทำให้ Gateway / WebSocket ต้อง full resync)
+
+    Returns:
+        int: จำนวน cells ที่เปลี่ยน
+    """
+    changed = 0
+    for level, block, lots in list(get_shelf_store()):
+        new_lots = cells.get((level, block), [])
+        if new_lots != lots:
+            set_cell_lots(level, block, new_lots)
+            changed += 1
+    return changed
 
 def get_lots_in_position(level: int, block: int):
     cell = get_cell(level, block)
@@ -218,7 +612,8 @@ def get_lots_in_position(level: int, block: int):
     return []
 
 def add_lot_to_position(level: int, block: int, lot_no: str, tray_count: int, biz: str = "Unknown"):
-    cell = get_cell(level, block)
+    store = get_shelf_store()
+    cell = store.get(level, block)
     if not cell:
         return False
     lots = cell[2]
@@ -234,19 +629,28 @@ def add_lot_to_position(level: int, block: int, lot_no: str, tray_count: int, bi
             # อัปเดต biz ถ้าไม่มีหรือเป็น Unknown
             if 'biz' not in lot or lot['biz'] == "Unknown":
                 lot['biz'] = biz
+            _mark_cell_dirty(level, block)
+            _record_change("lot_add", level=level, block=block, lot_no=lot_no, tray_count=tray_count, biz=biz)
             return True
     # ถ้าไม่มี lot_no เดิม ให้เพิ่มใหม่ (วางบนสุด: append)
     lots.append({"lot_no": lot_no, "tray_count": tray_count, "biz": biz})
+    store.index_lot(lot_no, level, block)
+    _mark_cell_dirty(level, block)
+    _record_change("lot_add", level=level, block=block, lot_no=lot_no, tray_count=tray_count, biz=biz)
     return True
 
 def remove_lot_from_position(level: int, block: int, lot_no: str):
-    cell = get_cell(level, block)
+    store = get_shelf_store()
+    cell = store.get(level, block)
     if not cell:
         return False
     lots = cell[2]
     for i, lot in enumerate(lots):
         if lot['lot_no'] == lot_no:
             lots.pop(i)
+            store.unindex_lot(lot_no, level, block)
+            _mark_cell_dirty(level, block)
+            _record_change("lot_remove", level=level, block=block, lot_no=lot_no)
             return True
     return False
 
@@ -258,16 +662,25 @@ def update_lot_quantity(level: int, block: int, lot_no: str, new_tray_count: int
     for lot in lots:
         if lot['lot_no'] == lot_no:
             lot['tray_count'] = new_tray_count
+            _mark_cell_dirty(level, block)
+            _record_change("lot_qty", level=level, block=block, lot_no=lot_no, tray_count=new_tray_count)
             return True
     return False
 
 def find_lot_location(lot_no: str):
     """ค้นหาว่า lot_no นี้อยู่ cell ไหน (คืน (level, block) หรือ None)"""
-    for cell in DB["shelf_state"]:
-        for lot in cell[2]:
-            if lot['lot_no'] == lot_no:
-                return (cell[0], cell[1])
-    return None
+    positions = get_shelf_store().lot_positions(lot_no)
+    if not positions:
+        return None
+    return min(positions)
+
+def find_lot_locations(lot_no: str):
+    """ค้นหาทุกตำแหน่งที่มี lot_no นี้ (คืน list ของ (level, block) เรียงตามตำแหน่ง)"""
+    return sorted(get_shelf_store().lot_positions(lot_no))
+
+def is_lot_in_position(level: int, block: int, lot_no: str):
+    """ตรวจสอบว่า lot_no อยู่ในช่องที่กำหนดหรือไม่ (ใช้ lot_no index)"""
+    return (level, block) in get_shelf_store().lot_positions(lot_no)
 
 def get_lot_in_position(level: int, block: int):
     """ดึง lot_no ที่อยู่ในตำแหน่งที่กำหนด"""
@@ -299,11 +712,15 @@ def validate_position(level: int, block: int):
 def update_lot_biz(lot_no: str, biz: str):
     """อัปเดต biz ของ lot_no ทุกตำแหน่งที่พบ"""
     updated_count = 0
-    for cell in DB["shelf_state"]:
-        for lot in cell[2]:
+    store = get_shelf_store()
+    for level, block in store.lot_positions(lot_no):
+        for lot in store.get(level, block)[2]:
             if lot['lot_no'] == lot_no:
                 lot['biz'] = biz
                 updated_count += 1
+                _mark_cell_dirty(level, block)
+    if updated_count:
+        _record_change("lot_biz", lot_no=lot_no, biz=biz)
     return updated_count
 def migrate_existing_lots_add_biz():
     """เพิ่ม biz field ให้กับ lots ที่มีอยู่แล้วโดยไม่มี biz"""
@@ -314,6 +731,7 @@ def migrate_existing_lots_add_biz():
                 lot['biz'] = "Unknown"
                 updated_count += 1
     if updated_count > 0:
+        _bump_revision()
         print(f"🔄 Migrated {updated_count} existing lots to include biz field")
     return updated_count
 
@@ -416,4 +834,148 @@ def log_current_layout():
     print(f"   Gateway Layout Loaded: {'✅ Yes' if gateway_loaded else '❌ No (using fallback)'}")
     print(f"   Active Layout Source: {'Gateway' if gateway_loaded else 'Fallback SHELF_CONFIG'}")
     print(f"   Default Cell Capacity: {DEFAULT_CELL_CAPACITY}")
-    print("="*50 + "\n")
\ No newline at end of file
+    print("="*50 + "\n")
+
+# === Storage Backend (memory + journal / sqlite) ===
+# ทุกการเปลี่ยนแปลงของ DB ผ่าน helper functions ด้านบนจะถูกส่งไปที่ storage backend
+# ตอนเริ่มระบบ open_storage() จะกู้คืนสถานะล่าสุดกลับมาโดยไม่ต้องเรียก Gateway
+
+_STORAGE = None
+
+def _record_change(op: str, **data):
+    """ส่งการเปลี่ยนแปลงไปที่ storage backend (no-op ถ้ายังไม่ได้เปิด หรือกำลัง replay)"""
+    _bump_revision()
+    if _STORAGE is not None:
+        try:
+            _STORAGE.record(op, data)
+        except Exception as e:
+            print(f"⚠️ Storage write failed ({op}): {e}")
+
+def _storage_snapshot():
+    """สร้าง snapshot ของ DB + layout สำหรับ compaction / checkpoint"""
+    return {
+        "version": 1,
+        "jobs": get_job_queue().to_list(),
+        "shelf_state": [list(cell) for cell in get_shelf_store()],
+        "job_counter": DB["job_counter"],
+        "shelf_version": SHELF_SYNC["version"],
+        "layout": {
+            "shelf_config": {str(level): blocks for level, blocks in SHELF_CONFIG.items()},
+            "cell_capacities": dict(CELL_CAPACITIES),
+            "dynamic_layout": dict(DYNAMIC_LAYOUT)
+        }
+    }
+
+def _restore_snapshot(snapshot: dict):
+    """โหลด DB + layout จาก snapshot"""
+    global DYNAMIC_LAYOUT
+    layout = snapshot.get("layout", {})
+    if layout.get("shelf_config"):
+        SHELF_CONFIG.clear()
+        SHELF_CONFIG.update({int(level): int(blocks) for level, blocks in layout["shelf_config"].items()})
+    if layout.get("cell_capacities"):
+        CELL_CAPACITIES.clear()
+        CELL_CAPACITIES.update(layout["cell_capacities"])
+    DYNAMIC_LAYOUT = dict(layout.get("dynamic_layout", {}))
+
+    DB["shelf_state"] = CellStore([list(cell) for cell in snapshot.get("shelf_state", [])])
+    DB["jobs"] = JobQueue(snapshot.get("jobs", []))
+    DB["job_counter"] = int(snapshot.get("job_counter", 0))
+    _bump_revision()
+    SHELF_SYNC["version"] = int(snapshot.get("shelf_version", SHELF_SYNC["version"]))
+
+def _apply_journal_record(op: str, data: dict):
+    """Replay 1 record (เรียก helper เดียวกับตอนเขียน โดย _STORAGE ยังเป็น None)"""
+    if op == "lot_add":
+        add_lot_to_position(data["level"], data["block"], data["lot_no"], data["tray_count"], data.get("biz", "Unknown"))
+    elif op == "lot_remove":
+        remove_lot_from_position(data["level"], data["block"], data["lot_no"])
+    elif op == "lot_qty":
+        update_lot_quantity(data["level"], data["block"], data["lot_no"], data["tray_count"])
+    elif op == "lot_biz":
+        update_lot_biz(data["lot_no"], data["biz"])
+    elif op == "cell_set":
+        set_cell_lots(data["level"], data["block"], data["lots"])
+    elif op == "shelf_reset":
+        reset_shelf_state()
+    elif op == "reset":
+        reset_db()
+    elif op == "job_create":
+        enqueue_job(data["job"])
+        DB["job_counter"] = max(DB["job_counter"], int(data.get("job_counter", 0)))
+    elif op == "job_complete":
+        complete_job_entry(data["jobId"])
+    elif op == "job_cancel":
+        cancel_jobs_by_lot(data["lot_no"])
+    elif op == "job_update":
+        update_job(data["jobId"], data.get("fields", {}))
+    else:
+        print(f"⚠️ Unknown journal op ignored: {op}")
+
+def open_storage(engine: str = None, location=None):
+    """
+    กู้คืนสถานะจาก storage backend แล้วเริ่มบันทึกการเปลี่ยนแปลงต่อ
+
+    Args:
+        engine: "memory" (journal) หรือ "sqlite" - ค่าเริ่มต้นจาก SMART_SHELF_STORAGE
+        location: directory ของ journal หรือ path ของไฟล์ SQLite (optional)
+
+    Returns:
+        dict: {"engine", "restored", "snapshot", "records", "elapsed_ms"}
+    """
+    global _STORAGE
+    if _STORAGE is not None:
+        return {"engine": _STORAGE.name, "restored": False, "snapshot": False, "records": 0, "elapsed_ms": 0.0}
+
+    start = time.perf_counter()
+    storage = create_storage(engine, location)
+    snapshot, records = storage.load()
+
+    if snapshot:
+        _restore_snapshot(snapshot)
+    for record in records:
+        try:
+            _apply_journal_record(record.get("op"), record.get("data", {}))
+        except Exception as e:
+            print(f"⚠️ Journal replay failed at seq {record.get('seq')}: {e}")
+
+    storage.open(_storage_snapshot)
+    _STORAGE = storage
+
+    restored = bool(snapshot) or bool(records)
+    if records or not snapshot:
+        # เริ่มต้นด้วย snapshot ที่ compact แล้ว เพื่อให้การกู้คืนครั้งหน้าเร็ว
+        storage.checkpoint()
+
+    elapsed_ms = round((time.perf_counter() - start) * 1000, 2)
+    if restored:
+        print(f"💾 Local state restored from {storage.name} storage: {len(get_job_queue())} jobs, "
+              f"{len(records)} records replayed in {elapsed_ms} ms")
+    return {"engine": storage.name, "restored": restored, "snapshot": bool(snapshot),
+            "records": len(records), "elapsed_ms": elapsed_ms}
+
+def checkpoint_storage():
+    """บันทึกสถานะทั้งหมดทันที (ใช้หลังการเปลี่ยนแปลงใหญ่ เช่น layout)"""
+    if _STORAGE is not None:
+        try:
+            _STORAGE.checkpoint()
+        except Exception as e:
+            print(f"⚠️ Storage checkpoint failed: {e}")
+
+def close_storage():
+    """flush ที่ค้างอยู่แล้วปิด storage backend"""
+    global _STORAGE
+    if _STORAGE is not None:
+        _STORAGE.close()
+        _STORAGE = None
+
+def get_storage_status():
+    if _STORAGE is None:
+        return {"engine": None, "open": False}
+    return _STORAGE.get_status()
+
+def get_job_history(lot_no: str = None, job_id: str = None, limit: int = 100):
+    """ดึงประวัติ jobs (created / completed / canceled / updated) จาก storage backend"""
+    if _STORAGE is None:
+        return []
+    return _STORAGE.get_job_history(lot_no=lot_no, job_id=job_id, limit=limit)
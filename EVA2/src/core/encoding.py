@@ -0,0 +1,159 @@
+# core/encoding.py
+"""
+Message encoding layer (WebSocket events + HTTP responses)
+
+- encode event 1 ครั้ง แล้วใช้ bytes/str เดียวกันกับทุก client
+- ใช้ orjson หรือ msgspec ถ้าติดตั้งไว้ (เร็วกว่า json มาตรฐานหลายเท่า) ไม่งั้นใช้ json
+- เลือก encoder เองได้ด้วย SMART_SHELF_JSON_ENCODER=auto|orjson|msgspec|json
+- MessagePack (binary) สำหรับ /ws?encoding=msgpack ถ้าติดตั้ง msgpack ไว้
+
+Benchmark: python bench_encoding.py
+"""
+
+import json
+import os
+
+JSON_ENCODER_PREFERENCE = os.environ.get("SMART_SHELF_JSON_ENCODER", "auto").lower()
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+
+def _stdlib_encode(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _load_orjson():
+    import orjson
+    options = orjson.OPT_NON_STR_KEYS    # SHELF_CONFIG ใช้ int เป็น key
+
+    def encode(obj) -> bytes:
+        return orjson.dumps(obj, option=options)
+    return encode
+
+
+def _load_msgspec():
+    import msgspec
+
+    def enc_hook(obj):
+        # CellStore / JobQueue และ type อื่นที่ msgspec ไม่รู้จัก
+        if hasattr(obj, "to_list"):
+            return obj.to_list()
+        if isinstance(obj, (list, tuple, set)):
+            return list(obj)
+        if isinstance(obj, dict):
+            return dict(obj)
+        raise TypeError(f"Cannot encode {type(obj).__name__}")
+
+    encoder = msgspec.json.Encoder(enc_hook=enc_hook)
+    return encoder.encode
+
+
+_ENCODERS = {"orjson": _load_orjson, "msgspec": _load_msgspec}
+
+
+def _select_encoder(preference: str):
+    candidates = ["orjson", "msgspec"] if preference == "auto" else [preference]
+    for name in candidates:
+        loader = _ENCODERS.get(name)
+        if loader is None:
+            continue
+        try:
+            return name, loader()
+        except ImportError:
+            if preference != "auto":
+                print(f"⚠️ JSON encoder '{name}' not installed, using json")
+    return "json", _stdlib_encode
+
+
+JSON_ENCODER_NAME, _encode = _select_encoder(JSON_ENCODER_PREFERENCE)
+
+
+def encode_json(obj) -> bytes:
+    """encode เป็น JSON (UTF-8 bytes) ด้วย encoder ที่เร็วที่สุดที่มี"""
+    try:
+        return _encode(obj)
+    except TypeError:
+        # type ที่ fast encoder ไม่รองรับ - ใช้ json มาตรฐาน (default=str แบบเดียวกับ log)
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def dumps(obj) -> str:
+    """encode เป็น JSON str"""
+    return encode_json(obj).decode("utf-8")
+
+
+def _msgpack_default(obj):
+    if hasattr(obj, "to_list"):
+        return obj.to_list()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    return str(obj)
+
+
+def encode_msgpack(obj) -> bytes:
+    """encode เป็น MessagePack (ต้องติดตั้ง msgpack)"""
+    return msgpack.packb(obj, use_bin_type=True, default=_msgpack_default)
+
+
+class EncodedMessage:
+    """
+    Event ที่ encode แล้ว 1 ครั้ง - ส่งซ้ำให้ทุก client ได้โดยไม่ encode ใหม่
+    .data = UTF-8 bytes, .text = str (decode ครั้งเดียวแล้ว cache), .packed = MessagePack (encode เมื่อใช้ครั้งแรก)
+    """
+
+    __slots__ = ("event", "data", "_text", "_packed")
+
+    def __init__(self, event=None, data: bytes = None, text: str = None, packed: bytes = None):
+        self.event = event
+        if data is None:
+            data = text.encode("utf-8") if text is not None else encode_json(event)
+        self.data = data
+        self._text = text
+        self._packed = packed
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = self.data.decode("utf-8")
+        return self._text
+
+    @property
+    def packed(self) -> bytes:
+        if self._packed is None:
+            self._packed = encode_msgpack(self.event if self.event is not None else json.loads(self.data))
+        return self._packed
+
+    def __len__(self):
+        return len(self.data)
+
+
+def encode_message(message) -> EncodedMessage:
+    """แปลง dict / str / bytes / EncodedMessage เป็น EncodedMessage"""
+    if isinstance(message, EncodedMessage):
+        return message
+    if isinstance(message, str):
+        return EncodedMessage(text=message)
+    if isinstance(message, (bytes, bytearray)):
+        return EncodedMessage(data=bytes(message))
+    return EncodedMessage(event=message)
+
+
+def get_encoder_info() -> dict:
+    return {"json_encoder": JSON_ENCODER_NAME, "preference": JSON_ENCODER_PREFERENCE, "msgpack": MSGPACK_AVAILABLE}
+
+
+try:
+    from fastapi.responses import JSONResponse
+
+    class FastJSONResponse(JSONResponse):
+        """JSONResponse ที่ใช้ encoder เดียวกับ WebSocket events"""
+
+        def render(self, content) -> bytes:
+            return encode_json(content)
+except ImportError:
+    # script ที่ไม่มี fastapi (เช่น bench_encoding.py)
+    FastJSONResponse = None
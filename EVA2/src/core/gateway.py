@@ -0,0 +1,127 @@
+# core/gateway.py
+"""
+Shared HTTP client สำหรับทุกการเรียก Gateway
+
+- ใช้ httpx.AsyncClient ตัวเดียวตลอดอายุ application (keep-alive connection pool)
+  แทนการสร้าง/ปิด client ใหม่ทุกครั้ง (ประหยัด TCP handshake ทุก request)
+- เปิด HTTP/2 อัตโนมัติถ้าติดตั้ง h2 ไว้ (pip install httpx[http2])
+- timeout แยกตาม endpoint (ดู GATEWAY_TIMEOUTS)
+- เปิด/ปิดใน FastAPI lifespan (main.py)
+"""
+
+import os
+
+import httpx
+
+# Gateway Configuration
+GATEWAY_BASE_URL = "http://43.72.20.238:8000"  # Gateway server URL
+
+# Connection pool
+GATEWAY_MAX_CONNECTIONS = 10
+GATEWAY_MAX_KEEPALIVE = 5
+GATEWAY_KEEPALIVE_EXPIRY = 30.0   # วินาที
+GATEWAY_CONNECT_TIMEOUT = 3.0     # วินาที (ทุก endpoint)
+
+# Timeout (วินาที) แยกตาม endpoint
+GATEWAY_TIMEOUTS = {
+    "request_id": 10.0,   # /IoTManagement/shelf/requestID
+    "layout": 10.0,       # /IoTManagement/shelf/layout
+    "shelf_item": 10.0,   # /IoTManagement/shelf/shelfItem
+    "pending": 10.0,      # /IoTManagement/shelf/pending/{shelf_id}
+    "complete": 5.0,      # /shelf/complete
+    "ask_shelf": 15.0,    # /shelf/askCorrectShelf (Gateway → LMS)
+    "logs": 10.0,
+}
+DEFAULT_GATEWAY_TIMEOUT = 10.0
+
+# Shelf state sync: ส่งเฉพาะ cells ที่เปลี่ยน (delta + version) แทนทั้ง shelf
+# Gateway รุ่นเก่าถือว่า shelfItem คือ state ทั้ง shelf - ถ้าได้ delta จะลบ cells ที่ไม่อยู่ใน payload
+# จึงส่ง delta เฉพาะเมื่อ Gateway ยืนยันว่ารองรับ ({"delta_sync": true} ใน response ของ sync)
+#   SMART_SHELF_DELTA_SYNC=auto (default) ส่ง full จนกว่า Gateway จะยืนยัน
+#   SMART_SHELF_DELTA_SYNC=1 ส่ง delta เสมอ, =0 ส่ง full เสมอ
+GATEWAY_DELTA_SYNC = os.environ.get("SMART_SHELF_DELTA_SYNC", "auto").lower()
+
+# ยืนยันจาก response ล่าสุดของ shelfItem (None = ยังไม่รู้)
+_GATEWAY_CAPABILITIES = {"delta_sync": None}
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+_client = None
+
+
+def gateway_timeout(endpoint: str) -> httpx.Timeout:
+    """สร้าง httpx.Timeout ของ endpoint ที่ระบุ"""
+    seconds = GATEWAY_TIMEOUTS.get(endpoint, DEFAULT_GATEWAY_TIMEOUT)
+    return httpx.Timeout(seconds, connect=min(seconds, GATEWAY_CONNECT_TIMEOUT))
+
+
+def delta_sync_enabled() -> bool:
+    """ส่ง shelf state แบบ delta ได้หรือไม่ (ตาม SMART_SHELF_DELTA_SYNC + การยืนยันของ Gateway)"""
+    if GATEWAY_DELTA_SYNC in ("1", "true", "on"):
+        return True
+    if GATEWAY_DELTA_SYNC in ("0", "false", "off"):
+        return False
+    return _GATEWAY_CAPABILITIES["delta_sync"] is True
+
+
+def note_shelf_sync_response(response):
+    """บันทึกว่า Gateway รองรับ delta sync หรือไม่ จาก response 200 ของ shelfItem"""
+    try:
+        body = response.json()
+    except ValueError:
+        body = None
+    supported = isinstance(body, dict) and body.get("delta_sync") is True
+    if supported != _GATEWAY_CAPABILITIES["delta_sync"]:
+        print(f"🌐 Gateway delta sync support: {'✅' if supported else '❌'}")
+    _GATEWAY_CAPABILITIES["delta_sync"] = supported
+
+
+def get_delta_sync_status() -> dict:
+    return {"setting": GATEWAY_DELTA_SYNC, "gateway_confirmed": _GATEWAY_CAPABILITIES["delta_sync"],
+            "enabled": delta_sync_enabled()}
+
+
+def _create_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=HTTP2_AVAILABLE,
+        timeout=httpx.Timeout(DEFAULT_GATEWAY_TIMEOUT, connect=GATEWAY_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=GATEWAY_MAX_CONNECTIONS,
+            max_keepalive_connections=GATEWAY_MAX_KEEPALIVE,
+            keepalive_expiry=GATEWAY_KEEPALIVE_EXPIRY
+        ),
+        headers={"Accept": "application/json"}
+    )
+
+
+async def open_gateway_client() -> httpx.AsyncClient:
+    """สร้าง shared client (เรียกตอน startup)"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _create_client()
+        print(f"🌐 Gateway client ready (HTTP/2: {'✅' if HTTP2_AVAILABLE else '❌'}, pool: {GATEWAY_MAX_CONNECTIONS})")
+    return _client
+
+
+def get_gateway_client() -> httpx.AsyncClient:
+    """
+    ดึง shared client
+    ถ้ายังไม่ได้เปิด (เช่นเรียกจาก script) จะสร้างให้อัตโนมัติ
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _create_client()
+    return _client
+
+
+async def close_gateway_client():
+    """ปิด shared client และ connection pool (เรียกตอน shutdown)"""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+        print("🌐 Gateway client closed")
+    _client = None
@@ -0,0 +1,245 @@
+# core/journal.py
+"""
+Write-ahead journal สำหรับ DB (shelf_state + job queue)
+
+- ทุกการเปลี่ยนแปลงถูกเขียนต่อท้ายไฟล์ journal.log (JSON 1 บรรทัดต่อ 1 record)
+- record() แค่ต่อ buffer ใน memory - writer thread เขียนไฟล์ + fsync (event loop ไม่รอ disk)
+- fsync แบบ batch: sync เมื่อครบ FSYNC_BATCH_SIZE records หรือทุก FSYNC_INTERVAL วินาที
+- ทุก SNAPSHOT_EVERY records จะเขียน snapshot.json ใหม่ (atomic) แล้วล้าง journal (compaction, ใน writer thread)
+- ตอนเริ่มระบบ: โหลด snapshot แล้ว replay records ที่ตามมา (ไม่ต้องเรียก Gateway)
+
+Module นี้ไม่รู้จักโครงสร้าง DB - core.database เป็นผู้ apply records เอง
+"""
+
+import json
+import os
+import pathlib
+import threading
+import time
+
+# === Journal Configuration ===
+DATA_DIR = pathlib.Path(__file__).resolve().parent.parent / "data"
+JOURNAL_FILE = "journal.log"
+SNAPSHOT_FILE = "snapshot.json"
+FSYNC_BATCH_SIZE = 32      # fsync ทุก 32 records
+FSYNC_INTERVAL = 0.1       # หรือทุก 100ms (records ที่ค้างอยู่)
+SNAPSHOT_EVERY = 1000      # compaction ทุก 1000 records
+
+
+def _fsync_dir(path: pathlib.Path):
+    """fsync directory เพื่อให้ rename/create ไฟล์ทนไฟดับ (ข้ามบน Windows)"""
+    try:
+        fd = os.open(str(path), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class Journal:
+    """Append-only journal + compacted snapshot"""
+
+    def __init__(self, directory=None, fsync_batch: int = FSYNC_BATCH_SIZE,
+                 fsync_interval: float = FSYNC_INTERVAL, snapshot_every: int = SNAPSHOT_EVERY):
+        self.directory = pathlib.Path(directory) if directory else DATA_DIR
+        self.journal_path = self.directory / JOURNAL_FILE
+        self.snapshot_path = self.directory / SNAPSHOT_FILE
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.snapshot_every = snapshot_every
+
+        self._lock = threading.RLock()     # buffer / seq (ถือสั้นๆ จาก event loop)
+        self._io_lock = threading.Lock()   # ไฟล์ (writer thread / close)
+        self._file = None
+        self._snapshot_provider = None
+        self._seq = 0
+        self._buffer = []            # (seq, line) ที่ยังไม่ได้เขียน + fsync
+        self._snapshot = None        # (seq, json text) ที่รอ writer เขียน
+        self._since_snapshot = 0
+        self._last_sync = time.monotonic()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._sync_thread = None
+
+        self.stats = {
+            "records": 0,
+            "fsyncs": 0,
+            "snapshots": 0,
+            "last_snapshot_time": None
+        }
+
+    # --- Load / Replay ---
+    def load(self):
+        """
+        อ่าน snapshot และ records ที่ตามมา
+
+        Returns:
+            tuple: (snapshot dict หรือ None, list ของ records {"seq", "op", "data"})
+        """
+        snapshot = None
+        snapshot_seq = 0
+        if self.snapshot_path.exists():
+            try:
+                with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                    snapshot = json.load(f)
+                snapshot_seq = int(snapshot.get("seq", 0))
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Journal snapshot unreadable, ignoring: {e}")
+                snapshot = None
+
+        records = []
+        if self.journal_path.exists():
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                for line_no, line in enumerate(f, 1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # บรรทัดสุดท้ายเขียนไม่ครบตอนไฟดับ - หยุดที่นี่
+                        print(f"⚠️ Journal truncated at line {line_no}, ignoring the rest")
+                        break
+                    # records ที่อยู่ใน snapshot แล้ว (crash ระหว่าง compaction)
+                    if record.get("seq", 0) <= snapshot_seq:
+                        continue
+                    records.append(record)
+
+        self._seq = max([snapshot_seq] + [r.get("seq", 0) for r in records])
+        return snapshot, records
+
+    # --- Write ---
+    def open(self, snapshot_provider):
+        """
+        เริ่มเขียน journal
+
+        Args:
+            snapshot_provider: callable ที่คืน state ปัจจุบัน (dict ที่ json.dumps ได้) สำหรับ compaction
+        """
+        with self._io_lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._snapshot_provider = snapshot_provider
+            self._file = open(self.journal_path, "a", encoding="utf-8")
+            _fsync_dir(self.directory)
+        self._stop.clear()
+        self._sync_thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self._sync_thread.start()
+
+    def record(self, op: str, data: dict):
+        """
+        ต่อ record ลง buffer ใน memory - writer thread เป็นผู้เขียนไฟล์ + fsync (ไม่ block event loop)
+        ครบ FSYNC_BATCH_SIZE records -> ปลุก writer ทันที, ครบ SNAPSHOT_EVERY -> compaction
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            self._seq += 1
+            line = json.dumps({"seq": self._seq, "ts": time.time(), "op": op, "data": data},
+                              ensure_ascii=False, separators=(",", ":"))
+            self._buffer.append((self._seq, line))
+            self._since_snapshot += 1
+            self.stats["records"] += 1
+
+            if self._since_snapshot >= self.snapshot_every:
+                self.compact()
+            elif len(self._buffer) >= self.fsync_batch:
+                self._wake.set()
+
+    def compact(self):
+        """
+        ขอ snapshot ใหม่ + ล้าง journal
+
+        state ถูก serialize ที่ผู้เรียก (ให้ตรงกับ seq ณ ตอนนี้ - DB ถูกแก้จาก event loop เท่านั้น)
+        ส่วนเขียนไฟล์ / fsync / replace / truncate ทำใน writer thread
+        """
+        with self._lock:
+            if self._file is None or self._snapshot_provider is None:
+                return
+            snapshot = self._snapshot_provider()
+            snapshot["seq"] = self._seq
+            self._snapshot = (self._seq, json.dumps(snapshot, ensure_ascii=False, separators=(",", ":")))
+            self._since_snapshot = 0
+        self._wake.set()
+
+    def sync(self):
+        """เขียน + fsync records (และ snapshot) ที่ค้างอยู่ทันทีใน thread ของผู้เรียก - ใช้ตอนปิด/ทดสอบ"""
+        with self._io_lock:
+            self._drain()
+
+    def _drain(self):
+        """เขียน buffer ลงไฟล์ (ต้องถือ _io_lock) - snapshot ที่รออยู่จะถูกเขียนหลัง records ที่มาก่อนมัน"""
+        with self._lock:
+            entries, self._buffer = self._buffer, []
+            pending_snapshot, self._snapshot = self._snapshot, None
+        if self._file is None or (not entries and pending_snapshot is None):
+            return
+
+        if entries:
+            self._file.write("".join(line + "\n" for _, line in entries))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._last_sync = time.monotonic()
+            self.stats["fsyncs"] += 1
+
+        if pending_snapshot is not None:
+            snapshot_seq, text = pending_snapshot
+            tmp_path = self.snapshot_path.with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+            _fsync_dir(self.directory)
+
+            # snapshot ครอบคลุมทุก record จนถึง snapshot_seq - เริ่ม journal ใหม่ด้วย records ที่ตามมา
+            self._file.close()
+            self._file = open(self.journal_path, "w", encoding="utf-8")
+            later = [line for seq, line in entries if seq > snapshot_seq]
+            if later:
+                self._file.write("".join(line + "\n" for line in later))
+                self._file.flush()
+            os.fsync(self._file.fileno())
+            self.stats["snapshots"] += 1
+            self.stats["last_snapshot_time"] = time.time()
+
+    def _writer_loop(self):
+        """Writer thread: เขียน + fsync ทุก fsync_interval หรือเมื่อถูกปลุก (ครบ batch / compaction)"""
+        while not self._stop.is_set():
+            self._wake.wait(self.fsync_interval)
+            self._wake.clear()
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"⚠️ Journal background write error: {e}")
+
+    def close(self):
+        """เขียน + fsync ที่เหลือแล้วปิดไฟล์"""
+        self._stop.set()
+        self._wake.set()
+        if self._sync_thread:
+            self._sync_thread.join(timeout=1.0)
+        with self._io_lock:
+            if self._file is None:
+                return
+            self._drain()
+            with self._lock:
+                self._file.close()
+                self._file = None
+
+    def get_status(self) -> dict:
+        return {
+            "directory": str(self.directory),
+            "open": self._file is not None,
+            "seq": self._seq,
+            "pending_fsync": len(self._buffer),
+            "snapshot_pending": self._snapshot is not None,
+            "records_since_snapshot": self._since_snapshot,
+            "fsync_batch": self.fsync_batch,
+            "fsync_interval_ms": int(self.fsync_interval * 1000),
+            "snapshot_every": self.snapshot_every,
+            **self.stats
+        }
@@ -0,0 +1,108 @@
+# core/led_color.py
+"""
+Color pipeline ของ LED strip: gamma + brightness + current budget
+
+- gamma / brightness รวมเป็น lookup table 256 ค่า (สร้างใหม่เฉพาะตอนตั้งค่า)
+- ทั้ง frame ถูกแปลงเป็น bytes แล้วใช้ bytes.translate (loop ใน C ไม่ใช่ Python ต่อ pixel)
+- ประมาณกระแสของ frame (mA) จากผลรวมค่าสี; ถ้าเกิน budget จะลดทุก pixel ตามสัดส่วน
+  เพื่อไม่ให้ไฟ 5V ของ Pi ตก (เช่น เปิดทั้งชั้นเป็นสีขาว)
+
+WS2812: ~20 mA ต่อสีที่ค่า 255, ~1 mA ต่อดวงตอนดับ (ปรับได้ด้วย env)
+"""
+
+import itertools
+import os
+
+# === LED Color / Power Configuration ===
+LED_GAMMA = float(os.environ.get("SMART_SHELF_LED_GAMMA", "2.2"))
+LED_BRIGHTNESS = float(os.environ.get("SMART_SHELF_LED_BRIGHTNESS", "1.0"))              # 0.0 - 1.0
+LED_CURRENT_BUDGET_MA = float(os.environ.get("SMART_SHELF_LED_BUDGET_MA", "2000"))       # 0 = ไม่จำกัด
+LED_MA_PER_CHANNEL = float(os.environ.get("SMART_SHELF_LED_MA_PER_CHANNEL", "20"))       # mA ที่ค่า 255
+LED_IDLE_MA = float(os.environ.get("SMART_SHELF_LED_IDLE_MA", "1"))                      # mA ต่อดวง
+
+
+def _build_table(gamma: float, brightness: float) -> bytes:
+    return bytes(min(255, int(round(((value / 255) ** gamma) * 255 * brightness))) for value in range(256))
+
+
+def _clamp(value) -> int:
+    return max(0, min(255, int(value)))
+
+
+class ColorPipeline:
+    """แปลง frame สีที่สั่ง -> สีที่ส่งให้ strip จริง (เรียกใน render thread)"""
+
+    def __init__(self, gamma: float = LED_GAMMA, brightness: float = LED_BRIGHTNESS,
+                 budget_ma: float = LED_CURRENT_BUDGET_MA, ma_per_channel: float = LED_MA_PER_CHANNEL,
+                 idle_ma: float = LED_IDLE_MA):
+        self.gamma = 1.0
+        self.brightness = 1.0
+        self.budget_ma = 0.0
+        self.ma_per_channel = ma_per_channel
+        self.idle_ma = idle_ma
+        self._table = _build_table(1.0, 1.0)
+        self.configure(gamma=gamma, brightness=brightness, budget_ma=budget_ma)
+
+        self.stats = {
+            "requested_ma": 0.0,       # frame ล่าสุดหลัง gamma/brightness ก่อนจำกัด
+            "estimated_ma": 0.0,       # frame ล่าสุดที่ส่งจริง
+            "scale": 1.0,              # ตัวคูณจาก budget (1.0 = ไม่ถูกจำกัด)
+            "max_estimated_ma": 0.0,
+            "limited_frames": 0
+        }
+
+    def configure(self, gamma: float = None, brightness: float = None, budget_ma: float = None) -> dict:
+        """เปลี่ยนค่า (None = คงเดิม) - ValueError ถ้าค่าไม่ถูกต้อง"""
+        gamma = self.gamma if gamma is None else float(gamma)
+        brightness = self.brightness if brightness is None else float(brightness)
+        budget_ma = self.budget_ma if budget_ma is None else float(budget_ma)
+        if not 0.1 <= gamma <= 5.0:
+            raise ValueError("gamma must be between 0.1 and 5.0")
+        if not 0.0 <= brightness <= 1.0:
+            raise ValueError("brightness must be between 0.0 and 1.0")
+        if budget_ma < 0:
+            raise ValueError("budget_ma must be >= 0 (0 = unlimited)")
+        self._table = _build_table(gamma, brightness)     # แทนที่ทั้ง object - render thread ไม่เห็นครึ่งๆ กลางๆ
+        self.gamma, self.brightness, self.budget_ma = gamma, brightness, budget_ma
+        return self.get_config()
+
+    def estimate_ma(self, flat: bytes, pixels: int) -> float:
+        return sum(flat) * self.ma_per_channel / 255 + pixels * self.idle_ma
+
+    def apply(self, frame: list) -> list:
+        """frame [(r, g, b), ...] -> frame ที่ผ่าน gamma / brightness / budget แล้ว"""
+        pixels = len(frame)
+        try:
+            flat = bytes(itertools.chain.from_iterable(frame))
+        except (TypeError, ValueError):
+            flat = bytes(_clamp(value) for value in itertools.chain.from_iterable(frame))
+        flat = flat.translate(self._table)
+
+        requested_ma = self.estimate_ma(flat, pixels)
+        estimated_ma, scale = requested_ma, 1.0
+        idle_ma = pixels * self.idle_ma
+        if self.budget_ma and requested_ma > self.budget_ma and requested_ma > idle_ma:
+            scale = max(0.0, (self.budget_ma - idle_ma) / (requested_ma - idle_ma))
+            flat = flat.translate(bytes(int(value * scale) for value in range(256)))
+            estimated_ma = self.estimate_ma(flat, pixels)
+            self.stats["limited_frames"] += 1
+
+        self.stats["requested_ma"] = round(requested_ma, 1)
+        self.stats["estimated_ma"] = round(estimated_ma, 1)
+        self.stats["scale"] = round(scale, 3)
+        self.stats["max_estimated_ma"] = max(self.stats["max_estimated_ma"], self.stats["estimated_ma"])
+
+        channels = iter(flat)
+        return list(zip(channels, channels, channels))
+
+    def get_config(self) -> dict:
+        return {
+            "gamma": self.gamma,
+            "brightness": self.brightness,
+            "budget_ma": self.budget_ma,
+            "ma_per_channel": self.ma_per_channel,
+            "idle_ma_per_pixel": self.idle_ma
+        }
+
+    def get_status(self) -> dict:
+        return {**self.get_config(), **self.stats}
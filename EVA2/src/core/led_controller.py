@@ -1,131 +1,352 @@
 # core/led_controller.py
 
+import math
+import re
+import time
+
 from core.database import get_shelf_config
+from core.led_drivers import create_driver, resolve_driver_kind
+from core.led_engine import led_engine
 
 # ---------- Hardware LED Mapping (ตามข้อกำหนด hardware จริง) ----------
 def _total_pixels(cfg: dict) -> int:
     """คำนวณจำนวน LED ทั้งหมดจาก shelf configuration"""
     return sum(int(v) for v in cfg.values())
 
-def idx(level: int, block: int) -> int:
+# Lookup table (สร้างใหม่เฉพาะตอน layout เปลี่ยน - refresh_led_config)
+_LED_MAP = {}          # (level, block) -> LED index
+_LEVEL_RANGES = {}     # level -> (start_index, end_index)
+_LED_ORDER = []        # (level, block) เรียงตาม LED index
+
+def _build_led_map(cfg: dict = None):
     """
-    แปลง (level, block) -> LED index
+    สร้าง (level, block) -> LED index จาก shelf configuration
     - เริ่มที่ L<top> B1 = 0
     - ซ้าย→ขวาในชั้น, แล้วลงชั้นถัดไป
     - ตัวอย่าง: L4B1=0, L4B2=1, ..., L3B1=6, L3B2=7, ..., L1B6=23
     """
-    cfg = get_shelf_config()
-    # ตรวจสอบตำแหน่งมีจริง
-    if level not in cfg or not (1 <= block <= int(cfg[level])):
-        return -1
-
+    global _LED_MAP, _LEVEL_RANGES, _LED_ORDER
+    if cfg is None:
+        cfg = get_shelf_config()
+    led_map, level_ranges, order = {}, {}, []
     # ลำดับชั้นจากบนลงล่าง: 4,3,2,1, ...
-    order = sorted(cfg.keys(), reverse=True)
-
-    # offset = รวมจำนวนบล็อกจากทุกชั้นที่อยู่ "เหนือ" ชั้นเป้าหมาย
-    offset = 0
-    for lv in order:
-        if lv == level:
-            break
-        offset += int(cfg[lv])
+    for level in sorted(cfg.keys(), reverse=True):
+        blocks = int(cfg[level])
+        start = len(order)
+        for block in range(1, blocks + 1):
+            led_map[(level, block)] = len(order)
+            order.append((level, block))
+        if blocks > 0:
+            level_ranges[level] = (start, start + blocks - 1)
+    _LED_MAP, _LEVEL_RANGES, _LED_ORDER = led_map, level_ranges, order
 
-    # index ภายในชั้น = block เริ่มที่ 1
-    return offset + (block - 1)
+def idx(level: int, block: int) -> int:
+    """แปลง (level, block) -> LED index (-1 ถ้าไม่มีตำแหน่งนี้)"""
+    return _LED_MAP.get((level, block), -1)
 
 # ---------- State / Hardware ----------
+# _led_state = framebuffer (สีล่าสุดที่สั่ง) - render thread ใน core/led_engine.py เป็นผู้ push ไปที่ strip
+# ฟังก์ชันด้านล่างแค่เขียน framebuffer แล้วคืนทันที (ไม่ block event loop)
+# ทุกคำสั่งเทียบกับ _led_state ก่อน: pixel ที่สีเท่าเดิมไม่ถูกเขียน, คำสั่งที่ไม่เปลี่ยนอะไรเลยไม่ขอ frame ใหม่
+_build_led_map()
 NUM_PIXELS = _total_pixels(get_shelf_config())
 _led_state = [(0, 0, 0)] * max(1, NUM_PIXELS)
+_LED_STATS = {"updates": 0, "noop_updates": 0, "pixel_writes": 0, "skipped_writes": 0}
 
-try:
-    import pi5neo, time
-    neo = pi5neo.Pi5Neo('/dev/spidev0.0', NUM_PIXELS, 800)
+# output driver (pi5neo / multi-strip / mock / record) - core/led_drivers.py
+LED_MOCK = resolve_driver_kind() == "mock"
 
-    def refresh_led_config():
-        global neo, NUM_PIXELS, _led_state
-        cfg = get_shelf_config()
-        new_pixels = _total_pixels(cfg)
-        if new_pixels != NUM_PIXELS:
-            NUM_PIXELS = new_pixels
-            _led_state = [(0, 0, 0)] * max(1, NUM_PIXELS)
-            neo = pi5neo.Pi5Neo('/dev/spidev0.0', NUM_PIXELS, 800)
-        # clear ด้วยคำสั่งที่คุณต้องการ
-        neo.fill_strip(0, 0, 0)
-        neo.update_strip()
-        time.sleep(0.01)
-        print(f"💡 LED reinit: {NUM_PIXELS} pixels")
-
-    def set_led(level, block, r, g, b):
-        i = idx(level, block)
-        if i < 0 or i >= NUM_PIXELS:
-            return {"ok": False, "error": f"Invalid L{level}B{block}"}
-        _led_state[i] = (r, g, b)
-        neo.set_led_color(i, r, g, b)
-        neo.update_strip()
-        time.sleep(0.002)
-        return {"ok": True, "index": i}
-
-    def set_led_batch(leds):
-        errors, count = [], 0
-        # clear ก่อนเสมอด้วยคำสั่งที่กำหนด
-        neo.fill_strip(0, 0, 0)
-        for led in leds:
-            lv = int(led.get('level', 0))
-            bk = int(led.get('block', 0))
-            r  = int(led.get('r', 0)); g = int(led.get('g', 0)); b = int(led.get('b', 0))
-            i = idx(lv, bk)
-            if 0 <= i < NUM_PIXELS:
-                _led_state[i] = (r, g, b)
-                neo.set_led_color(i, r, g, b)
-                count += 1
-            else:
-                errors.append(f"L{lv}B{bk}: invalid")
-        neo.update_strip()
-        time.sleep(0.003)
-        out = {"ok": True, "count": count, "total_requested": len(leds)}
-        if errors: out["errors"] = errors
-        return out
-
-    def clear_all_leds():
-        global _led_state
-        _led_state = [(0, 0, 0)] * NUM_PIXELS
-        neo.fill_strip(0, 0, 0)
-        neo.update_strip()
-        time.sleep(0.01)
-        return {"ok": True, "pixels_cleared": NUM_PIXELS}
-
-except ImportError:
-    # -------- MOCK fallback (ไม่มีฮาร์ดแวร์) --------
-    def refresh_led_config():
-        global NUM_PIXELS, _led_state
-        NUM_PIXELS = _total_pixels(get_shelf_config())
+
+def _open_strip(num_pixels: int):
+    """สร้าง output driver ตาม layout ปัจจุบัน (เรียกใน render thread)"""
+    return create_driver(num_pixels, _LEVEL_RANGES)
+
+
+led_engine.attach(_led_state, _open_strip)
+
+
+def _result(result: dict) -> dict:
+    if LED_MOCK:
+        result["mock"] = True
+    return result
+
+
+def _commit(changed: int, skipped: int, force: bool = False) -> bool:
+    """นับสถิติ แล้วขอ frame ใหม่เฉพาะเมื่อมี pixel เปลี่ยน (force = effect ถูกยกเลิก)"""
+    _LED_STATS["updates"] += 1
+    _LED_STATS["pixel_writes"] += changed
+    _LED_STATS["skipped_writes"] += skipped
+    if not changed and not force:
+        _LED_STATS["noop_updates"] += 1
+        return False
+    led_engine.request_frame()
+    return True
+
+
+def refresh_led_config():
+    """สร้าง lookup table + framebuffer ใหม่ตาม layout ปัจจุบัน แล้ว clear strip"""
+    global NUM_PIXELS, _led_state
+    cfg = get_shelf_config()
+    with led_engine.lock:
+        _clear_effects()     # index เดิมใช้ไม่ได้กับ layout ใหม่
+        _build_led_map(cfg)
+        NUM_PIXELS = _total_pixels(cfg)
         _led_state = [(0, 0, 0)] * max(1, NUM_PIXELS)
-        print(f"[MOCK] LED reinit: {NUM_PIXELS} pixels")
-
-    def set_led(level, block, r, g, b):
-        i = idx(level, block)
-        if 0 <= i < len(_led_state):
-            _led_state[i] = (r, g, b)
-            print(f"[MOCK] set i={i} -> ({r},{g},{b})")
-            return {"ok": True, "index": i, "mock": True}
-        return {"ok": False, "error": "invalid index", "mock": True}
-
-    def set_led_batch(leds):
-        ok = 0; errs = []
-        for led in leds:
-            i = idx(int(led.get('level',0)), int(led.get('block',0)))
-            if 0 <= i < len(_led_state):
-                _led_state[i] = (int(led.get('r',0)), int(led.get('g',0)), int(led.get('b',0)))
-                ok += 1
-            else:
-                errs.append(str(led))
-        print(f"[MOCK] batch set {ok}/{len(leds)}")
-        return {"ok": True, "count": ok, "errors": errs, "mock": True}
-
-    def clear_all_leds():
-        global _led_state
-        _led_state = [(0, 0, 0)] * len(_led_state)
-        print(f"[MOCK] clear {len(_led_state)}")
-        return {"ok": True}
+        led_engine.attach(_led_state, _open_strip, reopen=True)   # multi-strip mapping ขึ้นกับ layout
+    led_engine.request_frame()
+    print(f"💡 LED reinit: {NUM_PIXELS} pixels")
+
+
+def set_led(level, block, r, g, b):
+    i = idx(level, block)
+    if i < 0 or i >= NUM_PIXELS:
+        return _result({"ok": False, "error": f"Invalid L{level}B{block}"})
+    color = (r, g, b)
+    with led_engine.lock:
+        released = _release_pixel(i)     # คำสั่งล่าสุดชนะ - ยกเลิก effect ของ pixel นี้
+        changed = _led_state[i] != color
+        if changed:
+            _led_state[i] = color
+    _commit(int(changed), int(not changed), force=released)
+    return _result({"ok": True, "index": i, "changed": changed})
+
+
+def set_led_batch(leds):
+    """
+    แสดงเฉพาะ LED ที่ระบุ (ที่เหลือดับ) เป็น frame เดียว
+    เขียนเฉพาะ pixel ที่ต่างจาก _led_state - ถ้า frame เหมือนเดิมทั้งหมดจะไม่ push เลย
+    """
+    errors, count = [], 0
+    led_map = _LED_MAP
+    target = {}
+    for led in leds:
+        lv = int(led.get('level', 0))
+        bk = int(led.get('block', 0))
+        r  = int(led.get('r', 0)); g = int(led.get('g', 0)); b = int(led.get('b', 0))
+        i = led_map.get((lv, bk), -1)
+        if 0 <= i < NUM_PIXELS:
+            target[i] = (r, g, b)
+            count += 1
+        else:
+            errors.append(f"L{lv}B{bk}: invalid")
+
+    changed = _apply_frame(target)
+    out = {"ok": True, "count": count, "total_requested": len(leds),
+           "changed": changed, "skipped": NUM_PIXELS - changed}
+    if errors: out["errors"] = errors
+    return _result(out)
+
+
+def _apply_frame(target: dict) -> int:
+    """เขียน frame เป้าหมาย {index: color} (index อื่นดับ) ลง _led_state - คืนจำนวน pixel ที่เปลี่ยน"""
+    off = (0, 0, 0)
+    changed = 0
+    with led_engine.lock:
+        released = _clear_effects()      # frame ใหม่ทั้ง strip - ยกเลิก effects ทั้งหมด
+        frame = _led_state
+        total = len(frame)
+        for i in range(total):
+            color = target.get(i, off)
+            if frame[i] != color:
+                frame[i] = color
+                changed += 1
+    _commit(changed, total - changed, force=released > 0)
+    return changed
+
+
+def clear_all_leds():
+    changed = _apply_frame({})
+    return _result({"ok": True, "pixels_cleared": NUM_PIXELS, "changed": changed})
+
+
+# ---------- Animation Effects ----------
+# effect ทำงานใน render thread (tick ทุก frame interval) แทน setTimeout + fetch หลายรอบจาก UI
+# - effect วาดทับ framebuffer; pixel ละ 1 effect (effect ใหม่ / set_led ทับของเดิม)
+# - set_led_batch / clear_all_leds ยกเลิก effects ทั้งหมด
+# - ttl: ครบเวลาแล้ว effect หยุดและ LED ดับเอง / stop_effect: หยุดแล้วกลับไปแสดงสีใน framebuffer
+LED_EFFECTS = ("solid", "blink", "breathe", "chase")
+LED_COLORS = {
+    "red": (255, 0, 0),
+    "green": (0, 255, 0),
+    "blue": (0, 0, 255),
+    "yellow": (255, 255, 0),
+    "purple": (128, 0, 128),
+    "orange": (255, 165, 0),
+    "white": (255, 255, 255),
+    "off": (0, 0, 0),
+}
+_EFFECTS = {}           # effect_id -> effect
+_PIXEL_EFFECTS = {}     # LED index -> effect_id
+_effect_counter = 0
+
+def _parse_position(position: str):
+    match = re.match(r'^L(\d+)B(\d+)$', str(position).upper().strip())
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+def _release_pixel(i: int) -> bool:
+    """เอา pixel ออกจาก effect ที่ครอบครองอยู่ (ต้องถือ led_engine.lock)"""
+    effect_id = _PIXEL_EFFECTS.pop(i, None)
+    if effect_id is None:
+        return False
+    effect = _EFFECTS.get(effect_id)
+    if effect is not None:
+        effect["pixels"].remove(i)
+        if not effect["pixels"]:
+            del _EFFECTS[effect_id]
+    return True
+
+def _clear_effects() -> int:
+    count = len(_EFFECTS)
+    _EFFECTS.clear()
+    _PIXEL_EFFECTS.clear()
+    return count
+
+def start_effect(effect: str, positions: list = None, levels: list = None, color=(0, 0, 255),
+                 period: float = 1.0, ttl: float = None, width: int = 1) -> dict:
+    """
+    เริ่ม animation บนตำแหน่ง ("L1B2") และ/หรือทั้งชั้น
+    - solid: สีคงที่ (ใช้กับ ttl = เปิดแล้วดับเอง)
+    - blink: ติด/ดับ ครึ่งละ period/2
+    - breathe: ค่อยๆ สว่าง-มืด รอบละ period วินาที
+    - chase: ไฟวิ่งตามลำดับตำแหน่ง (width ดวง) ครบรอบใน period วินาที
+    """
+    global _effect_counter
+    if effect not in LED_EFFECTS:
+        return {"ok": False, "error": f"Unknown effect '{effect}' (supported: {', '.join(LED_EFFECTS)})"}
+    if period <= 0:
+        return {"ok": False, "error": "period must be > 0"}
+
+    pixels, errors = [], []
+    for position in positions or []:
+        parsed = _parse_position(position)
+        i = idx(*parsed) if parsed else -1
+        if i < 0:
+            errors.append(f"{position}: invalid")
+        else:
+            pixels.append(i)
+    for level in levels or []:
+        start, end = _LEVEL_RANGES.get(int(level), (-1, -1))
+        if start < 0:
+            errors.append(f"L{level}: invalid")
+        else:
+            pixels.extend(range(start, end + 1))
+    pixels = list(dict.fromkeys(pixels))     # ตัดซ้ำ คงลำดับ (ลำดับของ chase)
+    if not pixels:
+        return {"ok": False, "error": "No valid positions", "errors": errors}
+
+    now = time.monotonic()
+    with led_engine.lock:
+        for i in pixels:
+            _release_pixel(i)
+        _effect_counter += 1
+        effect_id = _effect_counter
+        _EFFECTS[effect_id] = {
+            "effect": effect,
+            "pixels": pixels,
+            "color": tuple(int(v) for v in color),
+            "period": float(period),
+            "width": max(1, int(width)),
+            "ttl": ttl,
+            "started": now,
+            "expires": now + ttl if ttl else None
+        }
+        for i in pixels:
+            _PIXEL_EFFECTS[i] = effect_id
+    led_engine.request_frame()
+    out = {"ok": True, "effect_id": effect_id, "effect": effect, "pixels": len(pixels), "ttl": ttl}
+    if errors: out["errors"] = errors
+    return _result(out)
+
+def stop_effect(effect_id: int = None) -> dict:
+    """หยุด effect (None = ทั้งหมด) - pixel กลับไปแสดงสีใน framebuffer"""
+    with led_engine.lock:
+        if effect_id is None:
+            stopped = _clear_effects()
+        else:
+            effect = _EFFECTS.get(effect_id)
+            stopped = 0
+            if effect is not None:
+                for i in list(effect["pixels"]):
+                    _release_pixel(i)
+                stopped = 1
+    if stopped:
+        led_engine.request_frame()
+    return _result({"ok": True, "stopped": stopped})
+
+def list_effects() -> list:
+    now = time.monotonic()
+    with led_engine.lock:
+        return [{
+            "effect_id": effect_id,
+            "effect": effect["effect"],
+            "positions": [f"L{_LED_ORDER[i][0]}B{_LED_ORDER[i][1]}" for i in effect["pixels"]],
+            "color": effect["color"],
+            "period": effect["period"],
+            "running_s": round(now - effect["started"], 2),
+            "remaining_s": round(max(0.0, effect["expires"] - now), 2) if effect["expires"] else None
+        } for effect_id, effect in _EFFECTS.items()]
+
+def _effect_pixels(effect: dict, frame: list, elapsed: float):
+    off = (0, 0, 0)
+    color, period, pixels = effect["color"], effect["period"], effect["pixels"]
+    kind = effect["effect"]
+    if kind == "chase":
+        n = len(pixels)
+        head = int(elapsed / (period / n)) % n
+        width = effect["width"]
+        for k, i in enumerate(pixels):
+            frame[i] = color if (head - k) % n < width else off
+        return
+    if kind == "blink":
+        value = color if (elapsed % period) < period / 2 else off
+    elif kind == "breathe":
+        level = (1 - math.cos(2 * math.pi * elapsed / period)) / 2
+        value = (int(color[0] * level), int(color[1] * level), int(color[2] * level))
+    else:
+        value = color
+    for i in pixels:
+        frame[i] = value
+
+def _compose_effects(frame: list, now: float) -> bool:
+    """compositor ของ led_engine (render thread, ถือ lock): วาด effects ทับ frame - คืน True ถ้ายังต้อง tick ต่อ"""
+    if not _EFFECTS:
+        return False
+    off = (0, 0, 0)
+    expired = [effect_id for effect_id, effect in _EFFECTS.items()
+               if effect["expires"] is not None and now >= effect["expires"]]
+    for effect_id in expired:
+        for i in _EFFECTS.pop(effect_id)["pixels"]:
+            _PIXEL_EFFECTS.pop(i, None)
+            if i < len(_led_state):
+                _led_state[i] = off      # ttl ครบ -> ดับ
+                frame[i] = off
+    animating = False
+    for effect in _EFFECTS.values():
+        _effect_pixels(effect, frame, now - effect["started"])
+        animating = animating or effect["effect"] != "solid" or effect["expires"] is not None
+    return animating
+
+led_engine.set_compositor(_compose_effects)
+
+
+# ---------- Power / Color ----------
+def get_led_power() -> dict:
+    """ค่า gamma / brightness / current budget + กระแสโดยประมาณของ frame ล่าสุด"""
+    return led_engine.color_pipeline.get_status()
+
+def configure_led_power(gamma: float = None, brightness: float = None, budget_ma: float = None) -> dict:
+    """เปลี่ยนค่า color pipeline แล้ว render frame ปัจจุบันใหม่ (ValueError ถ้าค่าไม่ถูกต้อง)"""
+    config = led_engine.color_pipeline.configure(gamma=gamma, brightness=brightness, budget_ma=budget_ma)
+    led_engine.request_frame()
+    return config
+
+
+def get_led_status() -> dict:
+    """สถานะ framebuffer + render thread"""
+    with led_engine.lock:
+        lit = sum(1 for color in _led_state if color != (0, 0, 0))
+    return {"pixels": NUM_PIXELS, "lit": lit, "mock": LED_MOCK, "driver": resolve_driver_kind(), **_LED_STATS,
+            "effects": len(_EFFECTS), "power": get_led_power(), "engine": led_engine.get_status()}
 
 # ---------- Debug Functions ----------
 def debug_mapping():
@@ -140,38 +361,36 @@ def debug_mapping():
     print(f"{'Level':<6} {'Block':<6} {'Index':<6} {'Position':<12}")
     print("-" * 40)
     
-    # แสดงตามลำดับชั้นจากบนลงล่าง
-    for level in sorted(cfg.keys(), reverse=True):
-        for block in range(1, int(cfg[level]) + 1):
-            index = idx(level, block)
-            position = f"L{level}B{block}"
-            print(f"{level:<6} {block:<6} {index:<6} {position:<12}")
+    # แสดงตามลำดับ LED index (ชั้นบนลงล่าง)
+    for index, (level, block) in enumerate(_LED_ORDER):
+        position = f"L{level}B{block}"
+        print(f"{level:<6} {block:<6} {index:<6} {position:<12}")
     
     return {"config": cfg, "total_pixels": total}
 
 def validate_expected_mapping():
-    """ตรวจสอบ mapping ตามที่คาดหวัง - ตรงกับการเดินสายจริง"""
-    # ตัวอย่างตรวจที่สอดคล้องลวดจริง (4×6)
-    expected = {
-        (4,1): 0,   # ชั้น 4 เริ่มต้น
-        (4,6): 5,   # ชั้น 4 จบ
-        (3,1): 6,   # ชั้น 3 เริ่มต้น
-        (3,6): 11,  # ชั้น 3 จบ
-        (2,1): 12,  # ชั้น 2 เริ่มต้น
-        (2,6): 17,  # ชั้น 2 จบ
-        (1,1): 18,  # ชั้น 1 เริ่มต้น
-        (1,6): 23,  # ชั้น 1 จบ
-    }
-    
+    """
+    ตรวจสอบ mapping ตามการเดินสายจริง (ตาม layout ปัจจุบัน ไม่ใช่ 4×6 ตายตัว):
+    ชั้นบนสุดเริ่มที่ 0, ซ้าย→ขวาในชั้น, ชั้นถัดไปต่อจากชั้นก่อนหน้า
+    """
     print("🔍 Validating Expected Mapping:")
     all_correct = True
+    next_start = 0
     
-    for (level, block), expected_idx in expected.items():
-        actual_idx = idx(level, block)
-        status = "✅" if actual_idx == expected_idx else "❌"
-        print(f"{status} L{level}B{block} -> {actual_idx} (expected {expected_idx})")
-        if actual_idx != expected_idx:
-            all_correct = False
+    for level in sorted(_LEVEL_RANGES.keys(), reverse=True):
+        start, end = _LEVEL_RANGES[level]
+        expected = {(level, 1): next_start, (level, end - start + 1): next_start + end - start}
+        for (lv, block), expected_idx in expected.items():
+            actual_idx = idx(lv, block)
+            status = "✅" if actual_idx == expected_idx else "❌"
+            print(f"{status} L{lv}B{block} -> {actual_idx} (expected {expected_idx})")
+            if actual_idx != expected_idx:
+                all_correct = False
+        next_start = end + 1
+    
+    if next_start != NUM_PIXELS:
+        print(f"❌ Mapping covers {next_start} LEDs, strip has {NUM_PIXELS}")
+        all_correct = False
     
     return all_correct
 
@@ -181,14 +400,7 @@ def get_led_range_for_level(level: int) -> tuple:
     ส่งกลับ (start_index, end_index) สำหรับชั้นที่ระบุ
     ใช้สำหรับการควบคุม LED ทั้งชั้น
     """
-    cfg = get_shelf_config()
-    if level not in cfg:
-        return (-1, -1)
-    
-    start_idx = idx(level, 1)  # Block แรกของชั้น
-    end_idx = idx(level, int(cfg[level]))  # Block สุดท้ายของชั้น
-    
-    return (start_idx, end_idx)
+    return _LEVEL_RANGES.get(level, (-1, -1))
 
 def create_level_led_batch(level: int, r: int, g: int, b: int) -> list:
     """
@@ -0,0 +1,248 @@
+# core/led_drivers.py
+"""
+LED output drivers (render thread ใน core/led_engine.py เป็นผู้เรียก)
+
+Driver interface:
+    driver = SomeDriver(num_pixels, ...)
+    driver.show(frame, dirty)   # frame = [(r, g, b)] ทั้ง strip, dirty = index ที่เปลี่ยน หรือ None = ทั้งหมด
+    driver.close()
+    driver.describe() -> dict
+
+- Pi5NeoDriver: strip เดียวผ่าน SPI (pi5neo)
+- MultiStripDriver: หลาย strip (คนละ SPI bus / chip-select) แต่ละ strip รับ pixel ชุดของตัวเอง
+  (เช่น 1 strip ต่อชั้น) และ update พร้อมกันคนละ thread - strip ที่ไม่มี pixel เปลี่ยนไม่ถูกส่ง
+- MockDriver: แสดง frame ทาง log (ไม่มีฮาร์ดแวร์) - เฉพาะเมื่อ pixel ที่ติดเปลี่ยน และไม่เกิน 1 บรรทัด/วินาที
+- RecordingDriver: เก็บทุก frame พร้อม timestamp ไว้ในหน่วยความจำ (ส่งต่อให้ driver อื่นได้)
+  และบันทึกลงไฟล์ binary ถ้าระบุ path (core/led_recording.py, ดูด้วย led_replay.py)
+
+เลือกด้วย SMART_SHELF_LED_DRIVER=auto|pi5neo|multi|mock|record
+SMART_SHELF_LED_STRIPS="/dev/spidev0.0=4,3;/dev/spidev1.0=2,1"  (device=levels ตามลำดับการเดินสาย)
+SMART_SHELF_LED_RECORD_FILE=data/led_frames.ledr  บันทึกทุก frame ลงไฟล์ (ใช้ร่วมกับ driver ใดก็ได้)
+"""
+
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pi5neo
+    PI5NEO_AVAILABLE = True
+except ImportError:
+    PI5NEO_AVAILABLE = False
+
+# === LED Driver Configuration ===
+LED_DRIVER = os.environ.get("SMART_SHELF_LED_DRIVER", "auto").lower()
+LED_STRIPS = os.environ.get("SMART_SHELF_LED_STRIPS", "")
+LED_RECORD_FILE = os.environ.get("SMART_SHELF_LED_RECORD_FILE", "")
+LED_SPI_DEVICE = "/dev/spidev0.0"
+LED_SPI_SPEED_KHZ = 800
+LED_RECORD_FRAMES = 2000       # frame ที่ RecordingDriver เก็บไว้ล่าสุด
+LED_MOCK_LOG_INTERVAL = 1.0    # วินาที ระหว่าง log ของ MockDriver (effect render ~50 fps)
+
+
+class Pi5NeoDriver:
+    """WS2812 strip เดียวผ่าน SPI"""
+
+    name = "pi5neo"
+
+    def __init__(self, num_pixels: int, device: str = LED_SPI_DEVICE, speed_khz: int = LED_SPI_SPEED_KHZ):
+        self.num_pixels = num_pixels
+        self.device = device
+        self.neo = pi5neo.Pi5Neo(device, num_pixels, speed_khz)
+
+    def show(self, frame: list, dirty=None):
+        neo = self.neo
+        for i in (range(len(frame)) if dirty is None else dirty):
+            r, g, b = frame[i]
+            neo.set_led_color(i, r, g, b)
+        neo.update_strip()
+
+    def close(self):
+        close = getattr(self.neo, "close", None)
+        if close is not None:
+            close()
+
+    def describe(self) -> dict:
+        return {"driver": self.name, "device": self.device, "pixels": self.num_pixels}
+
+
+class MockDriver:
+    """แสดง frame ทาง log แทน strip จริง (ข้าม frame ที่เหมือนเดิม และจำกัดความถี่ของ log)"""
+
+    name = "mock"
+
+    def __init__(self, num_pixels: int, label: str = "", log_interval: float = LED_MOCK_LOG_INTERVAL):
+        self.num_pixels = num_pixels
+        self.label = label
+        self.log_interval = log_interval
+        self.frames = 0
+        self.unlogged = 0          # frame ที่เปลี่ยนแต่ไม่ได้ log (เร็วกว่า log_interval)
+        self._last_lit = None
+        self._last_log = None
+        print(f"[MOCK] LED strip opened{f' {label}' if label else ''}: {num_pixels} pixels")
+
+    def show(self, frame: list, dirty=None):
+        self.frames += 1
+        lit = [f"{i}=({r},{g},{b})" for i, (r, g, b) in enumerate(frame) if r or g or b]
+        if lit == self._last_lit:
+            return
+        self._last_lit = lit
+        now = time.monotonic()
+        if self._last_log is not None and now - self._last_log < self.log_interval:
+            self.unlogged += 1
+            return
+        self._last_log = now
+        skipped = f" (+{self.unlogged} frames not logged)" if self.unlogged else ""
+        self.unlogged = 0
+        print(f"[MOCK]{f' {self.label}' if self.label else ''} frame: {len(lit)}/{len(frame)} lit "
+              f"{' '.join(lit[:8])}{' ...' if len(lit) > 8 else ''}{skipped}")
+
+    def close(self):
+        pass
+
+    def describe(self) -> dict:
+        return {"driver": self.name, "pixels": self.num_pixels, "frames": self.frames}
+
+
+class RecordingDriver:
+    """
+    เก็บทุก frame (monotonic timestamp, tuple ของสี) - ส่งต่อให้ inner driver ถ้ามี
+    path: บันทึกลงไฟล์ด้วย (meta = ข้อมูล layout สำหรับแปลง "L2B3" ตอนอ่าน)
+    """
+
+    name = "record"
+
+    def __init__(self, num_pixels: int, inner=None, max_frames: int = LED_RECORD_FRAMES,
+                 path: str = None, meta: dict = None):
+        self.num_pixels = num_pixels
+        self.inner = inner
+        self.frames = deque(maxlen=max_frames)
+        self.total_frames = 0
+        self.writer = None
+        if path:
+            from core.led_recording import FrameWriter
+            self.writer = FrameWriter(path, num_pixels, meta)
+
+    def show(self, frame: list, dirty=None):
+        t = time.monotonic()
+        self.frames.append((t, tuple(frame)))
+        self.total_frames += 1
+        if self.writer is not None:
+            self.writer.write(frame, dirty, t)
+        if self.inner is not None:
+            self.inner.show(frame, dirty)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.inner is not None:
+            self.inner.close()
+
+    def describe(self) -> dict:
+        info = {"driver": self.name, "pixels": self.num_pixels, "recorded": len(self.frames),
+                "total_frames": self.total_frames}
+        if self.writer is not None:
+            info["file"] = self.writer.path
+        if self.inner is not None:
+            info["inner"] = self.inner.describe()
+        return info
+
+
+class MultiStripDriver:
+    """
+    หลาย strip update พร้อมกัน
+    strips: [(driver_factory, [global index ตามลำดับ pixel บน strip นั้น])]
+    """
+
+    name = "multi"
+
+    def __init__(self, num_pixels: int, strips: list):
+        self.num_pixels = num_pixels
+        self.strips = []           # (driver, indices, {global index: local index})
+        for factory, indices in strips:
+            indices = [i for i in indices if 0 <= i < num_pixels]
+            if not indices:
+                continue
+            self.strips.append((factory(len(indices)), indices, {g: k for k, g in enumerate(indices)}))
+        mapped = sum(len(indices) for _, indices, _ in self.strips)
+        if mapped < num_pixels:
+            print(f"⚠️ LED multi-strip: {num_pixels - mapped} pixels are not on any strip")
+        self._pool = ThreadPoolExecutor(max_workers=max(1, len(self.strips)), thread_name_prefix="led-strip")
+
+    def _show_strip(self, driver, indices, frame, local_dirty):
+        driver.show([frame[i] for i in indices], local_dirty)
+
+    def show(self, frame: list, dirty=None):
+        jobs = []
+        for driver, indices, local in self.strips:
+            if dirty is None:
+                local_dirty = None
+            else:
+                local_dirty = [local[i] for i in dirty if i in local]
+                if not local_dirty:
+                    continue      # strip นี้ไม่มี pixel เปลี่ยน
+            jobs.append(self._pool.submit(self._show_strip, driver, indices, frame, local_dirty))
+        for job in jobs:
+            job.result()
+
+    def close(self):
+        for driver, _, _ in self.strips:
+            driver.close()
+        self._pool.shutdown(wait=False)
+
+    def describe(self) -> dict:
+        return {"driver": self.name, "pixels": self.num_pixels,
+                "strips": [{**driver.describe(), "global_start": indices[0]} for driver, indices, _ in self.strips]}
+
+
+def parse_strip_spec(spec: str) -> list:
+    """"/dev/spidev0.0=4,3;/dev/spidev1.0=2,1" -> [("/dev/spidev0.0", [4, 3]), ("/dev/spidev1.0", [2, 1])]"""
+    strips = []
+    for part in filter(None, (p.strip() for p in spec.split(";"))):
+        device, _, levels = part.partition("=")
+        strips.append((device.strip(), [int(level) for level in levels.split(",") if level.strip()]))
+    return strips
+
+
+def resolve_driver_kind(kind: str = LED_DRIVER, strips: str = LED_STRIPS) -> str:
+    if kind != "auto":
+        return kind
+    if not PI5NEO_AVAILABLE:
+        return "mock"
+    return "multi" if strips else "pi5neo"
+
+
+def create_driver(num_pixels: int, level_ranges: dict, kind: str = LED_DRIVER, strips: str = LED_STRIPS,
+                  record_file: str = LED_RECORD_FILE):
+    """
+    สร้าง driver ตาม configuration (level_ranges: level -> (start, end) จาก led_controller)
+    record_file: ครอบ driver ด้วย RecordingDriver ที่บันทึกลงไฟล์
+    """
+    kind = resolve_driver_kind(kind, strips)
+    if record_file:
+        meta = {"levels": {level: list(start_end) for level, start_end in level_ranges.items()}}
+        inner = None if kind == "record" else create_driver(num_pixels, level_ranges, kind, strips, "")
+        return RecordingDriver(num_pixels, inner=inner, path=record_file, meta=meta)
+    if kind == "pi5neo":
+        return Pi5NeoDriver(num_pixels)
+    if kind == "mock":
+        return MockDriver(num_pixels)
+    if kind == "record":
+        return RecordingDriver(num_pixels, inner=Pi5NeoDriver(num_pixels) if PI5NEO_AVAILABLE else None)
+    if kind == "multi":
+        child = (lambda device: (lambda n: Pi5NeoDriver(n, device))) if PI5NEO_AVAILABLE else \
+                (lambda device: (lambda n: MockDriver(n, device)))
+        segments = []
+        for device, levels in parse_strip_spec(strips):
+            indices = []
+            for level in levels:
+                start, end = level_ranges.get(level, (-1, -1))
+                if start >= 0:
+                    indices.extend(range(start, end + 1))
+            segments.append((child(device), indices))
+        if not segments:
+            print("⚠️ SMART_SHELF_LED_STRIPS is empty, using a single strip")
+            return create_driver(num_pixels, level_ranges, "auto", "", "")
+        return MultiStripDriver(num_pixels, segments)
+    raise ValueError(f"Unknown LED driver '{kind}' (supported: auto, pi5neo, multi, mock, record)")
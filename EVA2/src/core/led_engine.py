@@ -0,0 +1,224 @@
+# core/led_engine.py
+"""
+LED render thread (framebuffer + frame coalescing)
+
+- API handler เขียนสีลง framebuffer (back buffer) แล้วเรียก request_frame() - คืนทันที ไม่แตะ SPI
+- render thread เป็นเจ้าของ strip คนเดียว: copy framebuffer เป็น front buffer
+  แล้ว push ด้วย update_strip 1 ครั้ง ห่างกันอย่างน้อย frame_interval
+- request หลายครั้งภายใน 1 frame -> push ครั้งเดียวด้วย state ล่าสุด (coalesce)
+- เทียบ front buffer กับ frame ที่ push ล่าสุด: ส่งเฉพาะ pixel ที่เปลี่ยน (dirty) และไม่ push เลยถ้าไม่มี
+- front buffer ผ่าน color pipeline (gamma / brightness / current budget - core/led_color.py) ก่อนส่ง
+- compositor (animation effects) วาดทับ front buffer ทุก tick - ระหว่างที่มี animation
+  thread จะ render ต่อเนื่องทุก frame_interval โดยไม่ต้องมี request
+=> HTTP latency ไม่ขึ้นกับความเร็วของ strip และไม่มี time.sleep ใน event loop
+
+Output: factory(num_pixels) -> driver (core/led_drivers.py) ที่มี show(frame, dirty), close(), describe()
+        dirty = list ของ index ที่เปลี่ยน หรือ None = ทั้ง frame (หลังเปิด strip ใหม่)
+(สร้าง / เรียกใน render thread เท่านั้น)
+"""
+
+import os
+import threading
+import time
+
+from core.led_color import ColorPipeline
+
+# === LED Engine Configuration ===
+LED_FRAME_INTERVAL = float(os.environ.get("SMART_SHELF_LED_FRAME_INTERVAL", "0.02"))   # วินาที (สูงสุด 50 fps)
+
+
+class LedEngine:
+    """render thread ที่ push framebuffer ไปยัง strip"""
+
+    def __init__(self, frame_interval: float = LED_FRAME_INTERVAL, color_pipeline: ColorPipeline = None):
+        self.frame_interval = frame_interval
+        self.color_pipeline = color_pipeline if color_pipeline is not None else ColorPipeline()
+        self.lock = threading.RLock()       # ป้องกัน framebuffer (led_controller ถือ lock ตอนเขียน)
+
+        self._framebuffer = []
+        self._output_factory = None
+        self._output = None
+        self._reopen = False
+        self._shown = None                  # frame ที่ push ไปล่าสุด (None = ไม่รู้สถานะ strip)
+        self._compositor = None             # fn(frame, now) -> True ถ้ายังมี animation ที่ต้อง tick ต่อ
+        self._animating = False
+
+        self._requested = 0                 # frame ที่ถูกขอล่าสุด
+        self._pushed = 0                    # frame ที่ push แล้วล่าสุด
+        self._pushed_cond = threading.Condition(self.lock)
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stopping = False
+        self._last_render = 0.0
+
+        self.stats = {
+            "requests": 0,
+            "frames": 0,
+            "coalesced": 0,                 # request ที่รวมเข้ากับ frame อื่น (ไม่ต้อง push แยก)
+            "skipped_frames": 0,            # frame ที่เหมือนกับที่ push ไปแล้ว (ไม่ push)
+            "pixels_written": 0,
+            "errors": 0,
+            "last_error": None,
+            "last_push_ms": None,
+            "max_push_ms": 0.0
+        }
+
+    def attach(self, framebuffer: list, output_factory, reopen: bool = False):
+        """
+        ใช้ framebuffer / output ใหม่ (ตอน init หรือ layout เปลี่ยน)
+        strip ถูกเปิดใหม่ใน render thread ถ้าจำนวน pixel เปลี่ยน (หรือ reopen=True)
+        """
+        with self.lock:
+            if (reopen or self._output is None or len(framebuffer) != len(self._framebuffer)
+                    or output_factory is not self._output_factory):
+                self._reopen = True
+            self._framebuffer = framebuffer
+            self._output_factory = output_factory
+
+    def set_compositor(self, compositor):
+        """fn(frame, now) เรียกใน render thread (ถือ lock) เพื่อวาด effects ทับ framebuffer copy"""
+        with self.lock:
+            self._compositor = compositor
+
+    def request_frame(self):
+        """แจ้งว่า framebuffer เปลี่ยน - render thread จะ push ใน frame ถัดไป"""
+        with self.lock:
+            self._requested += 1
+            self.stats["requests"] += 1
+        self.start()
+        self._wakeup.set()
+
+    def flush(self, timeout: float = 1.0) -> bool:
+        """รอจนทุก request ถึงตอนนี้ถูก push แล้ว (สำหรับ script / shutdown - ห้ามเรียกใน event loop)"""
+        deadline = time.monotonic() + timeout
+        with self._pushed_cond:
+            target = self._requested
+            while self._pushed < target:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._thread is None:
+                    return False
+                self._pushed_cond.wait(remaining)
+        return True
+
+    # --- Thread ---
+    def start(self):
+        with self.lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="led-engine", daemon=True)
+            self._thread.start()
+        print(f"💡 LED engine started (frame interval {self.frame_interval * 1000:.0f} ms)")
+
+    def stop(self, timeout: float = 2.0):
+        """push frame ที่ค้าง แล้วหยุด thread และปิด strip"""
+        thread = self._thread
+        if thread is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        thread.join(timeout)
+        self._thread = None
+        print("💡 LED engine stopped")
+
+    def _run(self):
+        while True:
+            if self._stopping:
+                pass
+            elif self._animating:
+                # fixed-rate tick ระหว่างที่มี animation
+                self._wakeup.wait(max(0.0, self._last_render + self.frame_interval - time.monotonic()))
+            else:
+                self._wakeup.wait()
+            self._wakeup.clear()
+
+            with self.lock:
+                pending = self._requested > self._pushed
+            if not pending and (self._stopping or not self._animating):
+                if self._stopping:
+                    break
+                continue
+
+            # frame ละไม่เกิน 1 push - request ที่เข้ามาระหว่างรอจะรวมอยู่ใน frame นี้
+            wait = self._last_render + self.frame_interval - time.monotonic()
+            if wait > 0 and not self._stopping:
+                time.sleep(wait)
+            self._render()
+
+        self._close_output()
+
+    def _render(self):
+        with self.lock:
+            frame = list(self._framebuffer)          # front buffer
+            if self._compositor is not None:
+                self._animating = bool(self._compositor(frame, time.monotonic()))
+            frame_id = self._requested
+            batch = frame_id - self._pushed
+            reopen, self._reopen = self._reopen, False
+            factory = self._output_factory
+
+        if self.color_pipeline is not None:
+            frame = self.color_pipeline.apply(frame)
+        self._last_render = time.monotonic()
+        if reopen or self._output is None:
+            self._shown = None
+        shown = self._shown
+        if shown is None or len(shown) != len(frame):
+            dirty = None
+        else:
+            dirty = [i for i, color in enumerate(frame) if shown[i] != color]
+            if not dirty:
+                with self._pushed_cond:
+                    self._pushed = frame_id
+                    self.stats["skipped_frames"] += 1
+                    self.stats["coalesced"] += max(0, batch - 1)
+                    self._pushed_cond.notify_all()
+                return
+
+        start = time.monotonic()
+        try:
+            if reopen or self._output is None:
+                self._close_output()
+                self._output = factory(len(frame)) if factory else None
+            if self._output is not None:
+                self._output.show(frame, dirty)
+            self._shown = frame
+        except Exception as e:
+            self._shown = None     # ไม่แน่ใจว่า strip แสดงอะไรอยู่ - ครั้งหน้าส่งทั้ง frame
+            self.stats["errors"] += 1
+            self.stats["last_error"] = str(e)
+            print(f"⚠️ LED engine push failed: {e}")
+        push_ms = round((time.monotonic() - start) * 1000, 2)
+
+        with self._pushed_cond:
+            self._pushed = frame_id
+            self.stats["frames"] += 1
+            self.stats["pixels_written"] += len(frame) if dirty is None else len(dirty)
+            self.stats["coalesced"] += max(0, batch - 1)
+            self.stats["last_push_ms"] = push_ms
+            self.stats["max_push_ms"] = max(self.stats["max_push_ms"], push_ms)
+            self._pushed_cond.notify_all()
+
+    def _close_output(self):
+        output, self._output = self._output, None
+        if output is not None:
+            try:
+                output.close()
+            except Exception as e:
+                print(f"⚠️ LED output close failed: {e}")
+
+    def get_status(self) -> dict:
+        with self.lock:
+            return {
+                "running": self._thread is not None and self._thread.is_alive(),
+                "frame_interval_ms": round(self.frame_interval * 1000, 1),
+                "pixels": len(self._framebuffer),
+                "animating": self._animating,
+                "output": self._output.describe() if hasattr(self._output, "describe") else None,
+                "pending_requests": self._requested - self._pushed,
+                **self.stats
+            }
+
+
+# Global engine (framebuffer / output ผูกใน core/led_controller.py)
+led_engine = LedEngine()
@@ -0,0 +1,231 @@
+# core/led_recording.py
+"""
+LED frame recording (ไฟล์ binary) + การอ่าน / ตรวจสอบย้อนหลัง
+
+ใช้ทดสอบพฤติกรรมของ LED (ลำดับสี, เวลา, frame rate) บนเครื่อง Linux ธรรมดาโดยไม่ต้องมี strip:
+    SMART_SHELF_LED_RECORD_FILE=data/led_frames.ledr python main.py
+    python led_replay.py data/led_frames.ledr --assert "L2B3=blue>=500"
+
+File format (little-endian):
+    segment header : b"LEDR", u8 version, u32 meta_len, meta (JSON: pixels, levels, started_at)
+    record         : u8 kind, f64 time.monotonic(), u32 count
+        kind 0 FULL  : count = pixels, ตามด้วย pixels * 3 bytes (r, g, b)
+        kind 1 DELTA : count = pixel ที่เปลี่ยน, ตามด้วย count * (u16 index, r, g, b)
+        kind 2 END   : count = 0 (ปิดไฟล์ปกติ)
+    เปิด driver ใหม่ (เช่น layout เปลี่ยน) = segment ใหม่ต่อท้ายไฟล์เดิม
+"""
+
+import json
+import struct
+import time
+
+MAGIC = b"LEDR"
+VERSION = 1
+KIND_FULL, KIND_DELTA, KIND_END = 0, 1, 2
+
+_SEGMENT = struct.Struct("<4sBI")
+_RECORD = struct.Struct("<BdI")
+_DELTA = struct.Struct("<H3B")
+_MAX_DELTA_INDEX = 0xFFFF
+
+_NAMED_COLORS = {
+    "red": (255, 0, 0),
+    "green": (0, 255, 0),
+    "blue": (0, 0, 255),
+    "yellow": (255, 255, 0),
+    "purple": (128, 0, 128),
+    "orange": (255, 165, 0),
+    "white": (255, 255, 255),
+    "off": (0, 0, 0),
+}
+
+# path ที่เปิดแล้วใน process นี้ (เปิดครั้งแรก = เขียนทับ, ครั้งต่อไป = ต่อท้ายเป็น segment ใหม่)
+_OPENED_PATHS = set()
+
+
+class FrameWriter:
+    """เขียน frame ที่ส่งให้ strip ลงไฟล์ (เรียกใน render thread)"""
+
+    def __init__(self, path, num_pixels: int, meta: dict = None):
+        path = str(path)
+        mode = "ab" if path in _OPENED_PATHS else "wb"
+        _OPENED_PATHS.add(path)
+        self.path = path
+        self.num_pixels = num_pixels
+        self.frames = 0
+        self._file = open(path, mode)
+        header = json.dumps({**(meta or {}), "pixels": num_pixels, "started_at": time.time()}).encode("utf-8")
+        self._file.write(_SEGMENT.pack(MAGIC, VERSION, len(header)) + header)
+        self._file.flush()
+
+    def write(self, frame: list, dirty=None, t: float = None):
+        t = time.monotonic() if t is None else t
+        use_delta = (dirty is not None and self.frames > 0 and self.num_pixels <= _MAX_DELTA_INDEX
+                     and len(dirty) * _DELTA.size < self.num_pixels * 3)
+        if use_delta:
+            body = b"".join(_DELTA.pack(i, *frame[i]) for i in dirty)
+            record = _RECORD.pack(KIND_DELTA, t, len(dirty)) + body
+        else:
+            record = _RECORD.pack(KIND_FULL, t, len(frame)) + bytes(c for color in frame for c in color)
+        self._file.write(record)
+        self._file.flush()          # ไฟดับ / process ถูก kill ก็ยังอ่าน frame ที่ผ่านมาได้
+        self.frames += 1
+
+    def close(self, t: float = None):
+        if self._file.closed:
+            return
+        self._file.write(_RECORD.pack(KIND_END, time.monotonic() if t is None else t, 0))
+        self._file.close()
+
+
+def _to_color(color):
+    if isinstance(color, str):
+        return _NAMED_COLORS[color.lower()]
+    return tuple(int(c) for c in color)
+
+
+def _color_matches(actual, expected, scaled: bool) -> bool:
+    """scaled=True: ยอมรับสีที่ถูกลดความสว่าง (brightness / current budget) แต่สัดส่วนเดิม"""
+    if not scaled:
+        return tuple(actual) == tuple(expected)
+    if not any(actual):
+        return not any(expected)
+    ratios = []
+    for a, e in zip(actual, expected):
+        if e == 0:
+            if a != 0:
+                return False
+        else:
+            ratios.append(a / e)
+    return bool(ratios) and max(ratios) - min(ratios) <= 0.1 and min(ratios) > 0
+
+
+class LedRecording:
+    """frame ทั้งหมดจากไฟล์บันทึก (เวลาเป็นวินาทีนับจาก segment แรก)"""
+
+    def __init__(self, segments: list, frames: list, end_time: float):
+        self.segments = segments        # meta ของแต่ละ segment
+        self.frames = frames            # [(t, (colors...), segment_index)]
+        self.end_time = end_time
+
+    # --- Positions ---
+    def index_of(self, position, segment: int = 0) -> int:
+        """"L2B3" หรือ index -> LED index ตาม layout ของ segment (-1 ถ้าไม่มี)"""
+        if isinstance(position, int):
+            return position
+        text = str(position).upper().strip()
+        if text.isdigit():
+            return int(text)
+        level, _, block = text.lstrip("L").partition("B")
+        levels = self.segments[segment].get("levels", {})
+        start_end = levels.get(str(int(level)))
+        if not start_end:
+            return -1
+        index = start_end[0] + int(block) - 1
+        return index if index <= start_end[1] else -1
+
+    # --- Inspection ---
+    def spans(self, position) -> list:
+        """ช่วงเวลาที่ pixel แสดงสีเดียวกันต่อเนื่อง: [(start_s, end_s, (r, g, b))]"""
+        spans = []
+        current, started = None, None
+        for t, colors, segment in self.frames:
+            index = self.index_of(position, segment)
+            color = colors[index] if 0 <= index < len(colors) else None
+            if color != current:
+                if current is not None:
+                    spans.append((started, t, current))
+                current, started = color, t
+        if current is not None:
+            spans.append((started, self.end_time, current))
+        return spans
+
+    def summary(self) -> dict:
+        times = [t for t, _, _ in self.frames]
+        intervals = [(b - a) * 1000 for a, b in zip(times, times[1:])]
+        duration = self.end_time - times[0] if times else 0.0
+        return {
+            "segments": len(self.segments),
+            "pixels": self.segments[-1].get("pixels") if self.segments else 0,
+            "frames": len(self.frames),
+            "duration_s": round(duration, 3),
+            "fps": round((len(self.frames) - 1) / (times[-1] - times[0]), 1) if len(times) > 1 and times[-1] > times[0] else None,
+            "interval_ms": {
+                "min": round(min(intervals), 2),
+                "avg": round(sum(intervals) / len(intervals), 2),
+                "max": round(max(intervals), 2)
+            } if intervals else None
+        }
+
+    # --- Assertions ---
+    def assert_color(self, position, color, at_least_ms: float = None, at_most_ms: float = None,
+                     scaled: bool = False):
+        """
+        ตรวจว่า pixel เคยแสดง color ต่อเนื่องอย่างน้อย at_least_ms (และ/หรือไม่เกิน at_most_ms)
+        เช่น assert_color("L2B3", "blue", at_least_ms=500) - AssertionError ถ้าไม่ผ่าน
+        """
+        expected = _to_color(color)
+        durations = [(end - start) * 1000 for start, end, actual in self.spans(position)
+                     if _color_matches(actual, expected, scaled)]
+        if not durations:
+            raise AssertionError(f"{position} was never {color}")
+        if at_least_ms is not None and max(durations) < at_least_ms:
+            raise AssertionError(f"{position} was {color} for at most {max(durations):.0f} ms (expected >= {at_least_ms:.0f} ms)")
+        if at_most_ms is not None and min(durations) > at_most_ms:
+            raise AssertionError(f"{position} was {color} for at least {min(durations):.0f} ms (expected <= {at_most_ms:.0f} ms)")
+        return durations
+
+
+def read_recording(path) -> LedRecording:
+    """อ่านไฟล์บันทึก (ไฟล์ที่ถูกตัดกลางทางอ่านได้ถึง frame สุดท้ายที่สมบูรณ์)"""
+    with open(path, "rb") as f:
+        data = f.read()
+
+    segments, frames = [], []
+    colors, end_time, origin = [], None, None
+    offset = 0
+    while offset < len(data):
+        if data[offset:offset + 4] == MAGIC:
+            _, version, meta_len = _SEGMENT.unpack_from(data, offset)
+            if version != VERSION:
+                raise ValueError(f"Unsupported LED recording version {version}")
+            offset += _SEGMENT.size
+            meta = json.loads(data[offset:offset + meta_len].decode("utf-8"))
+            offset += meta_len
+            segments.append(meta)
+            colors = [(0, 0, 0)] * int(meta.get("pixels", 0))
+            continue
+
+        if offset + _RECORD.size > len(data):
+            break
+        kind, t, count = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        if origin is None:
+            origin = t
+        if kind == KIND_END:
+            end_time = t - origin
+            continue
+        if kind == KIND_FULL:
+            size = count * 3
+            if offset + size > len(data):
+                break
+            raw = data[offset:offset + size]
+            channels = iter(raw)
+            colors = list(zip(channels, channels, channels))
+            offset += size
+        elif kind == KIND_DELTA:
+            size = count * _DELTA.size
+            if offset + size > len(data):
+                break
+            colors = list(colors)
+            for _ in range(count):
+                i, r, g, b = _DELTA.unpack_from(data, offset)
+                colors[i] = (r, g, b)
+                offset += _DELTA.size
+        else:
+            raise ValueError(f"Corrupt LED recording at byte {offset}")
+        frames.append((t - origin, tuple(colors), len(segments) - 1))
+
+    if end_time is None or (frames and end_time < frames[-1][0]):
+        end_time = frames[-1][0] if frames else 0.0
+    return LedRecording(segments, frames, end_time)
@@ -160,4 +160,30 @@ class APILEDcommand(BaseModel):
         {"position": "L2B3", "r": 0, "g": 255, "b": 0},
         {"position": "L3B1", "r": 0, "g": 0, "b": 255}
     ])
-    clear_first: Optional[bool] = Field(False, example=True)
\ No newline at end of file
+    clear_first: Optional[bool] = Field(False, example=True)
+
+class LEDEffectRequest(BaseModel):
+    """Server-side LED animation (แทนการเรียก /api/led/control หลายรอบจาก UI)
+    {
+        "effect": "blink",            // solid | blink | breathe | chase
+        "positions": ["L1B2"],        // และ/หรือ "levels": [1]
+        "color": "blue",              // หรือ r/g/b
+        "period": 1.0,
+        "ttl": 10                     // optional: ครบแล้วดับเอง
+    }"""
+    effect: str = Field("blink", example="blink")
+    positions: Optional[List[str]] = Field(None, example=["L1B2"])
+    levels: Optional[List[int]] = Field(None, example=None)
+    color: Optional[str] = Field(None, example="blue")
+    r: Optional[int] = Field(None, ge=0, le=255, example=None)
+    g: Optional[int] = Field(None, ge=0, le=255, example=None)
+    b: Optional[int] = Field(None, ge=0, le=255, example=None)
+    period: float = Field(1.0, gt=0, le=60, example=1.0, description="วินาทีต่อรอบ")
+    ttl: Optional[float] = Field(None, gt=0, le=3600, example=10, description="วินาที - ครบแล้ว LED ดับเอง")
+    width: int = Field(1, ge=1, le=64, example=1, description="จำนวนดวงที่ติดพร้อมกันใน chase")
+
+class LEDPowerConfig(BaseModel):
+    """ตั้งค่า color pipeline ของ LED (ไม่ระบุ = คงค่าเดิม)"""
+    brightness: Optional[float] = Field(None, ge=0, le=1, example=0.6)
+    gamma: Optional[float] = Field(None, ge=0.1, le=5, example=2.2)
+    budget_ma: Optional[float] = Field(None, ge=0, example=2000, description="กระแสสูงสุดของ strip (mA), 0 = ไม่จำกัด")
@@ -0,0 +1,322 @@
+# core/outbox.py
+"""
+Persistent outbox สำหรับข้อความที่ต้องส่งไป Gateway
+
+- enqueue() ต่อข้อความเข้าคิวแล้วคืนทันที - ไฟล์ (1 ไฟล์ต่อข้อความ, atomic rename + fsync)
+  เขียนใน thread แยกเป็น batch (event loop ไม่รอ disk); worker ส่งเฉพาะข้อความที่อยู่บนดิสก์แล้ว
+- worker (asyncio task) ส่งทีละข้อความตามลำดับ ผ่าน handler ที่ลงทะเบียนไว้ตาม kind
+- ส่งไม่สำเร็จ -> retry แบบ exponential backoff (ข้อความถัดไปรอ เพื่อรักษาลำดับ)
+- ข้อความที่ยังไม่ได้ส่งจะถูกโหลดกลับมาส่งต่อหลัง restart
+- Gateway ปฏิเสธถาวร (handler raise PermanentDeliveryError เช่น HTTP 4xx) -> ย้ายไป dead/ ทันที
+  ไม่ retry (ไม่ให้ข้อความเดียวขวางคิวทั้งหมด); drop_head() ทิ้งหัวคิวที่ค้างด้วยมือได้
+
+Handler: async def handler(payload: dict) -> bool  (True = Gateway รับแล้ว, False = retry)
+"""
+
+import asyncio
+import json
+import os
+import pathlib
+import threading
+import time
+
+from core.journal import DATA_DIR, _fsync_dir
+
+# === Outbox Configuration ===
+OUTBOX_DIR = DATA_DIR / "outbox"
+OUTBOX_RETRY_BASE = 1.0        # วินาที (retry แรก)
+OUTBOX_RETRY_MAX = 60.0        # วินาที (backoff สูงสุด)
+OUTBOX_MAX_ATTEMPTS = None     # None = retry ไม่จำกัดสำหรับ error ชั่วคราว (ไม่ทิ้งข้อความ)
+
+
+class PermanentDeliveryError(Exception):
+    """Gateway ปฏิเสธข้อความถาวร (retry ไปก็ไม่สำเร็จ) - outbox จะ dead-letter ทันที"""
+
+
+def is_permanent_http_failure(status_code: int) -> bool:
+    """4xx = ข้อความผิด / ถูกปฏิเสธ (ยกเว้น 408 timeout และ 429 rate limit ที่ควร retry)"""
+    return 400 <= status_code < 500 and status_code not in (408, 429)
+
+
+class Outbox:
+    """Durable FIFO outbox + delivery worker"""
+
+    def __init__(self, directory=None, retry_base: float = OUTBOX_RETRY_BASE,
+                 retry_max: float = OUTBOX_RETRY_MAX, max_attempts: int = OUTBOX_MAX_ATTEMPTS):
+        self.directory = pathlib.Path(directory) if directory else OUTBOX_DIR
+        self.dead_directory = self.directory / "dead"
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.max_attempts = max_attempts
+
+        self._handlers = {}
+        self._queue = []            # [(seq, path, message)] เรียงตาม seq
+        self._seq = 0
+        self._unwritten = []        # [(seq, path, json text)] ที่ยังไม่ได้เขียนลงดิสก์
+        self._written_seq = 0       # ข้อความ seq <= นี้อยู่บนดิสก์แล้ว
+        self._lock = threading.Lock()      # _unwritten (event loop / writer thread)
+        self._io_lock = threading.Lock()   # เขียนไฟล์ทีละ batch ตามลำดับ
+        self._flush_task = None
+        self._wakeup = None
+        self._head_dropped = None   # ปลุก worker ที่รอ backoff เมื่อหัวคิวถูกทิ้ง
+        self._task = None
+        self._loaded = False
+
+        self.stats = {
+            "enqueued": 0,
+            "delivered": 0,
+            "failed_attempts": 0,
+            "dead_lettered": 0,
+            "dropped": 0,
+            "last_error": None,
+            "last_dead_letter": None,
+            "last_delivery_time": None
+        }
+        self._current_attempts = 0
+        self._next_retry_at = None
+
+    def register_handler(self, kind: str, handler):
+        """ลงทะเบียน coroutine สำหรับส่งข้อความชนิด kind"""
+        self._handlers[kind] = handler
+
+    # --- Persistence ---
+    def _load(self):
+        """โหลดข้อความที่ค้างอยู่จากดิสก์ (ตอน start)"""
+        if self._loaded:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for path in sorted(self.directory.glob("*.json")):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    message = json.load(f)
+                seq = int(path.stem)
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Outbox message unreadable, skipping {path.name}: {e}")
+                continue
+            self._queue.append((seq, path, message))
+            self._seq = max(self._seq, seq)
+        self._written_seq = self._seq
+        # ไฟล์ .tmp ที่เขียนไม่เสร็จตอนไฟดับ
+        for tmp in self.directory.glob("*.tmp"):
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+        self._loaded = True
+        if self._queue:
+            print(f"📮 Outbox: {len(self._queue)} pending Gateway messages restored")
+
+    def enqueue(self, kind: str, payload: dict = None):
+        """
+        เพิ่มข้อความเข้า outbox แล้วปลุก worker
+        worker ทำงานอยู่ -> เขียนไฟล์ใน thread แยก (ไม่ block event loop), ยังไม่ start -> เขียนทันที
+        """
+        self._load()
+        self._seq += 1
+        seq = self._seq
+        message = {"kind": kind, "payload": payload or {}, "created": time.time()}
+        path = self.directory / f"{seq:012d}.json"
+        with self._lock:
+            self._unwritten.append((seq, path, json.dumps(message, ensure_ascii=False)))
+
+        self._queue.append((seq, path, message))
+        self.stats["enqueued"] += 1
+        if self._task is not None and not self._task.done():
+            if self._flush_task is None or self._flush_task.done():
+                self._flush_task = asyncio.create_task(self._flush())
+        else:
+            self._write_pending()
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return seq
+
+    def _write_pending(self):
+        """เขียนข้อความที่ค้างทั้งหมด (tmp + fsync + rename) แล้ว fsync directory ครั้งเดียว"""
+        with self._io_lock:
+            with self._lock:
+                pending, self._unwritten = self._unwritten, []
+            if not pending:
+                return
+            for index, (seq, path, text) in enumerate(pending):
+                tmp_path = path.with_suffix(".tmp")
+                try:
+                    with open(tmp_path, "w", encoding="utf-8") as f:
+                        f.write(text)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(tmp_path, path)
+                except OSError:
+                    # เขียนไม่ได้ (เช่น disk เต็ม) - คืนข้อความที่เหลือเข้าคิวเขียน ลองใหม่รอบหน้า
+                    with self._lock:
+                        self._unwritten[:0] = pending[index:]
+                    raise
+                self._written_seq = seq
+            _fsync_dir(self.directory)
+
+    async def _flush(self):
+        while self._unwritten:
+            try:
+                await asyncio.to_thread(self._write_pending)
+            except OSError as e:
+                self.stats["last_error"] = f"outbox write failed: {e}"
+                print(f"⚠️ Outbox: writing pending messages failed ({e}), retrying in {self.retry_base:.0f}s")
+                await asyncio.sleep(self.retry_base)
+
+    async def flush(self):
+        """รอจนข้อความที่ enqueue แล้วทั้งหมดอยู่บนดิสก์"""
+        if self._flush_task is not None and not self._flush_task.done():
+            await self._flush_task
+        await self._flush()
+
+    def _remove(self, path: pathlib.Path):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _dead_letter(self, path: pathlib.Path, reason: str = None):
+        self.dead_directory.mkdir(parents=True, exist_ok=True)
+        try:
+            os.replace(path, self.dead_directory / path.name)
+        except OSError:
+            self._remove(path)
+        self.stats["dead_lettered"] += 1
+        self.stats["last_dead_letter"] = {"file": path.name, "reason": reason, "time": time.time()}
+
+    def drop_head(self, seq: int = None):
+        """
+        ทิ้งหัวคิว (ย้ายไป dead/) - ใช้เมื่อข้อความค้างและขวางข้อความอื่น
+        seq: ทิ้งเฉพาะเมื่อหัวคิวเป็น seq นี้ (กันทิ้งผิดตัวถ้าหัวคิวเพิ่งเปลี่ยน)
+
+        Returns:
+            dict ของข้อความที่ถูกทิ้ง หรือ None ถ้าคิวว่าง / seq ไม่ตรง
+        """
+        if not self._queue or (seq is not None and self._queue[0][0] != seq):
+            return None
+        if self._queue[0][0] > self._written_seq:
+            self._write_pending()   # ให้ไฟล์มีก่อนย้ายไป dead/ (ไม่ฟื้นกลับมาตอน restart)
+        head_seq, path, message = self._queue.pop(0)
+        self._dead_letter(path, "dropped manually")
+        self.stats["dropped"] += 1
+        self._current_attempts = 0
+        self._next_retry_at = None
+        if self._head_dropped is not None:
+            self._head_dropped.set()
+        print(f"🗑️ Outbox: dropped #{head_seq} ({message.get('kind')}) to dead-letter")
+        return {"seq": head_seq, "kind": message.get("kind"), "payload": message.get("payload"),
+                "created": message.get("created")}
+
+    # --- Worker ---
+    def start(self):
+        """เริ่ม worker (ต้องเรียกภายใน event loop)"""
+        self._load()
+        if self._task is not None and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._head_dropped = asyncio.Event()
+        if self._queue:
+            self._wakeup.set()
+        self._task = asyncio.create_task(self._run())
+        print(f"📮 Outbox worker started ({len(self._queue)} pending)")
+
+    async def stop(self):
+        """หยุด worker (ข้อความที่ค้างยังอยู่บนดิสก์)"""
+        if self._task is None:
+            return
+        await self.flush()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        print(f"📮 Outbox worker stopped ({len(self._queue)} pending)")
+
+    async def _run(self):
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            seq, path, message = self._queue[0]
+            if seq > self._written_seq:
+                # ส่งหลังไฟล์อยู่บนดิสก์แล้วเท่านั้น (ไม่งั้นไฟล์อาจถูกเขียนหลังลบ -> ส่งซ้ำหลัง restart)
+                await self.flush()
+                continue
+            handler = self._handlers.get(message.get("kind"))
+            if handler is None:
+                print(f"⚠️ Outbox: no handler for '{message.get('kind')}', dead-lettering #{seq}")
+                self._queue.pop(0)
+                self._dead_letter(path, "no handler")
+                continue
+
+            try:
+                delivered = bool(await handler(message.get("payload", {})))
+                error = None if delivered else "handler returned False"
+            except asyncio.CancelledError:
+                raise
+            except PermanentDeliveryError as e:
+                print(f"❌ Outbox: #{seq} ({message.get('kind')}) rejected permanently ({e}), dead-lettering")
+                self.stats["last_error"] = str(e)
+                if self._queue and self._queue[0][0] == seq:
+                    self._queue.pop(0)
+                    self._dead_letter(path, str(e))
+                self._current_attempts = 0
+                self._next_retry_at = None
+                continue
+            except Exception as e:
+                delivered = False
+                error = str(e)
+
+            if not self._queue or self._queue[0][0] != seq:
+                # หัวคิวถูก drop_head ระหว่างส่ง
+                continue
+
+            if delivered:
+                self._queue.pop(0)
+                self._remove(path)
+                self._current_attempts = 0
+                self._next_retry_at = None
+                self.stats["delivered"] += 1
+                self.stats["last_delivery_time"] = time.time()
+                continue
+
+            self._current_attempts += 1
+            self.stats["failed_attempts"] += 1
+            self.stats["last_error"] = error
+
+            if self.max_attempts is not None and self._current_attempts >= self.max_attempts:
+                print(f"❌ Outbox: giving up on #{seq} ({message.get('kind')}) after {self._current_attempts} attempts")
+                self._queue.pop(0)
+                self._dead_letter(path, f"{self._current_attempts} failed attempts: {error}")
+                self._current_attempts = 0
+                continue
+
+            delay = min(self.retry_max, self.retry_base * (2 ** (self._current_attempts - 1)))
+            self._next_retry_at = time.time() + delay
+            print(f"⏳ Outbox: #{seq} ({message.get('kind')}) failed ({error}), retry #{self._current_attempts} in {delay:.0f}s")
+            self._head_dropped.clear()
+            try:
+                await asyncio.wait_for(self._head_dropped.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def get_status(self) -> dict:
+        head = self._queue[0][2] if self._queue else None
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "pending": len(self._queue),
+            "unwritten": len(self._unwritten),
+            "head_seq": self._queue[0][0] if head else None,
+            "head_kind": head.get("kind") if head else None,
+            "head_age_s": round(time.time() - head.get("created", time.time()), 1) if head else 0,
+            "head_attempts": self._current_attempts,
+            "next_retry_at": self._next_retry_at,
+            "directory": str(self.directory),
+            **self.stats
+        }
+
+
+# Global outbox instance (ใช้ร่วมกันทั้ง application)
+outbox = Outbox()
@@ -7,10 +7,28 @@ Simple button reader class using PCF8574 I2C GPIO expander
 with debounce and callback support. Integrates directly with main server.
 
 Hardware Setup:
-- I2C Address: 0x20 (PCF8574)
-- Pins: P0, P1, P2 (3 buttons)
+- I2C Addresses: 0x20-0x27 (up to 8 x PCF8574, set by A2..A0)
+- Pins: P0-P7 on each expander -> button_index = (address - 0x20) * 8 + pin (0-63)
 - PCF8574 quasi-bidirectional I/O with weak pull-up
 - Buttons connect to GND when pressed (active LOW)
+- Optional: PCF8574 INT (open-drain, active LOW) -> Pi GPIO line
+  (INT of every expander can share the same line - wired-OR)
+
+Expanders (SMART_SHELF_BUTTON_ADDRS):
+- auto : probe 0x20-0x27 at startup and use those that answer
+- list : e.g. "0x20,0x21,0x22"
+Every cycle reads all expanders in ONE combined I2C transaction (i2c_rdwr with
+one 1-byte read per address); adapters that cannot do that fall back to one
+read_byte per address. Button -> cell mapping follows the shelf layout
+(build_button_mapping), with optional overrides in SMART_SHELF_BUTTON_MAP.
+
+Read modes (SMART_SHELF_BUTTON_MODE):
+- poll      : read the port every POLL_INTERVAL (50ms)
+- interrupt : block on the INT line via the Linux GPIO character device
+              (gpiod) and read the port only after a falling edge
+- auto      : interrupt if SMART_SHELF_BUTTON_INT_LINE is set, else poll
+Interrupt mode falls back to polling if the GPIO line cannot be used.
+SimulatedInterruptSource drives the interrupt path without hardware.
 
 Usage:
     from core.pushbutton_reader import PushButtonReader
@@ -24,25 +42,41 @@ Usage:
     reader.stop_monitoring()
 """
 
+import os
 import time
 import threading
-from typing import Callable, Dict, Optional
+from typing import Callable, Dict, List, Optional
 from dataclasses import dataclass
 
 try:
-    from smbus2 import SMBus
+    from smbus2 import SMBus, i2c_msg
     HAS_SMBUS = True
 except ImportError:
     HAS_SMBUS = False
     print("⚠️ smbus2 not available - button reader will run in simulation mode")
 
+try:
+    import gpiod
+    GPIOD_AVAILABLE = True
+except ImportError:
+    GPIOD_AVAILABLE = False
+
 # Hardware Configuration (PCF8574 only)
-I2C_ADDR = 0x20          # PCF8574 I2C address
-BUTTON_PINS = [0, 1, 2]  # GPIO pins P0, P1, P2
+I2C_ADDR = 0x20          # first PCF8574 address (A2..A0 = 000)
+MAX_EXPANDERS = 8        # 0x20-0x27
+PINS_PER_EXPANDER = 8    # P0-P7
+BUTTON_ADDRS = os.environ.get("SMART_SHELF_BUTTON_ADDRS", "auto")   # "auto" or "0x20,0x21"
+BUTTON_MAP = os.environ.get("SMART_SHELF_BUTTON_MAP", "")          # overrides: "0=L1B1;0x21:3=L2B4"
 DEBOUNCE_TIME = 0.2      # 200ms debounce
 I2C_BUS = 1              # I2C bus number
 POLL_INTERVAL = 0.05     # 50ms polling interval
 
+# Interrupt Configuration (PCF8574 INT -> Pi GPIO)
+BUTTON_MODE = os.environ.get("SMART_SHELF_BUTTON_MODE", "auto").lower()      # auto | interrupt | poll
+BUTTON_INT_CHIP = os.environ.get("SMART_SHELF_BUTTON_INT_CHIP", "/dev/gpiochip0")
+BUTTON_INT_LINE = os.environ.get("SMART_SHELF_BUTTON_INT_LINE", "")          # GPIO offset, e.g. "17"
+INT_SAFETY_INTERVAL = 1.0  # re-read the port if no interrupt arrived (missed edge recovery)
+
 @dataclass
 class ButtonState:
     """Button state tracking"""
@@ -50,64 +84,273 @@ class ButtonState:
     last_press_time: float = 0.0
     debounce_count: int = 0
 
+
+def button_index(address: int, pin: int) -> int:
+    """(0x21, 3) -> 11"""
+    return (address - I2C_ADDR) * PINS_PER_EXPANDER + pin
+
+
+def button_location(index: int) -> tuple:
+    """11 -> (0x21, 3)"""
+    return I2C_ADDR + index // PINS_PER_EXPANDER, index % PINS_PER_EXPANDER
+
+
+def parse_addresses(spec: str) -> List[int]:
+    """"0x20,0x21" -> [0x20, 0x21]; "auto" / "" -> [] (probe all)"""
+    if not spec or spec.strip().lower() == "auto":
+        return []
+    addresses = sorted({int(part, 0) for part in spec.replace(";", ",").split(",") if part.strip()})
+    for address in addresses:
+        if not I2C_ADDR <= address < I2C_ADDR + MAX_EXPANDERS:
+            raise ValueError(f"PCF8574 address 0x{address:02X} out of range 0x20-0x27")
+    return addresses
+
+
+def parse_button_map(spec: str) -> Dict[int, str]:
+    """"0=L1B1;0x21:3=L2B4" -> {0: "L1B1", 11: "L2B4"} (button index หรือ address:pin)"""
+    mapping = {}
+    for part in filter(None, (p.strip() for p in spec.replace(",", ";").split(";"))):
+        button, _, position = part.partition("=")
+        if ":" in button:
+            address, _, pin = button.partition(":")
+            index = button_index(int(address, 0), int(pin))
+        else:
+            index = int(button, 0)
+        mapping[index] = position.strip().upper()
+    return mapping
+
+
+def build_button_mapping(positions: List[str], indices: List[int],
+                         overrides: Optional[Dict[int, str]] = None) -> Dict[int, str]:
+    """
+    Map buttons to cells in layout order
+
+    Args:
+        positions: Cells in layout order (e.g. ["L1B1", "L1B2", ...])
+        indices: Available button indices in wiring order
+        overrides: Fixed button_index -> position (those buttons / cells are skipped
+                   by the automatic assignment; cells missing from the layout are dropped)
+    """
+    overrides = {i: p for i, p in (overrides or {}).items() if p in set(positions)}
+    taken = set(overrides.values())
+    free_indices = [i for i in indices if i not in overrides]
+    mapping = dict(zip(free_indices, (p for p in positions if p not in taken)))
+    mapping.update(overrides)
+    return dict(sorted(mapping.items()))
+
+
+class GpioInterruptSource:
+    """
+    PCF8574 INT line via the Linux GPIO character device (libgpiod v1 or v2 bindings)
+
+    INT goes LOW when any input differs from the last port read and is released
+    by the next read - so wait for a falling edge, then read the port.
+    """
+
+    name = "gpio"
+
+    def __init__(self, chip: str = BUTTON_INT_CHIP, line: int = 0, consumer: str = "smart-shelf-buttons"):
+        self.chip_path = chip
+        self.line = int(line)
+        self._chip = None
+        self._request = None
+        if hasattr(gpiod, "request_lines"):
+            # libgpiod v2
+            from gpiod.line import Bias, Edge
+            settings = gpiod.LineSettings(edge_detection=Edge.FALLING, bias=Bias.PULL_UP)
+            self._request = gpiod.request_lines(chip, consumer=consumer, config={self.line: settings})
+        else:
+            # libgpiod v1
+            self._chip = gpiod.Chip(chip)
+            self._request = self._chip.get_line(self.line)
+            self._request.request(consumer=consumer, type=gpiod.LINE_REQ_EV_FALLING_EDGE,
+                                  flags=getattr(gpiod, "LINE_REQ_FLAG_BIAS_PULL_UP", 0))
+
+    def wait(self, timeout: float) -> bool:
+        """Block until a falling edge (True) or timeout (False); drains queued edges"""
+        if self._chip is None:
+            if not self._request.wait_edge_events(timeout):
+                return False
+            self._request.read_edge_events()
+            return True
+        if not self._request.event_wait(sec=int(timeout), nsec=int((timeout % 1) * 1e9)):
+            return False
+        while self._request.event_wait(sec=0, nsec=0):
+            self._request.event_read()
+        return True
+
+    def close(self):
+        if self._request is not None:
+            self._request.release()
+            self._request = None
+        if self._chip is not None:
+            self._chip.close()
+            self._chip = None
+
+    def describe(self) -> Dict:
+        return {"source": self.name, "chip": self.chip_path, "line": self.line}
+
+
+class SimulatedInterruptSource:
+    """
+    Interrupt source + PCF8574 ports for testing without hardware
+
+    press(index) / release(index) change the simulated port of that button's
+    expander and fire INT, exactly like the real chips - the reader then
+    reads all ports once.
+    """
+
+    name = "simulated"
+
+    def __init__(self, addresses: List[int] = (I2C_ADDR,)):
+        self.ports = {address: 0xFF for address in addresses}
+        self.reads = 0
+        self._fired = threading.Event()
+
+    def set_port(self, address: int, value: int):
+        self.ports[address] = value & 0xFF
+        self._fired.set()
+
+    def press(self, index: int):
+        address, pin = button_location(index)
+        self.set_port(address, self.ports.get(address, 0xFF) & ~(1 << pin))
+
+    def release(self, index: int):
+        address, pin = button_location(index)
+        self.set_port(address, self.ports.get(address, 0xFF) | (1 << pin))
+
+    def read_ports(self, addresses: List[int]) -> Dict[int, int]:
+        """Port sweep (clears INT like the real chips)"""
+        self.reads += 1
+        self._fired.clear()
+        return {address: self.ports.get(address, 0xFF) for address in addresses}
+
+    def wait(self, timeout: float) -> bool:
+        return self._fired.wait(timeout)
+
+    def wake(self):
+        self._fired.set()
+
+    def close(self):
+        self._fired.set()
+
+    def describe(self) -> Dict:
+        return {"source": self.name, "ports": {f"0x{a:02X}": f"0x{v:02X}" for a, v in self.ports.items()}}
+
+
 class PushButtonReader:
     """
     Push button reader for PCF8574 (quasi-bidirectional I/O)
     
     How it works:
     - Write 0xFF once during init = set all pins as input with weak pull-up
-    - Read 1 byte from port: 1=HIGH(released), 0=LOW(pressed)
+    - Read 1 byte from each port: 1=HIGH(released), 0=LOW(pressed)
     - Software inverts: pressed=True for easier handling
     """
     
-    def __init__(self, callback: Optional[Callable[[int, str], None]] = None, debug: bool = False):
+    def __init__(self, callback: Optional[Callable[[int, str], None]] = None, debug: bool = False,
+                 mode: str = BUTTON_MODE, interrupt_source=None):
         """
         Initialize button reader
         
         Args:
             callback: Function called when button pressed (button_index, position)
             debug: Enable debug logging
+            mode: "auto", "interrupt" or "poll" (default: SMART_SHELF_BUTTON_MODE)
+            interrupt_source: Use this source instead of the GPIO INT line
+                              (e.g. SimulatedInterruptSource for testing)
         """
         self.callback = callback
         self.debug = debug
         self.running = False
         self.monitor_thread = None
-        
-        # Button state tracking
-        self.button_states = {pin: ButtonState() for pin in BUTTON_PINS}
-        
-        # Position mapping (L1B1, L1B2, L1B3 by default)
-        self.position_mapping = {
-            BUTTON_PINS[0]: "L1B1",
-            BUTTON_PINS[1]: "L1B2",
-            BUTTON_PINS[2]: "L1B3",
-        }
+        self.interrupt_source = interrupt_source
+        self.stats = {"sweeps": 0, "read_errors": 0, "interrupts": 0, "safety_reads": 0, "presses": 0}
         
         # I2C setup
         self.bus = None
         self.hardware_available = False
+        self.addresses = []          # PCF8574 addresses in use (sorted)
+        self._batch_read = True      # one combined i2c_rdwr per sweep
+        configured = parse_addresses(BUTTON_ADDRS)
         
         if HAS_SMBUS:
             try:
                 self.bus = SMBus(I2C_BUS)
-                # Test I2C connection and init PCF8574
-                self.bus.read_byte(I2C_ADDR)  # Probe device
-                self._init_pcf8574()
-                self.hardware_available = True
-                self._log("✅ I2C hardware detected (PCF8574)")
+                # Probe and init PCF8574 expanders
+                self.addresses = self._probe_expanders(configured)
+                self.hardware_available = bool(self.addresses)
+                if self.hardware_available:
+                    self._log(f"✅ I2C hardware detected (PCF8574 x{len(self.addresses)}: "
+                              f"{', '.join(f'0x{a:02X}' for a in self.addresses)})")
+                else:
+                    self._log("⚠️ I2C hardware not available: no PCF8574 answered")
                 
             except Exception as e:
                 self._log(f"⚠️ I2C hardware not available: {e}")
                 self.hardware_available = False
         else:
             self._log("⚠️ Running in simulation mode (smbus2 not installed)")
+        
+        if not self.hardware_available:
+            simulated_ports = getattr(interrupt_source, "ports", None)
+            self.addresses = configured or sorted(simulated_ports or [I2C_ADDR])
+        
+        # Button state tracking (8 buttons per expander)
+        self.button_states = {i: ButtonState() for i in self.button_indices()}
+        
+        # Position mapping (L1B1, L1B2, L1B3 by default - update_button_mapping follows the layout)
+        self.position_mapping = {0: "L1B1", 1: "L1B2", 2: "L1B3"}
+        
+        self.mode = self._resolve_mode(mode)
+    
+    def _resolve_mode(self, mode: str) -> str:
+        """Pick interrupt or poll mode (interrupt needs a usable INT source)"""
+        if self.interrupt_source is not None:
+            return "interrupt"
+        if mode == "poll" or (mode == "auto" and not BUTTON_INT_LINE):
+            return "poll"
+        if mode not in ("auto", "interrupt"):
+            self._log(f"⚠️ Unknown button mode '{mode}', using poll")
+            return "poll"
+        if not BUTTON_INT_LINE:
+            print("⚠️ Button interrupt mode needs SMART_SHELF_BUTTON_INT_LINE - falling back to polling")
+            return "poll"
+        if not self.hardware_available:
+            self._log("⚠️ No I2C hardware - interrupt mode disabled, polling (simulation)")
+            return "poll"
+        if not GPIOD_AVAILABLE:
+            print("⚠️ gpiod not installed - button reader falling back to polling")
+            return "poll"
+        try:
+            self.interrupt_source = GpioInterruptSource(BUTTON_INT_CHIP, int(BUTTON_INT_LINE))
+            self._log(f"⚡ Button INT on {BUTTON_INT_CHIP} line {BUTTON_INT_LINE}")
+            return "interrupt"
+        except Exception as e:
+            print(f"⚠️ Button INT line unavailable ({e}) - falling back to polling")
+            return "poll"
     
     def _log(self, msg: str):
         """Debug logging"""
         if self.debug:
             print(f"[ButtonReader] {msg}")
     
-    def _init_pcf8574(self):
+    def _probe_expanders(self, configured: List[int]) -> List[int]:
+        """Probe configured addresses (or all of 0x20-0x27) and init those that answer"""
+        candidates = configured or range(I2C_ADDR, I2C_ADDR + MAX_EXPANDERS)
+        found = []
+        for address in candidates:
+            try:
+                self.bus.read_byte(address)  # Probe device
+            except OSError:
+                if configured:
+                    print(f"⚠️ PCF8574 at 0x{address:02X} not responding")
+                continue
+            self._init_pcf8574(address)
+            found.append(address)
+        return found
+    
+    def _init_pcf8574(self, address: int = I2C_ADDR):
         """
         Initialize PCF8574 GPIO expander
         
@@ -117,27 +360,36 @@ class PushButtonReader:
         """
         try:
             # Write all 1s to enable input mode with pull-up
-            self.bus.write_byte(I2C_ADDR, 0xFF)
-            self._log("🔧 PCF8574 initialized (all pins as input w/ pull-up)")
+            self.bus.write_byte(address, 0xFF)
+            self._log(f"🔧 PCF8574 0x{address:02X} initialized (all pins as input w/ pull-up)")
         except Exception as e:
-            self._log(f"⚠️ PCF8574 init failed: {e}")
+            self._log(f"⚠️ PCF8574 0x{address:02X} init failed: {e}")
     
-    def update_position_mapping(self, button_mapping: Dict[int, str]):
+    def button_indices(self) -> List[int]:
+        """Available button indices in wiring order (expander by expander, P0-P7)"""
+        return [button_index(address, pin) for address in self.addresses for pin in range(PINS_PER_EXPANDER)]
+    
+    def update_position_mapping(self, button_mapping: Dict[int, str], replace: bool = False):
         """
         Update position mapping for buttons
         
         Args:
             button_mapping: Dict mapping button_index to position (e.g., {0: "L1B1", 1: "L2B3"})
+            replace: Drop the previous mapping first (layout changed)
         """
-        self.position_mapping.update(button_mapping)
-        self._log(f"📍 Position mapping updated: {self.position_mapping}")
+        if replace:
+            self.position_mapping = dict(button_mapping)
+        else:
+            self.position_mapping.update(button_mapping)
+        self._log(f"📍 Position mapping updated: {len(self.position_mapping)} buttons")
     
     def read_buttons(self) -> Dict[int, bool]:
         """
-        Read current button states from PCF8574
+        Read current button states from all PCF8574 expanders (one sweep)
         
         Returns:
-            Dict mapping button_index to pressed state (True = pressed)
+            Dict mapping button_index to pressed state (True = pressed);
+            buttons whose expander could not be read are left out
             
         PCF8574 logic:
         - Read entire 8-bit port
@@ -145,70 +397,115 @@ class PushButtonReader:
         - 0 = LOW (button pressed)
         - Invert bits so pressed = True for easier handling
         """
-        if not self.hardware_available:
+        if self.hardware_available:
+            read_ports = self._read_ports_i2c
+        elif hasattr(self.interrupt_source, "read_ports"):
+            read_ports = lambda: self.interrupt_source.read_ports(self.addresses)     # simulated PCF8574
+        else:
             # Simulation mode - no buttons pressed
-            return {i: False for i in BUTTON_PINS}
+            return {i: False for i in self.button_states}
         
         try:
-            # Read entire port (8 bits)
-            port_val = self.bus.read_byte(I2C_ADDR)
+            # Read every port (8 bits each) - also releases the INT line
+            ports = read_ports()
+            self.stats["sweeps"] += 1
             
             # Extract and invert button states
             # pressed = True when pin is LOW (0)
             button_states = {}
-            for pin in BUTTON_PINS:
-                pin_high = bool((port_val >> pin) & 0x01)
-                button_states[pin] = not pin_high  # Invert: LOW = pressed
+            for address, port_val in ports.items():
+                base = button_index(address, 0)
+                for pin in range(PINS_PER_EXPANDER):
+                    button_states[base + pin] = not ((port_val >> pin) & 0x01)  # Invert: LOW = pressed
             
             return button_states
             
         except Exception as e:
+            self.stats["read_errors"] += 1
             self._log(f"⚠️ Button read error: {e}")
-            return {i: False for i in BUTTON_PINS}
+            return {}
     
-    def _monitor_loop(self):
-        """Main monitoring loop (runs in separate thread)"""
-        self._log("🔄 Button monitoring started")
+    def _read_ports_i2c(self) -> Dict[int, int]:
+        """
+        One sweep over all expanders
         
-        while self.running:
+        Combined transaction (repeated START, 1 byte from each address) = one ioctl
+        regardless of the number of expanders. If the adapter rejects it but every
+        expander answers individually, batching is switched off for good.
+        """
+        batch_error = None
+        if self._batch_read and len(self.addresses) > 1:
+            msgs = [i2c_msg.read(address, 1) for address in self.addresses]
             try:
-                # Read current button states
-                current_states = self.read_buttons()
-                now = time.time()
+                self.bus.i2c_rdwr(*msgs)
+                return {address: bytes(msg)[0] for address, msg in zip(self.addresses, msgs)}
+            except OSError as e:
+                batch_error = e
+        
+        ports = {}
+        for address in self.addresses:
+            try:
+                ports[address] = self.bus.read_byte(address)
+            except OSError as e:
+                self.stats["read_errors"] += 1
+                self._log(f"⚠️ PCF8574 0x{address:02X} read error: {e}")
+        
+        if batch_error is not None and len(ports) == len(self.addresses):
+            self._batch_read = False
+            print(f"⚠️ I2C adapter rejected combined read ({batch_error}) - reading expanders one by one")
+        return ports
+    
+    def _process_states(self, current_states: Dict[int, bool], now: float):
+        """Edge detection + debounce for one sweep"""
+        for pin, cur in current_states.items():
+            st = self.button_states.get(pin)
+            if st is None:
+                continue
+            
+            # Detect button press (rising edge)
+            if cur and not st.pressed:
+                # Button press detected
+                time_since_last = now - st.last_press_time
                 
-                # Process each button
-                for pin in BUTTON_PINS:
-                    cur = current_states.get(pin, False)
-                    st = self.button_states[pin]
+                if time_since_last > DEBOUNCE_TIME:
+                    st.pressed = True
+                    st.last_press_time = now
+                    self.stats["presses"] += 1
+                    
+                    # Get position mapping
+                    pos = self.position_mapping.get(pin)
+                    if pos is None:
+                        self._log(f"🔘 Button {pin} pressed (not mapped to a cell)")
+                        continue
                     
-                    # Detect button press (rising edge)
-                    if cur and not st.pressed:
-                        # Button press detected
-                        time_since_last = now - st.last_press_time
-                        
-                        if time_since_last > DEBOUNCE_TIME:
-                            st.pressed = True
-                            st.last_press_time = now
-                            
-                            # Get position mapping
-                            pos = self.position_mapping.get(pin, f"L1B{pin+1}")
-                            
-                            self._log(f"🔘 Button {pin} pressed -> {pos}")
-                            
-                            # Trigger callback
-                            if self.callback:
-                                try:
-                                    self.callback(pin, pos)
-                                except Exception as cb_err:
-                                    self._log(f"⚠️ Callback error: {cb_err}")
-                        else:
-                            # Too soon after last press - ignore (debounce)
-                            self._log(f"🔇 Button {pin} debounced ({time_since_last:.3f}s)")
+                    self._log(f"🔘 Button {pin} pressed -> {pos}")
                     
-                    # Detect button release (falling edge)
-                    elif not cur and st.pressed:
-                        st.pressed = False
-                        self._log(f"🔘 Button {pin} released")
+                    # Trigger callback
+                    if self.callback:
+                        try:
+                            self.callback(pin, pos)
+                        except Exception as cb_err:
+                            self._log(f"⚠️ Callback error: {cb_err}")
+                else:
+                    # Too soon after last press - ignore (debounce)
+                    self._log(f"🔇 Button {pin} debounced ({time_since_last:.3f}s)")
+            
+            # Detect button release (falling edge)
+            elif not cur and st.pressed:
+                st.pressed = False
+                self._log(f"🔘 Button {pin} released")
+    
+    def _monitor_loop(self):
+        """Main monitoring loop (runs in separate thread)"""
+        self._log(f"🔄 Button monitoring started ({self.mode})")
+        
+        if self.mode == "interrupt":
+            self._interrupt_loop()
+        
+        # Polling (default, or fallback after an interrupt source failure)
+        while self.running:
+            try:
+                self._process_states(self.read_buttons(), time.time())
                 
                 # Sleep until next poll
                 time.sleep(POLL_INTERVAL)
@@ -219,6 +516,34 @@ class PushButtonReader:
         
         self._log("🛑 Button monitoring stopped")
     
+    def _interrupt_loop(self):
+        """
+        Wait on INT and read the port only when it fires
+        
+        The initial read releases INT in case it was already LOW (edge missed before
+        start); a safety read every INT_SAFETY_INTERVAL recovers from any other missed edge.
+        """
+        source = self.interrupt_source
+        self._process_states(self.read_buttons(), time.time())
+        
+        while self.running:
+            try:
+                fired = source.wait(INT_SAFETY_INTERVAL)
+                if not self.running:
+                    break
+                self.stats["interrupts" if fired else "safety_reads"] += 1
+                self._process_states(self.read_buttons(), time.time())
+                
+            except Exception as e:
+                print(f"⚠️ Button interrupt source failed ({e}) - falling back to polling")
+                self.mode = "poll"
+                try:
+                    source.close()
+                except Exception:
+                    pass
+                self.interrupt_source = None
+                return
+    
     def start_monitoring(self):
         """Start button monitoring (non-blocking)"""
         if self.running:
@@ -237,8 +562,11 @@ class PushButtonReader:
             return
         
         self.running = False
+        wake = getattr(self.interrupt_source, "wake", None)
+        if wake:
+            wake()
         if self.monitor_thread:
-            self.monitor_thread.join(timeout=1.0)
+            self.monitor_thread.join(timeout=INT_SAFETY_INTERVAL + 0.5 if self.mode == "interrupt" else 1.0)
         
         self._log("⏹️ Button monitoring stopped")
     
@@ -252,10 +580,17 @@ class PushButtonReader:
         return {
             "hardware_available": self.hardware_available,
             "running": self.running,
+            "mode": self.mode,
+            "interrupt_source": self.interrupt_source.describe() if self.interrupt_source else None,
+            "stats": dict(self.stats),
             "position_mapping": self.position_mapping.copy(),
-            "current_states": self.read_buttons(),
-            "i2c_address": f"0x{I2C_ADDR:02X}",
-            "button_pins": BUTTON_PINS,
+            # interrupt mode: tracked state (a status read must not consume the INT edge)
+            "current_states": ({pin: st.pressed for pin, st in self.button_states.items()}
+                               if self.mode == "interrupt" else self.read_buttons()),
+            "i2c_addresses": [f"0x{address:02X}" for address in self.addresses],
+            "buttons": len(self.button_states),
+            "mapped_buttons": len(self.position_mapping),
+            "batched_reads": self._batch_read and len(self.addresses) > 1,
             "debounce_time_ms": int(DEBOUNCE_TIME * 1000),
             "poll_interval_ms": int(POLL_INTERVAL * 1000)
         }
@@ -265,13 +600,13 @@ class PushButtonReader:
         Simulate button press for testing (when hardware not available)
         
         Args:
-            button_index: Button index to simulate (0-2)
+            button_index: Button index to simulate (must be mapped to a cell)
         """
-        if button_index not in BUTTON_PINS:
+        position = self.position_mapping.get(button_index)
+        if position is None:
             self._log(f"⚠️ Invalid button index: {button_index}")
             return
         
-        position = self.position_mapping.get(button_index, f"L1B{button_index+1}")
         self._log(f"🧪 Simulating button {button_index} press -> {position}")
         
         if self.callback:
@@ -287,18 +622,23 @@ class PushButtonReader:
             return None
         
         try:
-            # Read entire port (8 bits)
-            port_val = self.bus.read_byte(I2C_ADDR)
-            
-            self._log(f"🔍 Raw PORT (PCF8574): 0x{port_val:02X} ({port_val:08b})")
-            
-            # Show individual pin states
-            for pin in BUTTON_PINS:
-                pin_high = bool((port_val >> pin) & 0x01)
-                button_pressed = not pin_high  # Inverted logic
-                self._log(f"  P{pin}: {'HIGH' if pin_high else 'LOW'} -> Button {'PRESSED' if button_pressed else 'RELEASED'}")
+            ports = {}
+            for address in self.addresses:
+                # Read entire port (8 bits)
+                port_val = self.bus.read_byte(address)
+                ports[address] = port_val
+                
+                self._log(f"🔍 Raw PORT (PCF8574 0x{address:02X}): 0x{port_val:02X} ({port_val:08b})")
+                
+                # Show individual pin states
+                for pin in range(PINS_PER_EXPANDER):
+                    pin_high = bool((port_val >> pin) & 0x01)
+                    button_pressed = not pin_high  # Inverted logic
+                    index = button_index(address, pin)
+                    self._log(f"  P{pin} (button {index}, {self.position_mapping.get(index, '-')}): "
+                              f"{'HIGH' if pin_high else 'LOW'} -> Button {'PRESSED' if button_pressed else 'RELEASED'}")
             
-            return port_val
+            return ports
             
         except Exception as e:
             self._log(f"⚠️ GPIO debug error: {e}")
@@ -307,6 +647,11 @@ class PushButtonReader:
     def __del__(self):
         """Cleanup on destruction"""
         self.stop_monitoring()
+        if self.interrupt_source:
+            try:
+                self.interrupt_source.close()
+            except:
+                pass
         if self.bus:
             try:
                 self.bus.close()
@@ -335,6 +680,18 @@ if __name__ == "__main__":
         for i in range(3):
             reader.simulate_button_press(i)
             time.sleep(0.5)
+        
+        print("🧪 Testing interrupt path (SimulatedInterruptSource)...")
+        sim = SimulatedInterruptSource()
+        int_reader = PushButtonReader(callback=test_callback, debug=True, interrupt_source=sim)
+        int_reader.start_monitoring()
+        for i in range(3):
+            sim.press(i)
+            time.sleep(0.1)
+            sim.release(i)
+            time.sleep(0.3)
+        int_reader.stop_monitoring()
+        print(f"📊 Interrupt stats: {int_reader.stats}")
     
     # Keep running for manual testing
     try:
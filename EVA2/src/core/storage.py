@@ -0,0 +1,464 @@
+# core/storage.py
+"""
+Storage backends สำหรับ DB (shelf_state + job queue + job history)
+
+core.database เก็บสถานะหลักไว้ใน memory (CellStore / JobQueue) เสมอเพื่อให้ lookup เร็ว
+และส่งทุกการเปลี่ยนแปลง (op, data) มาที่ backend ที่เลือกไว้ตอนเริ่มระบบ:
+
+- "memory" : MemoryStorage - เขียน journal + snapshot ในเครื่อง (core.journal)
+- "sqlite" : SQLiteStorage - ตาราง jobs / cells / lots / job_history ใน SQLite (WAL mode)
+              writer thread เขียนเป็น batch (event loop ไม่รอ disk) - ข้อมูลทั้งหมดยังโหลดเข้า memory ตอนเริ่มระบบ
+
+เลือก engine ด้วย environment variable SMART_SHELF_STORAGE (ค่าเริ่มต้น "memory")
+"""
+
+import collections
+import json
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+
+from core.journal import Journal, DATA_DIR
+
+# === Storage Configuration ===
+STORAGE_ENGINE = os.environ.get("SMART_SHELF_STORAGE", "memory").lower()
+SQLITE_FILE = "smart_shelf.db"
+MEMORY_HISTORY_LIMIT = 1000  # จำนวน history events ที่ MemoryStorage เก็บไว้
+SQLITE_WRITE_INTERVAL = 0.1  # writer thread commit การเปลี่ยนแปลงที่ค้างทุก 100ms
+SQLITE_WRITE_BATCH = 64      # หรือทันทีเมื่อค้างครบ 64 รายการ
+
+# op ที่บันทึกลง job history
+_HISTORY_EVENTS = {
+    "job_create": "created",
+    "job_complete": "completed",
+    "job_cancel": "canceled",
+    "job_update": "updated",
+}
+
+
+class StorageBackend:
+    """Interface ของ storage backend (ทุก method เรียกจาก core.database)"""
+
+    name = "base"
+
+    def load(self):
+        """
+        โหลดสถานะที่บันทึกไว้
+
+        Returns:
+            tuple: (snapshot dict หรือ None, list ของ records {"op", "data"} ที่ต้อง replay ต่อ)
+        """
+        return None, []
+
+    def open(self, snapshot_provider):
+        """เริ่มรับการเปลี่ยนแปลง (snapshot_provider คืน state ปัจจุบันทั้งหมด)"""
+
+    def record(self, op: str, data: dict):
+        """บันทึกการเปลี่ยนแปลง 1 รายการ (เรียกหลังจาก apply ใน memory แล้ว)"""
+
+    def checkpoint(self):
+        """บันทึกสถานะทั้งหมดจาก snapshot_provider (ใช้หลังการเปลี่ยนโครงสร้าง เช่น layout)"""
+
+    def close(self):
+        """flush ที่ค้างแล้วปิด backend"""
+
+    def get_job_history(self, lot_no: str = None, job_id: str = None, limit: int = 100) -> list:
+        """ดึงประวัติ jobs ล่าสุด (ใหม่สุดก่อน)"""
+        return []
+
+    def get_status(self) -> dict:
+        return {"engine": self.name}
+
+
+class MemoryStorage(StorageBackend):
+    """สถานะอยู่ใน memory, ความทนทานมาจาก journal + snapshot ในเครื่อง"""
+
+    name = "memory"
+
+    def __init__(self, directory=None):
+        self.journal = Journal(directory)
+        self._history = collections.deque(maxlen=MEMORY_HISTORY_LIMIT)
+
+    def load(self):
+        return self.journal.load()
+
+    def open(self, snapshot_provider):
+        self.journal.open(snapshot_provider)
+
+    def record(self, op: str, data: dict):
+        self.journal.record(op, data)
+        if op in _HISTORY_EVENTS:
+            for entry in _history_entries(op, data):
+                self._history.append(entry)
+
+    def checkpoint(self):
+        self.journal.compact()
+
+    def close(self):
+        self.journal.close()
+
+    def get_job_history(self, lot_no: str = None, job_id: str = None, limit: int = 100) -> list:
+        results = []
+        for entry in reversed(self._history):
+            if lot_no is not None and entry["lot_no"] != lot_no:
+                continue
+            if job_id is not None and entry["job_id"] != job_id:
+                continue
+            results.append(entry)
+            if len(results) >= limit:
+                break
+        return results
+
+    def get_status(self) -> dict:
+        return {"engine": self.name, "history_size": len(self._history), "journal": self.journal.get_status()}
+
+
+def _history_entries(op: str, data: dict, now: float = None) -> list:
+    """แปลง job op เป็น history entries"""
+    event = _HISTORY_EVENTS[op]
+    now = time.time() if now is None else now
+    if op == "job_create":
+        job = data["job"]
+        return [{"ts": now, "event": event, "job_id": job.get("jobId"), "lot_no": job.get("lot_no"),
+                 "level": job.get("level"), "block": job.get("block"), "data": job}]
+    if op == "job_cancel":
+        return [{"ts": now, "event": event, "job_id": job.get("jobId"), "lot_no": data["lot_no"],
+                 "level": job.get("level"), "block": job.get("block"), "data": job}
+                for job in data.get("jobs", [])]
+    job = data.get("job") or {}
+    return [{"ts": now, "event": event, "job_id": data.get("jobId"), "lot_no": job.get("lot_no"),
+             "level": job.get("level"), "block": job.get("block"), "data": data.get("fields", job)}]
+
+
+class SQLiteStorage(StorageBackend):
+    """
+    SQLite (WAL mode) - ตาราง normalized:
+    - cells(level, block, position)            PK (level, block)
+    - lots(id, level, block, seq, lot_no, ...)  index (level, block) และ lot_no
+    - jobs(job_id, seq, lot_no, level, block, data)  PK job_id, index lot_no
+    - job_history(id, ts, event, job_id, lot_no, level, block, data)
+    - meta(key, value)                          job_counter / layout
+    ใช้ SQL คงที่ + parameters ทุกคำสั่ง (sqlite3 cache compiled statements ไว้ให้)
+
+    record() / checkpoint() แค่ serialize การเปลี่ยนแปลงต่อคิว - writer thread เขียนรวมเป็น 1 transaction
+    ต่อรอบ (เหมือน core.journal) ข้อมูลที่ใช้งานยังอยู่ใน CellStore / JobQueue ใน memory
+    SQLite เป็นที่เก็บถาวร ไม่ได้อ่านจาก disk ตามต้องการ
+    """
+
+    name = "sqlite"
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS cells (
+        level INTEGER NOT NULL,
+        block INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        PRIMARY KEY (level, block)
+    );
+    CREATE TABLE IF NOT EXISTS lots (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        level INTEGER NOT NULL,
+        block INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        lot_no TEXT NOT NULL,
+        tray_count INTEGER NOT NULL,
+        biz TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_lots_cell ON lots(level, block, seq);
+    CREATE INDEX IF NOT EXISTS idx_lots_lot_no ON lots(lot_no);
+    CREATE TABLE IF NOT EXISTS jobs (
+        job_id TEXT PRIMARY KEY,
+        seq INTEGER NOT NULL,
+        lot_no TEXT,
+        level TEXT,
+        block TEXT,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_jobs_lot_no ON jobs(lot_no);
+    CREATE INDEX IF NOT EXISTS idx_jobs_seq ON jobs(seq);
+    CREATE TABLE IF NOT EXISTS job_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts REAL NOT NULL,
+        event TEXT NOT NULL,
+        job_id TEXT,
+        lot_no TEXT,
+        level TEXT,
+        block TEXT,
+        data TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_history_job_id ON job_history(job_id);
+    CREATE INDEX IF NOT EXISTS idx_history_lot_no ON job_history(lot_no);
+    """
+
+    # --- Prepared statements ---
+    SQL_SET_META = "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)"
+    SQL_NEXT_LOT_SEQ = "SELECT COALESCE(MAX(seq), -1) + 1 FROM lots WHERE level = ? AND block = ?"
+    SQL_FIRST_LOT = "SELECT id FROM lots WHERE level = ? AND block = ? AND lot_no = ? ORDER BY seq LIMIT 1"
+    SQL_INSERT_LOT = "INSERT INTO lots (level, block, seq, lot_no, tray_count, biz) VALUES (?, ?, ?, ?, ?, ?)"
+    SQL_ADD_TRAYS = ("UPDATE lots SET tray_count = tray_count + ?, "
+                     "biz = CASE WHEN biz IS NULL OR biz = 'Unknown' THEN ? ELSE biz END WHERE id = ?")
+    SQL_SET_TRAYS = "UPDATE lots SET tray_count = ? WHERE id = ?"
+    SQL_DELETE_LOT = "DELETE FROM lots WHERE id = ?"
+    SQL_SET_BIZ = "UPDATE lots SET biz = ? WHERE lot_no = ?"
+    SQL_DELETE_CELL_LOTS = "DELETE FROM lots WHERE level = ? AND block = ?"
+    SQL_INSERT_JOB = ("INSERT OR REPLACE INTO jobs (job_id, seq, lot_no, level, block, data) "
+                      "VALUES (?, (SELECT COALESCE(MAX(seq), -1) + 1 FROM jobs), ?, ?, ?, ?)")
+    SQL_GET_JOB = "SELECT data FROM jobs WHERE job_id = ?"
+    SQL_UPDATE_JOB = "UPDATE jobs SET data = ? WHERE job_id = ?"
+    SQL_DELETE_JOB = "DELETE FROM jobs WHERE job_id = ?"
+    SQL_DELETE_LOT_JOBS = "DELETE FROM jobs WHERE lot_no = ?"
+    SQL_INSERT_HISTORY = ("INSERT INTO job_history (ts, event, job_id, lot_no, level, block, data) "
+                          "VALUES (?, ?, ?, ?, ?, ?, ?)")
+
+    def __init__(self, path=None, write_interval: float = SQLITE_WRITE_INTERVAL,
+                 write_batch: int = SQLITE_WRITE_BATCH):
+        self.path = pathlib.Path(path) if path else DATA_DIR / SQLITE_FILE
+        self.write_interval = write_interval
+        self.write_batch = write_batch
+        self._lock = threading.RLock()     # คิว (ถือสั้นๆ จาก event loop)
+        self._io_lock = threading.RLock()  # connection (writer thread / reads / close)
+        self._conn = None
+        self._snapshot_provider = None
+        self._pending = []                 # (op, ts, json text) ที่รอ writer thread
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._writer_thread = None
+        self.stats = {"writes": 0, "checkpoints": 0, "commits": 0}
+
+    def _connect(self):
+        if self._conn is not None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, cached_statements=128)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(self.SCHEMA)
+
+    def load(self):
+        with self._io_lock:
+            self._connect()
+            meta = dict(self._conn.execute("SELECT key, value FROM meta"))
+            if "version" not in meta:
+                return None, []
+
+            shelf_state = []
+            cells = {}
+            for level, block in self._conn.execute("SELECT level, block FROM cells ORDER BY position"):
+                cell = [level, block, []]
+                cells[(level, block)] = cell
+                shelf_state.append(cell)
+            for level, block, lot_no, tray_count, biz in self._conn.execute(
+                    "SELECT level, block, lot_no, tray_count, biz FROM lots ORDER BY level, block, seq"):
+                cell = cells.get((level, block))
+                if cell is not None:
+                    cell[2].append({"lot_no": lot_no, "tray_count": tray_count, "biz": biz})
+
+            jobs = [json.loads(data) for (data,) in self._conn.execute("SELECT data FROM jobs ORDER BY seq")]
+
+            snapshot = {
+                "version": int(meta["version"]),
+                "jobs": jobs,
+                "shelf_state": shelf_state,
+                "job_counter": int(meta.get("job_counter", 0)),
+                "layout": json.loads(meta.get("layout", "{}"))
+            }
+            return snapshot, []
+
+    def open(self, snapshot_provider):
+        with self._io_lock:
+            self._connect()
+            self._snapshot_provider = snapshot_provider
+        self._stop.clear()
+        self._writer_thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self._writer_thread.start()
+
+    def record(self, op: str, data: dict):
+        """serialize ตอนนี้ (data อาจถูกแก้ต่อใน memory) แล้วต่อคิวให้ writer thread"""
+        if op in ("shelf_reset", "reset"):
+            # โครงสร้าง cells เปลี่ยน - เขียนใหม่ทั้งหมดจาก snapshot
+            self.checkpoint()
+            return
+        self._enqueue(op, json.dumps(data, ensure_ascii=False))
+
+    def checkpoint(self):
+        """snapshot ถูก serialize ที่ผู้เรียก (ให้ตรงกับลำดับใน คิว) - writer thread เขียนทับทุกตาราง"""
+        if self._conn is None or self._snapshot_provider is None:
+            return
+        self._enqueue("checkpoint", json.dumps(self._snapshot_provider(), ensure_ascii=False))
+
+    def _enqueue(self, op: str, text: str):
+        with self._lock:
+            if self._conn is None:
+                return
+            self._pending.append((op, time.time(), text))
+            if len(self._pending) >= self.write_batch or op == "checkpoint":
+                self._wake.set()
+
+    def sync(self):
+        """เขียนการเปลี่ยนแปลงที่ค้างทันทีใน thread ของผู้เรียก - ใช้ตอนปิด / อ่าน history / ทดสอบ"""
+        with self._io_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if self._conn is None or not pending:
+                return
+            with self._conn:
+                for op, ts, text in pending:
+                    data = json.loads(text)
+                    if op == "checkpoint":
+                        self._write_snapshot(data)
+                        continue
+                    self._apply(op, data)
+                    if op in _HISTORY_EVENTS:
+                        self._conn.executemany(self.SQL_INSERT_HISTORY, [
+                            (e["ts"], e["event"], e["job_id"], e["lot_no"], _str_or_none(e["level"]),
+                             _str_or_none(e["block"]), json.dumps(e["data"], ensure_ascii=False))
+                            for e in _history_entries(op, data, ts)
+                        ])
+                    self.stats["writes"] += 1
+            self.stats["commits"] += 1
+
+    def _writer_loop(self):
+        """Writer thread: commit ทุก write_interval หรือเมื่อถูกปลุก (ครบ batch / checkpoint)"""
+        while not self._stop.is_set():
+            self._wake.wait(self.write_interval)
+            self._wake.clear()
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"⚠️ SQLite background write error: {e}")
+
+    def _apply(self, op: str, data: dict):
+        c = self._conn
+        if op == "lot_add":
+            row = c.execute(self.SQL_FIRST_LOT, (data["level"], data["block"], data["lot_no"])).fetchone()
+            if row:
+                c.execute(self.SQL_ADD_TRAYS, (data["tray_count"], data.get("biz", "Unknown"), row[0]))
+            else:
+                seq = c.execute(self.SQL_NEXT_LOT_SEQ, (data["level"], data["block"])).fetchone()[0]
+                c.execute(self.SQL_INSERT_LOT, (data["level"], data["block"], seq, data["lot_no"],
+                                                data["tray_count"], data.get("biz", "Unknown")))
+        elif op == "lot_remove":
+            row = c.execute(self.SQL_FIRST_LOT, (data["level"], data["block"], data["lot_no"])).fetchone()
+            if row:
+                c.execute(self.SQL_DELETE_LOT, (row[0],))
+        elif op == "lot_qty":
+            row = c.execute(self.SQL_FIRST_LOT, (data["level"], data["block"], data["lot_no"])).fetchone()
+            if row:
+                c.execute(self.SQL_SET_TRAYS, (data["tray_count"], row[0]))
+        elif op == "lot_biz":
+            c.execute(self.SQL_SET_BIZ, (data["biz"], data["lot_no"]))
+        elif op == "cell_set":
+            self._write_cell_lots(data["level"], data["block"], data["lots"])
+        elif op == "job_create":
+            job = data["job"]
+            c.execute(self.SQL_INSERT_JOB, (job.get("jobId"), job.get("lot_no"), _str_or_none(job.get("level")),
+                                            _str_or_none(job.get("block")), json.dumps(job, ensure_ascii=False)))
+            c.execute(self.SQL_SET_META, ("job_counter", str(data.get("job_counter", 0))))
+        elif op == "job_complete":
+            c.execute(self.SQL_DELETE_JOB, (data["jobId"],))
+        elif op == "job_cancel":
+            c.execute(self.SQL_DELETE_LOT_JOBS, (data["lot_no"],))
+        elif op == "job_update":
+            row = c.execute(self.SQL_GET_JOB, (data["jobId"],)).fetchone()
+            if row:
+                job = json.loads(row[0])
+                job.update(data.get("fields", {}))
+                c.execute(self.SQL_UPDATE_JOB, (json.dumps(job, ensure_ascii=False), data["jobId"]))
+
+    def _write_cell_lots(self, level: int, block: int, lots: list):
+        self._conn.execute(self.SQL_DELETE_CELL_LOTS, (level, block))
+        self._conn.executemany(self.SQL_INSERT_LOT, [
+            (level, block, seq, lot.get("lot_no"), int(lot.get("tray_count", 0)), lot.get("biz", "Unknown"))
+            for seq, lot in enumerate(lots)
+        ])
+
+    def _write_snapshot(self, snapshot: dict):
+        """เขียนทับ cells / lots / jobs / meta ทั้งหมด (อยู่ใน transaction ของ sync)"""
+        c = self._conn
+        c.execute("DELETE FROM cells")
+        c.execute("DELETE FROM lots")
+        c.execute("DELETE FROM jobs")
+        c.executemany("INSERT INTO cells (level, block, position) VALUES (?, ?, ?)", [
+            (cell[0], cell[1], position) for position, cell in enumerate(snapshot["shelf_state"])
+        ])
+        for cell in snapshot["shelf_state"]:
+            if cell[2]:
+                self._write_cell_lots(cell[0], cell[1], cell[2])
+        c.executemany(
+            "INSERT INTO jobs (job_id, seq, lot_no, level, block, data) VALUES (?, ?, ?, ?, ?, ?)",
+            [(job.get("jobId"), seq, job.get("lot_no"), _str_or_none(job.get("level")),
+              _str_or_none(job.get("block")), json.dumps(job, ensure_ascii=False))
+             for seq, job in enumerate(snapshot["jobs"])])
+        c.execute(self.SQL_SET_META, ("version", str(snapshot.get("version", 1))))
+        c.execute(self.SQL_SET_META, ("job_counter", str(snapshot.get("job_counter", 0))))
+        c.execute(self.SQL_SET_META, ("layout", json.dumps(snapshot.get("layout", {}), ensure_ascii=False)))
+        self.stats["checkpoints"] += 1
+
+    def close(self):
+        """เขียนที่ค้างแล้วปิด connection"""
+        self._stop.set()
+        self._wake.set()
+        if self._writer_thread:
+            self._writer_thread.join(timeout=1.0)
+            self._writer_thread = None
+        with self._io_lock:
+            self.sync()
+            with self._lock:
+                if self._conn is not None:
+                    self._conn.close()
+                    self._conn = None
+
+    def get_job_history(self, lot_no: str = None, job_id: str = None, limit: int = 100) -> list:
+        query = "SELECT ts, event, job_id, lot_no, level, block, data FROM job_history"
+        conditions, params = [], []
+        if lot_no is not None:
+            conditions.append("lot_no = ?")
+            params.append(lot_no)
+        if job_id is not None:
+            conditions.append("job_id = ?")
+            params.append(job_id)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(int(limit))
+
+        with self._io_lock:
+            if self._conn is None:
+                return []
+            self.sync()   # รวม events ที่ยังค้างในคิว
+            rows = self._conn.execute(query, params).fetchall()
+        return [
+            {"ts": ts, "event": event, "job_id": jid, "lot_no": lot, "level": level, "block": block,
+             "data": json.loads(data) if data else None}
+            for ts, event, jid, lot, level, block, data in rows
+        ]
+
+    def get_status(self) -> dict:
+        status = {"engine": self.name, "path": str(self.path), "open": self._conn is not None,
+                  "pending_writes": len(self._pending), **self.stats}
+        with self._io_lock:
+            if self._conn is not None:
+                status["jobs"] = self._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+                status["lots"] = self._conn.execute("SELECT COUNT(*) FROM lots").fetchone()[0]
+                status["history"] = self._conn.execute("SELECT COUNT(*) FROM job_history").fetchone()[0]
+        return status
+
+
+def _str_or_none(value):
+    return None if value is None else str(value)
+
+
+def create_storage(engine: str = None, location=None) -> StorageBackend:
+    """สร้าง storage backend ตามชื่อ engine ("memory" หรือ "sqlite")"""
+    engine = (engine or STORAGE_ENGINE).lower()
+    if engine == "sqlite":
+        return SQLiteStorage(location)
+    if engine != "memory":
+        print(f"⚠️ Unknown storage engine '{engine}', using memory")
+    return MemoryStorage(location)
@@ -0,0 +1,142 @@
+# core/sync_scheduler.py
+"""
+Debounce / coalesce การ sync shelf state ไป Gateway
+
+- notify() ถูกเรียกทุกครั้งที่ shelf เปลี่ยน (เช่น job complete) - ไม่ส่งทันที
+- worker รอจนไม่มีการเปลี่ยนแปลงใหม่ภายใน window วินาที แล้ว flush 1 ครั้ง
+- ถ้ามีการเปลี่ยนแปลงต่อเนื่องไม่หยุด จะ flush อย่างช้าที่สุดหลัง max_staleness วินาที
+  นับจากการเปลี่ยนแปลงแรกที่ยังไม่ได้ส่ง
+=> Gateway ได้ไม่เกิน 1 sync ต่อ window ไม่ว่า operator จะทำงานเร็วแค่ไหน
+
+Flush handler: callable (sync หรือ async) ที่ไม่รับ argument
+"""
+
+import asyncio
+import inspect
+import os
+import time
+
+# === Sync Scheduler Configuration ===
+SYNC_WINDOW = float(os.environ.get("SMART_SHELF_SYNC_WINDOW", "0.5"))                 # วินาที (เงียบนานเท่านี้แล้วส่ง)
+SYNC_MAX_STALENESS = float(os.environ.get("SMART_SHELF_SYNC_MAX_STALENESS", "2.0"))   # วินาที (ค้างได้นานสุด)
+
+
+class SyncScheduler:
+    """รวมการเปลี่ยนแปลงหลายครั้งเป็น flush เดียวต่อ window"""
+
+    def __init__(self, window: float = SYNC_WINDOW, max_staleness: float = SYNC_MAX_STALENESS):
+        self.window = window
+        self.max_staleness = max(window, max_staleness)
+
+        self._flush = None
+        self._pending = 0              # การเปลี่ยนแปลงที่ยังไม่ได้ flush (queue depth)
+        self._first_pending = None     # monotonic time ของการเปลี่ยนแปลงแรกที่ค้าง
+        self._last_change = None
+        self._wakeup = None
+        self._task = None
+
+        self.stats = {
+            "notifications": 0,
+            "flushes": 0,
+            "flush_errors": 0,
+            "max_batch": 0,
+            "last_flush_lag_ms": None,    # เวลาจากการเปลี่ยนแปลงแรกถึง flush
+            "last_flush_time": None
+        }
+
+    def set_flush_handler(self, handler):
+        self._flush = handler
+
+    def notify(self):
+        """แจ้งว่ามีการเปลี่ยนแปลง (เรียกจาก event loop)"""
+        now = time.monotonic()
+        if self._pending == 0:
+            self._first_pending = now
+        self._pending += 1
+        self._last_change = now
+        self.stats["notifications"] += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    # --- Worker ---
+    def start(self):
+        """เริ่ม worker (ต้องเรียกภายใน event loop)"""
+        if self._task is not None and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        if self._pending:
+            self._wakeup.set()
+        self._task = asyncio.create_task(self._run())
+        print(f"⏱️ Sync scheduler started (window {self.window}s, max staleness {self.max_staleness}s)")
+
+    async def stop(self, flush: bool = True):
+        """หยุด worker - flush การเปลี่ยนแปลงที่ค้างอยู่ก่อน (ถ้า flush=True)"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if flush and self._pending:
+            await self._do_flush()
+        print("⏱️ Sync scheduler stopped")
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            if not self._pending:
+                self._wakeup.clear()
+                continue
+
+            # รอจนเงียบครบ window หรือค้างครบ max_staleness
+            while True:
+                now = time.monotonic()
+                deadline = min(self._last_change + self.window, self._first_pending + self.max_staleness)
+                if now >= deadline:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), deadline - now)
+                except asyncio.TimeoutError:
+                    pass
+
+            self._wakeup.clear()
+            await self._do_flush()
+
+    async def _do_flush(self):
+        batch = self._pending
+        first_pending = self._first_pending
+        self._pending = 0
+        self._first_pending = None
+
+        self.stats["flushes"] += 1
+        self.stats["max_batch"] = max(self.stats["max_batch"], batch)
+        self.stats["last_flush_lag_ms"] = round((time.monotonic() - first_pending) * 1000, 1) if first_pending else 0
+        self.stats["last_flush_time"] = time.time()
+
+        if self._flush is None:
+            return
+        try:
+            result = self._flush()
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            self.stats["flush_errors"] += 1
+            print(f"⚠️ Sync scheduler flush error: {e}")
+
+    def get_status(self) -> dict:
+        lag_ms = round((time.monotonic() - self._first_pending) * 1000, 1) if self._first_pending else 0
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "window_s": self.window,
+            "max_staleness_s": self.max_staleness,
+            "queue_depth": self._pending,
+            "lag_ms": lag_ms,
+            **self.stats
+        }
+
+
+# Global scheduler สำหรับ shelf state sync (flush handler ลงทะเบียนใน api/jobs.py)
+shelf_sync_scheduler = SyncScheduler()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+ตรวจสอบ / เล่นซ้ำไฟล์บันทึก LED frames (SMART_SHELF_LED_RECORD_FILE, core/led_recording.py)
+
+Usage:
+    python led_replay.py data/led_frames.ledr                          # สรุป frames / fps / interval
+    python led_replay.py data/led_frames.ledr --timeline L2B3           # สีของตำแหน่งตามเวลา
+    python led_replay.py data/led_frames.ledr --assert "L2B3=blue>=500" --assert "L1B1=green<=2500"
+    python led_replay.py data/led_frames.ledr --play [--speed 2]        # เล่นซ้ำผ่าน LED driver (mock ถ้าไม่มี strip)
+
+--assert: <position>=<color ชื่อ หรือ r,g,b><(>= | <=)><ms>  - exit code 1 ถ้าไม่ผ่าน (ใช้ใน CI ได้)
+
+frames ถูกบันทึกหลัง colour pipeline (gamma / brightness / current budget - core/led_color.py)
+- exact match ได้เฉพาะสีที่ทุก channel เป็น 0 หรือ 255 (red, green, blue, white, ...) ที่ brightness 1.0
+- สีที่ channel ที่ไม่เป็น 0 มีค่าเท่ากัน (purple = 128,0,128 -> ~56,0,56 หลัง gamma) หรือ brightness < 1
+  ต้องใช้ --scaled:  python led_replay.py data/led_frames.ledr --scaled --assert "L1B1=purple>=500"
+- สีที่ channel ต่างกัน (orange) สัดส่วนเปลี่ยนหลัง gamma - assert ด้วยค่า r,g,b ที่เห็นใน --timeline
+"""
+
+import argparse
+import re
+import sys
+import time
+
+from core.led_recording import read_recording
+
+_ASSERT_PATTERN = re.compile(r'^\s*([^=]+)=([a-z]+|\d+,\d+,\d+)\s*(>=|<=)\s*(\d+(?:\.\d+)?)\s*$', re.IGNORECASE)
+
+
+def run_assertion(recording, expression: str, scaled: bool) -> bool:
+    match = _ASSERT_PATTERN.match(expression)
+    if not match:
+        print(f"❌ Invalid assertion '{expression}' (expected e.g. L2B3=blue>=500)")
+        return False
+    position, color, op, ms = match.groups()
+    if "," in color:
+        color = tuple(int(c) for c in color.split(","))
+    try:
+        if op == ">=":
+            recording.assert_color(position.strip(), color, at_least_ms=float(ms), scaled=scaled)
+        else:
+            recording.assert_color(position.strip(), color, at_most_ms=float(ms), scaled=scaled)
+    except (AssertionError, KeyError) as e:
+        print(f"❌ {expression}: {e}")
+        return False
+    print(f"✅ {expression}")
+    return True
+
+
+def print_timeline(recording, position: str):
+    print(f"📍 {position}")
+    for start, end, color in recording.spans(position):
+        print(f"   {start * 1000:>10.1f} ms - {end * 1000:>10.1f} ms  ({(end - start) * 1000:>8.1f} ms)  {color}")
+
+
+def play(recording, speed: float):
+    """เล่น frames ซ้ำตามจังหวะเวลาเดิมผ่าน driver ตาม SMART_SHELF_LED_DRIVER (mock ถ้าไม่มี strip)"""
+    from core.led_drivers import create_driver
+
+    driver, segment = None, None
+    start = time.monotonic()
+    try:
+        for t, colors, frame_segment in recording.frames:
+            if frame_segment != segment:
+                if driver is not None:
+                    driver.close()
+                meta = recording.segments[frame_segment]
+                levels = {int(level): tuple(start_end) for level, start_end in meta.get("levels", {}).items()}
+                driver = create_driver(len(colors), levels, record_file="")
+                segment = frame_segment
+            delay = start + t / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            driver.show(list(colors))
+    finally:
+        if driver is not None:
+            driver.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect / replay LED frame recordings")
+    parser.add_argument("path")
+    parser.add_argument("--timeline", action="append", default=[], metavar="POSITION")
+    parser.add_argument("--assert", dest="assertions", action="append", default=[], metavar="EXPR")
+    parser.add_argument("--scaled", action="store_true", help="เทียบสัดส่วนสีแทนค่า exact (สีที่ถูกลดความสว่าง เช่น purple หรือ brightness < 1)")
+    parser.add_argument("--play", action="store_true")
+    parser.add_argument("--speed", type=float, default=1.0)
+    args = parser.parse_args()
+
+    recording = read_recording(args.path)
+    summary = recording.summary()
+    print(f"🎞️ {args.path}: {summary['frames']} frames, {summary['duration_s']} s, "
+          f"{summary['segments']} segment(s), {summary['pixels']} pixels")
+    if summary["interval_ms"]:
+        interval = summary["interval_ms"]
+        print(f"   fps {summary['fps']}, frame interval min/avg/max {interval['min']}/{interval['avg']}/{interval['max']} ms")
+
+    for position in args.timeline:
+        print_timeline(recording, position)
+
+    ok = all([run_assertion(recording, expression, args.scaled) for expression in args.assertions])
+
+    if args.play:
+        play(recording, args.speed)
+
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
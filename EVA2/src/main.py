@@ -7,16 +7,43 @@ import os
 import signal
 import subprocess
 import json
-import httpx
 import asyncio
+import re
+import time
+from contextlib import asynccontextmanager
 # --- Import Routers จากไฟล์ที่เราสร้าง ---
 from api import jobs, websockets
+from api.jobs import STARTUP_STATUS
+from core.gateway import open_gateway_client, close_gateway_client
+from core.outbox import outbox
+from core.sync_scheduler import shelf_sync_scheduler
+from core.led_engine import led_engine
+from core.encoding import FastJSONResponse
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application lifespan: เปิด shared Gateway client + outbox / sync workers / LED engine ก่อน init และปิดหลัง shutdown"""
+    await open_gateway_client()
+    outbox.start()
+    shelf_sync_scheduler.start()
+    led_engine.start()
+    await startup_event()
+    try:
+        yield
+    finally:
+        await shelf_sync_scheduler.stop()   # flush sync ที่ค้างเข้า outbox ก่อนหยุด outbox
+        await outbox.stop()
+        await asyncio.to_thread(led_engine.stop)   # push frame ที่ค้างก่อนปิด strip
+        await shutdown_event()
+        await close_gateway_client()
 
 # สร้างแอปพลิเคชัน FastAPI หลัก
 app = FastAPI(
     title="Smart Shelf API (Refactored)",
     description="A professional, well-structured server for the Smart Shelf system.",
-    version="3.0.0"
+    version="3.0.0",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse   # orjson/msgspec ถ้ามี (core/encoding.py)
 )
 
 # ฟังก์ชันเรียกใช้ตอนเริ่มต้นระบบ
@@ -41,133 +68,177 @@ async def initialize_shelf_info():
         print(f"❌ Error initializing shelf info: {e}")
         return False
 
-async def initialize_shelf_layout():
-    """ดึง layout configuration จาก Gateway เมื่อเริ่มต้นระบบ"""
-    try:
-        print("🔄 Initializing shelf layout from Gateway...")
-        
-        # Import ฟังก์ชันที่จำเป็น
-        from api.jobs import fetch_layout_from_gateway, GLOBAL_SHELF_INFO
-        from core.database import update_layout_from_gateway
+async def apply_shelf_layout(layout_data):
+    """อัปเดต local configuration จาก layout ที่ดึงมาจาก Gateway (ข้ามถ้า layout ไม่เปลี่ยน)"""
+    from core.database import update_layout_from_gateway, DYNAMIC_LAYOUT
+    from api.jobs import refresh_layout_hardware
+    
+    if layout_data and layout_data.get("status") == "success":
+        gateway_layout = layout_data.get("layout", {})
         
-        # ตรวจสอบว่ามี shelf_id แล้วหรือไม่
-        shelf_id = GLOBAL_SHELF_INFO.get("shelf_id")
-        if not shelf_id:
-            print("⚠️ No shelf_id available from Gateway, skipping layout initialization")
-            return False
+        if gateway_layout:
+            if gateway_layout == DYNAMIC_LAYOUT:
+                print(f"✅ Layout from Gateway matches cached layout ({len(gateway_layout)} positions)")
+                return True
             
-        # ดึง layout จาก Gateway
-        layout_data = await fetch_layout_from_gateway(shelf_id)
-        
-        if layout_data and layout_data.get("status") == "success":
-            gateway_layout = layout_data.get("layout", {})
+            # อัปเดต local database configuration
+            update_success = update_layout_from_gateway(gateway_layout)
             
-            if gateway_layout:
-                # อัปเดต local database configuration
-                update_success = update_layout_from_gateway(gateway_layout)
-                
-                if update_success:
-                    print(f"✅ Layout initialized from Gateway: {len(gateway_layout)} positions")
-                    return True
-                else:
-                    print("⚠️ Failed to update local database with Gateway layout")
-                    return False
+            if update_success:
+                print(f"✅ Layout initialized from Gateway: {len(gateway_layout)} positions")
+                # จำนวน cell เปลี่ยน -> LED lookup table + การจับคู่ปุ่มใหม่
+                refresh_layout_hardware()
+                return True
             else:
-                print("📝 Empty layout from Gateway, using default configuration")
+                print("⚠️ Failed to update local database with Gateway layout")
                 return False
         else:
-            print("❌ Failed to fetch layout from Gateway")
+            print("📝 Empty layout from Gateway, using default configuration")
             return False
-            
-    except Exception as e:
-        print(f"❌ Error initializing layout: {e}")
+    else:
+        print("❌ Failed to fetch layout from Gateway")
         return False
 
-async def initialize_shelf_state():
-    """กู้คืน shelf state จาก Gateway เมื่อเริ่มต้นระบบ"""
+def apply_shelf_state(restored_state, shelf_changed: bool = False):
+    """
+    อัปเดต local DB ด้วย shelf state จาก Gateway - แทนที่ทั้ง grid
+    (cell ที่ Gateway ไม่ส่งมาถูกล้าง ไม่ให้ lots ของ shelf เดิมค้างอยู่)
+    รองรับทั้ง dict {"L1B1": {...}} และ array [{"level", "block", "lots"}]
+
+    shelf_changed: shelf_id เปลี่ยน - ล้าง lots เดิมแม้ Gateway ไม่มีข้อมูลของ shelf ใหม่
+    """
+    from core.database import replace_shelf_lots
+    
+    if not restored_state and not shelf_changed:
+        print("📝 No shelf state data from Gateway, using current local state")
+        return True
+    
+    cells = {}
+    if isinstance(restored_state, dict):
+        for position_key, position_data in restored_state.items():
+            # Parse position (L1B1 -> level=1, block=1)
+            match = re.match(r'L(\d+)B(\d+)', position_key)
+            if match:
+                cells[(int(match.group(1)), int(match.group(2)))] = position_data.get("lots", [])
+    else:
+        for cell_data in restored_state or []:
+            level = cell_data.get("level")
+            block = cell_data.get("block")
+            if level is None or block is None:
+                continue
+            cells[(int(level), int(block))] = cell_data.get("lots", [])
+    
+    changed_count = replace_shelf_lots(cells)
+    print(f"✅ Shelf state restored from Gateway: {len(cells)} positions received, {changed_count} cells changed in local database")
+    return True
+
+# Background reconcile task (เก็บ reference ไว้ไม่ให้ถูก garbage collect)
+# STARTUP_STATUS อยู่ใน api/jobs.py (แสดงใน GET /api/system/storage)
+_reconcile_task = None
+
+async def reconcile_with_gateway(local_state_restored: bool, cached_shelf_id):
+    """
+    Startup pipeline (background):
+    shelf_id -> [layout fetch || state fetch] -> apply layout -> apply state
+    layout และ state ดึงพร้อมกันหลังได้ shelf_id แล้ว apply ตามลำดับ (state ต้องใช้ cells ของ layout)
+    """
+    from api.jobs import fetch_layout_from_gateway, restore_shelf_state_from_gateway, GLOBAL_SHELF_INFO
+    
+    start = time.perf_counter()
+    STARTUP_STATUS["phase"] = "reconciling"
     try:
-        print("🔄 Initializing shelf state from Gateway...")
+        shelf_init_success = await initialize_shelf_info()
+        STARTUP_STATUS["shelf_info"] = shelf_init_success
+        if not shelf_init_success and cached_shelf_id:
+            # Gateway ไม่ตอบ - ใช้ shelf_id จาก cache ต่อ
+            GLOBAL_SHELF_INFO["shelf_id"] = cached_shelf_id
+            print(f"📦 Gateway unavailable, keep serving cached shelf_id {cached_shelf_id}")
+            return
+        if not shelf_init_success:
+            print("⚠️ Skipping layout / state initialization due to shelf info failure")
+            return
         
-        # Import ฟังก์ชันที่จำเป็น
-        from api.jobs import restore_shelf_state_from_gateway, GLOBAL_SHELF_INFO
-        from core.database import DB
+        shelf_id = GLOBAL_SHELF_INFO.get("shelf_id")
+        shelf_changed = bool(cached_shelf_id) and shelf_id != cached_shelf_id
+        if shelf_changed:
+            print(f"⚠️ shelf_id changed {cached_shelf_id} -> {shelf_id}, local cache is stale")
         
-        # ตรวจสอบว่ามี shelf_id แล้วหรือไม่
-        if not GLOBAL_SHELF_INFO.get("shelf_id"):
-            print("⚠️ No shelf_id available, skipping shelf state restore")
-            return False
-            
-        # กู้คืนจาก Gateway
-        restored_state = await restore_shelf_state_from_gateway()
+        # ถ้ากู้คืนจาก storage ในเครื่องได้แล้ว ใช้สถานะในเครื่อง (ล่าสุดกว่า Gateway)
+        need_state = shelf_changed or not local_state_restored
         
-        if restored_state and isinstance(restored_state, dict):
-            print(f"✅ Shelf state restored from Gateway: {len(restored_state)} positions")
-            
-            # แปลง Gateway format เป็น local DB format
-            # สมมติว่า restored_state = {"L1B1": {...}, "L1B2": {...}}
-            restored_count = 0
-            for position_key, position_data in restored_state.items():
-                # Parse position (L1B1 -> level=1, block=1)
-                import re
-                match = re.match(r'L(\d+)B(\d+)', position_key)
-                if match:
-                    level = int(match.group(1))
-                    block = int(match.group(2))
-                    lots = position_data.get("lots", [])
-                    
-                    # อัปเดต local DB
-                    for cell in DB["shelf_state"]:
-                        if cell[0] == level and cell[1] == block:
-                            cell[2] = lots
-                            restored_count += 1
-                            break
-            
-            print(f"📦 Updated {restored_count} positions in local database")
-            return True
-            
+        async def _skip():
+            return None
+        
+        layout_data, restored_state = await asyncio.gather(
+            fetch_layout_from_gateway(shelf_id),
+            restore_shelf_state_from_gateway() if need_state else _skip()
+        )
+        
+        STARTUP_STATUS["layout"] = await apply_shelf_layout(layout_data)
+        if need_state:
+            STARTUP_STATUS["state"] = "gateway" if apply_shelf_state(restored_state, shelf_changed) else "failed"
         else:
-            print("📝 No shelf state data from Gateway, using current local state")
-            return True
-            
+            STARTUP_STATUS["state"] = "local"
+            print("💾 Using shelf state restored from local storage, skipping Gateway restore")
     except Exception as e:
-        print(f"❌ Error initializing shelf state: {e}")
-        return False
+        print(f"❌ Error reconciling with Gateway: {e}")
+    finally:
+        STARTUP_STATUS["phase"] = "ready"
+        STARTUP_STATUS["reconcile_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        print("=" * 50)
+        print("🚀 System Initialization Summary:")
+        print(f"   📋 Shelf Info: {'✅' if STARTUP_STATUS['shelf_info'] else '❌'}")
+        print(f"   🏗️  Layout: {'✅' if STARTUP_STATUS['layout'] else '❌'}")
+        print(f"   📦 State: {STARTUP_STATUS['state'] or 'unchanged'}")
+        print(f"   ⏱️  Boot: {STARTUP_STATUS['boot_ms']} ms ({STARTUP_STATUS['source']}), Gateway reconcile: {STARTUP_STATUS['reconcile_ms']} ms")
+        print("=" * 50)
 
-@app.on_event("startup")
 async def startup_event():
-    """เรียกใช้ฟังก์ชัน initialization เมื่อแอปพลิเคชันเริ่มต้น"""
-    # รอสักครู่ให้เซิร์ฟเวอร์เริ่มต้นเสร็จก่อน (ลดเวลาลง)
-    await asyncio.sleep(1)
+    """
+    เริ่มระบบจาก local cache ทันที (ไม่รอ Gateway)
+    - shelf state + layout: storage ในเครื่อง (journal หรือ SQLite)
+    - shelf_id: data/shelf_info.json
+    แล้ว reconcile กับ Gateway ใน background
+    """
+    global _reconcile_task
+    start = time.perf_counter()
+    
+    # กู้คืนสถานะล่าสุดจาก storage ในเครื่องก่อน (journal หรือ SQLite - ไม่ต้องรอ Gateway)
+    from core.database import open_storage, migrate_existing_lots_add_biz, is_layout_loaded_from_gateway
+    from api.jobs import load_cached_shelf_info, refresh_layout_hardware
+    storage_result = open_storage()
+    local_state_restored = storage_result["restored"]
+    
+    # layout ที่กู้คืนอาจต่างจาก default -> สร้าง LED lookup table ใหม่ และจับคู่ปุ่มกับ cell ตาม layout ที่โหลด
+    # (ทำหลัง open_storage คืนค่า - core/database ไม่ยุ่งกับ hardware)
+    refresh_layout_hardware()
     
     # Migration: เพิ่ม biz field ให้กับ lots ที่มีอยู่แล้ว
-    from core.database import migrate_existing_lots_add_biz
     migrate_existing_lots_add_biz()
     
-    # Initialize shelf info first
-    shelf_init_success = await initialize_shelf_info()
-    print(f"🔍 DEBUG: Shelf init success = {shelf_init_success}")
-    
-    # Initialize layout configuration from Gateway (only if shelf info succeeded)
-    if shelf_init_success:
-        layout_init_success = await initialize_shelf_layout()
-        #print(f"🔍 DEBUG: Layout init success = {layout_init_success}")
+    cached = load_cached_shelf_info()
+    cached_shelf_id = cached.get("shelf_id") if cached else None
+    if cached_shelf_id and is_layout_loaded_from_gateway():
+        STARTUP_STATUS["source"] = "cache"
+        print(f"📦 Serving from local cache: shelf {cached_shelf_id}, layout + state from {storage_result['engine']} storage")
     else:
-        layout_init_success = False
-        #print(f"⚠️ Skipping layout initialization due to shelf info failure")
+        STARTUP_STATUS["source"] = "fallback"
+        print("📦 No complete local cache, serving fallback layout until Gateway responds")
     
-    # Then initialize shelf state (requires shelf_id and layout)
-    if shelf_init_success:
-        await initialize_shelf_state()
-    else:
-        print("⚠️ Skipping shelf state initialization due to shelf info failure")
-        
-    # แสดงสถานะการ initialization
-    print("=" * 50)
-    print("🚀 System Initialization Summary:")
-    print(f"   📋 Shelf Info: {'✅' if shelf_init_success else '❌'}")
-    print(f"   🏗️  Layout: {'✅' if layout_init_success else '❌'}")
-    print(f"   📦 State: Available after shelf info")
-    print("=" * 50)
+    STARTUP_STATUS["phase"] = "serving"
+    STARTUP_STATUS["boot_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    _reconcile_task = asyncio.create_task(reconcile_with_gateway(local_state_restored, cached_shelf_id))
+
+async def shutdown_event():
+    """หยุด background reconcile และ flush storage ที่ค้างอยู่ก่อนปิดระบบ"""
+    if _reconcile_task is not None and not _reconcile_task.done():
+        _reconcile_task.cancel()
+        try:
+            await _reconcile_task
+        except asyncio.CancelledError:
+            pass
+    from core.database import close_storage
+    await asyncio.to_thread(close_storage)   # fsync ที่ค้างอยู่นอก event loop
 
 
 STATIC_PATH = pathlib.Path(__file__).parent / "static"
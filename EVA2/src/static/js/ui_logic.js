@@ -2219,9 +2219,147 @@ function getCellCapacity(level, block) {
         
         // *** START: WebSocket Integration ***
         let websocketConnection = null; // เก็บ WebSocket connection
+        let shelfVersion = null;        // version ของ shelf_state ล่าสุดที่ได้รับ (initial_state / cell_updated)
+        let shelfResyncPending = false; // ส่ง resync_request แล้ว รอ initial_state
+        let renderScheduled = false;
+        let lastEventSeq = null;        // seq ของ event ล่าสุด (ใช้ resume หลัง reconnect)
+        let wsSession = null;           // session ของ server (seq เริ่มใหม่เมื่อ server restart)
+        // binary MessagePack frames: เปิดด้วย ?ws_encoding=msgpack ใน URL ของหน้า (ค่าเริ่มต้น JSON text)
+        const WS_ENCODING = new URLSearchParams(window.location.search).get('ws_encoding') === 'msgpack' ? 'msgpack' : 'json';
+        const utf8Decoder = new TextDecoder();
+
+        // MessagePack decoder (เฉพาะ type ที่ server ส่ง: nil/bool/int/float/str/bin/array/map)
+        function decodeMsgpack(buffer) {
+            const bytes = new Uint8Array(buffer);
+            const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+            let offset = 0;
+
+            function readString(length) {
+                const value = utf8Decoder.decode(bytes.subarray(offset, offset + length));
+                offset += length;
+                return value;
+            }
+            function readBinary(length) {
+                const value = bytes.slice(offset, offset + length);
+                offset += length;
+                return value;
+            }
+            function readArray(length) {
+                const value = new Array(length);
+                for (let i = 0; i < length; i++) value[i] = read();
+                return value;
+            }
+            function readMap(length) {
+                const value = {};
+                for (let i = 0; i < length; i++) {
+                    const key = read();
+                    value[key] = read();
+                }
+                return value;
+            }
+            function readUint(size) {
+                let value;
+                if (size === 1) value = view.getUint8(offset);
+                else if (size === 2) value = view.getUint16(offset);
+                else if (size === 4) value = view.getUint32(offset);
+                else value = Number(view.getBigUint64(offset));
+                offset += size;
+                return value;
+            }
+            function readInt(size) {
+                let value;
+                if (size === 1) value = view.getInt8(offset);
+                else if (size === 2) value = view.getInt16(offset);
+                else if (size === 4) value = view.getInt32(offset);
+                else value = Number(view.getBigInt64(offset));
+                offset += size;
+                return value;
+            }
+            function read() {
+                const type = bytes[offset++];
+                if (type <= 0x7f) return type;
+                if (type <= 0x8f) return readMap(type & 0x0f);
+                if (type <= 0x9f) return readArray(type & 0x0f);
+                if (type <= 0xbf) return readString(type & 0x1f);
+                if (type >= 0xe0) return type - 0x100;
+                switch (type) {
+                    case 0xc0: return null;
+                    case 0xc2: return false;
+                    case 0xc3: return true;
+                    case 0xc4: return readBinary(readUint(1));
+                    case 0xc5: return readBinary(readUint(2));
+                    case 0xc6: return readBinary(readUint(4));
+                    case 0xca: { const value = view.getFloat32(offset); offset += 4; return value; }
+                    case 0xcb: { const value = view.getFloat64(offset); offset += 8; return value; }
+                    case 0xcc: return readUint(1);
+                    case 0xcd: return readUint(2);
+                    case 0xce: return readUint(4);
+                    case 0xcf: return readUint(8);
+                    case 0xd0: return readInt(1);
+                    case 0xd1: return readInt(2);
+                    case 0xd2: return readInt(4);
+                    case 0xd3: return readInt(8);
+                    case 0xd9: return readString(readUint(1));
+                    case 0xda: return readString(readUint(2));
+                    case 0xdb: return readString(readUint(4));
+                    case 0xdc: return readArray(readUint(2));
+                    case 0xdd: return readArray(readUint(4));
+                    case 0xde: return readMap(readUint(2));
+                    case 0xdf: return readMap(readUint(4));
+                    default: throw new Error(`Unsupported MessagePack type 0x${type.toString(16)}`);
+                }
+            }
+            return read();
+        }
+
+        // render ครั้งเดียวต่อ frame (cell_updated หลาย event ติดกัน)
+        function scheduleRenderAll() {
+            if (renderScheduled) return;
+            renderScheduled = true;
+            requestAnimationFrame(() => {
+                renderScheduled = false;
+                renderAll();
+            });
+        }
+
+        // ขอ state ทั้งหมดใหม่เมื่อพบ version gap
+        function requestShelfResync(reason) {
+            if (shelfResyncPending || !websocketConnection || websocketConnection.readyState !== WebSocket.OPEN) return;
+            shelfResyncPending = true;
+            console.warn(`🔁 Shelf resync requested: ${reason}`);
+            websocketConnection.send(JSON.stringify({ type: "resync_request", payload: { version: shelfVersion, reason: reason } }));
+        }
+
+        // แทนที่ lots ของ cell เดียวใน local shelf state
+        function applyCellUpdate(update) {
+            const shelfState = JSON.parse(localStorage.getItem(GLOBAL_SHELF_STATE_KEY) || '[]');
+            const newCell = { level: update.level, block: update.block, lots: update.lots || [] };
+            const index = shelfState.findIndex(cellData => {
+                const cellLevel = Array.isArray(cellData) ? cellData[0] : cellData && cellData.level;
+                const cellBlock = Array.isArray(cellData) ? cellData[1] : cellData && cellData.block;
+                return String(cellLevel) === String(update.level) && String(cellBlock) === String(update.block);
+            });
+            if (index >= 0) {
+                shelfState[index] = newCell;
+            } else {
+                shelfState.push(newCell);
+            }
+            localStorage.setItem(GLOBAL_SHELF_STATE_KEY, JSON.stringify(shelfState));
+        }
 
         function setupWebSocket() {
-            const ws = new WebSocket(`ws://${window.location.host}/ws`);
+            // resume: server replay เฉพาะ events ที่พลาดไประหว่างหลุด (ถ้ายังอยู่ใน buffer)
+            const query = new URLSearchParams();
+            if (lastEventSeq !== null && wsSession) {
+                query.set('since', lastEventSeq);
+                query.set('session', wsSession);
+            }
+            if (WS_ENCODING !== 'json') {
+                query.set('encoding', WS_ENCODING);
+            }
+            const queryString = query.toString();
+            const ws = new WebSocket(`ws://${window.location.host}/ws${queryString ? '?' + queryString : ''}`);
+            ws.binaryType = 'arraybuffer';
             
             websocketConnection = ws;
 
@@ -2231,14 +2369,46 @@ function getCellCapacity(level, block) {
 
             ws.onmessage = function(event) {
                 try {
-                    const data = JSON.parse(event.data);
+                    // server ส่ง JSON text เสมอถ้าไม่ได้ติดตั้ง msgpack - รองรับทั้ง 2 แบบ
+                    const data = (typeof event.data === 'string') ? JSON.parse(event.data) : decodeMsgpack(event.data);
+                    if (typeof data.seq === 'number') {
+                        lastEventSeq = data.seq;
+                    }
 
                     switch (data.type) {
+                        case "resumed":
+                            console.log(`🔁 WebSocket resumed from seq ${data.payload.since}, ${data.payload.replayed} missed events replayed`);
+                            break;
                         case "initial_state":
                             localStorage.setItem(QUEUE_KEY, JSON.stringify(data.payload.jobs));
                             localStorage.setItem(GLOBAL_SHELF_STATE_KEY, JSON.stringify(data.payload.shelf_state));
+                            shelfVersion = data.payload.shelf_version ?? null;
+                            shelfResyncPending = false;
+                            lastEventSeq = data.payload.seq ?? null;
+                            wsSession = data.payload.session ?? null;
                             renderAll();
                             break;
+                        case "cell_updated": {
+                            // delta ของ cell เดียว: ใช้ได้เมื่อ prev_version ตรงกับ version ที่มีอยู่
+                            const update = data.payload;
+                            if (shelfResyncPending) break;
+                            if (shelfVersion !== null && update.version <= shelfVersion) break; // อยู่ใน state แล้ว
+                            if (shelfVersion === null || update.prev_version !== shelfVersion) {
+                                requestShelfResync(`version gap (have ${shelfVersion}, event ${update.prev_version} -> ${update.version})`);
+                                break;
+                            }
+                            applyCellUpdate(update);
+                            shelfVersion = update.version;
+                            scheduleRenderAll();
+                            break;
+                        }
+                        case "shelf_snapshot":
+                            // ทั้ง shelf เปลี่ยน (reset / layout)
+                            localStorage.setItem(GLOBAL_SHELF_STATE_KEY, JSON.stringify(data.payload.shelf_state));
+                            shelfVersion = data.payload.version;
+                            shelfResyncPending = false; // state ทั้ง shelf มาแล้ว ไม่ต้องรอ resync
+                            scheduleRenderAll();
+                            break;
                         case "new_job":
                             const queue = getQueue();
                             if (!queue.some(job => job.jobId === data.payload.jobId)) {
@@ -2307,7 +2477,10 @@ function getCellCapacity(level, block) {
                             console.log('📦 Shelf state before update:', oldShelfState);
                             console.log('📦 New shelf state from server:', data.payload.shelf_state);
                             
-            localStorage.setItem(GLOBAL_SHELF_STATE_KEY, JSON.stringify(data.payload.shelf_state));
+            // shelf_state มาเฉพาะ server ที่เปิด SMART_SHELF_WS_FULL_STATE (ปกติได้ cell_updated มาก่อนแล้ว)
+            if (data.payload.shelf_state) {
+                localStorage.setItem(GLOBAL_SHELF_STATE_KEY, JSON.stringify(data.payload.shelf_state));
+            }
             clearPersistentNotifications(); // Clear persistent notifications on job completion
             localStorage.removeItem(ACTIVE_JOB_KEY);
             renderAll();
@@ -2512,24 +2685,20 @@ function getCellCapacity(level, block) {
         function showJobSuccess(level, block) {
             console.log(`💡 Job Success: L${level}B${block} -> Green`);
             
-            fetch('/api/led/control', {
+            // สีเขียว 2 วินาทีแล้วดับเอง (server-side ttl)
+            fetch('/api/led/effect', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({
-                    level: level.toString(),
-                    block: block.toString(),
-                    color: 'green'
+                    effect: 'solid',
+                    positions: [`L${level}B${block}`],
+                    color: 'green',
+                    ttl: 2
                 })
             })
                 .then(response => response.json())
                 .then(data => {
                     console.log(`✅ Success LED shown: L${level}B${block}`, data);
-                    
-                    // รอ 2 วินาที แล้วเคลียร์
-                    setTimeout(() => {
-                        fetch('/api/led/clear', { method: 'POST' })
-                            .then(() => console.log('💡 Success LED cleared'));
-                    }, 2000);
                 })
                 .catch(error => {
                     console.error('💡 Success LED error:', error);
@@ -0,0 +1,22 @@
+# tests/conftest.py
+"""
+Shared fixtures - รันจาก EVA2/src: python -m pytest -q
+(test_*.py ใน src/ เป็น script ทดสอบ hardware / HTTP ที่รันด้วยมือ ไม่ได้อยู่ใน pytest)
+"""
+
+import pytest
+
+
+@pytest.fixture
+def db():
+    """core.database ที่ reset แล้ว (layout fallback, DB ว่าง) - คืน module"""
+    from core import database
+
+    database.close_storage()
+    database.SHELF_CONFIG.clear()
+    database.SHELF_CONFIG.update(database.FALLBACK_SHELF_CONFIG)
+    database.reset_db()
+    database.SHELF_SYNC.update({"version": 0, "synced_version": None, "full_since": 0})
+    database.SHELF_SYNC["dirty"].clear()
+    yield database
+    database.close_storage()
@@ -0,0 +1,70 @@
+from core.database import CellStore
+
+
+def make_store():
+    return CellStore([[1, 1, []], [1, 2, []], [2, 1, []]])
+
+
+def test_get_returns_the_cell_object_in_the_list():
+    store = make_store()
+    cell = store.get(1, 2)
+    assert cell is store[1]
+    assert store.get(3, 1) is None
+    assert set(store.keys()) == {(1, 1), (1, 2), (2, 1)}
+
+
+def test_list_mutators_keep_the_index_in_sync():
+    store = make_store()
+    store.append([3, 1, []])
+    assert store.get(3, 1) == [3, 1, []]
+
+    store.remove(store.get(1, 1))
+    assert store.get(1, 1) is None
+    assert store.get(1, 2) is store[0]
+
+    store[0] = [5, 5, []]
+    assert store.get(1, 2) is None
+    assert store.get(5, 5) is store[0]
+
+    del store[0]
+    assert store.get(5, 5) is None
+
+    store.clear()
+    assert list(store.keys()) == []
+
+
+def test_duplicate_position_resolves_to_first_cell():
+    first, second = [1, 1, []], [1, 1, [{"lot_no": "X", "tray_count": 1}]]
+    store = CellStore([first, second])
+    assert store.get(1, 1) is first
+
+
+def test_helpers_use_the_index(db):
+    assert db.add_lot_to_position(1, 1, "LOT1", 3)
+    assert db.get_cell(1, 1)[2] == [{"lot_no": "LOT1", "tray_count": 3, "biz": "Unknown"}]
+    assert db.get_lots_in_position(99, 1) == []
+    assert not db.add_lot_to_position(99, 1, "LOT1", 3)
+
+
+def test_lot_index_follows_add_remove_and_set_lots(db):
+    db.add_lot_to_position(1, 1, "LOT1", 2)
+    db.add_lot_to_position(2, 3, "LOT1", 2)
+    db.add_lot_to_position(2, 3, "LOT2", 1)
+    assert db.find_lot_locations("LOT1") == [(1, 1), (2, 3)]
+    assert db.find_lot_location("LOT1") == (1, 1)
+    assert db.is_lot_in_position(2, 3, "LOT2")
+
+    db.remove_lot_from_position(1, 1, "LOT1")
+    assert db.find_lot_locations("LOT1") == [(2, 3)]
+
+    db.set_cell_lots(2, 3, [{"lot_no": "LOT3", "tray_count": 1}])
+    assert db.find_lot_location("LOT1") is None
+    assert db.find_lot_location("LOT2") is None
+    assert db.find_lot_locations("LOT3") == [(2, 3)]
+
+
+def test_lot_stays_indexed_while_a_duplicate_entry_remains():
+    store = CellStore([[1, 1, [{"lot_no": "A", "tray_count": 1}, {"lot_no": "A", "tray_count": 2}]]])
+    store.get(1, 1)[2].pop(0)
+    store.unindex_lot("A", 1, 1)
+    assert store.lot_positions("A") == {(1, 1)}
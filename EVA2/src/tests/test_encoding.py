@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from core.database import CellStore
+from core.encoding import EncodedMessage, dumps, encode_json, encode_message
+
+
+def test_encode_json_handles_shelf_types_and_thai_text():
+    payload = {"shelf": CellStore([[1, 1, [{"lot_no": "ล็อต1", "tray_count": 2}]]]), "config": {1: 4}}
+    decoded = json.loads(encode_json(payload))
+    assert decoded == {"shelf": [[1, 1, [{"lot_no": "ล็อต1", "tray_count": 2}]]], "config": {"1": 4}}
+    assert "ล็อต1" in dumps(payload)
+
+
+def test_encode_json_falls_back_for_unknown_types():
+    class Opaque:
+        def __str__(self):
+            return "opaque"
+
+    assert json.loads(encode_json({"value": Opaque()})) == {"value": "opaque"}
+
+
+def test_encoded_message_encodes_once_and_caches_text():
+    message = encode_message({"type": "ping", "payload": {}})
+    assert isinstance(message, EncodedMessage)
+    assert encode_message(message) is message
+    assert message.text is message.text
+    assert json.loads(message.data) == {"type": "ping", "payload": {}}
+    assert len(message) == len(message.data)
+
+
+def test_encode_message_accepts_pre_encoded_input():
+    assert encode_message('{"a":1}').data == b'{"a":1}'
+    assert encode_message(b'{"a":1}').text == '{"a":1}'
+
+
+def test_msgpack_frame_matches_the_json_event():
+    msgpack = pytest.importorskip("msgpack")
+    event = {"type": "cell_updated", "payload": {"level": 1, "block": 2, "lots": CellStore([[1, 2, []]])}}
+
+    from_event = EncodedMessage(event=event)
+    from_bytes = encode_message(encode_json(event))
+    expected = {"type": "cell_updated", "payload": {"level": 1, "block": 2, "lots": [[1, 2, []]]}}
+    assert msgpack.unpackb(from_event.packed) == expected
+    assert msgpack.unpackb(from_bytes.packed) == expected
+    assert from_event.packed is from_event.packed
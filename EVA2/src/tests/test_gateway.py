@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+from core import gateway  # noqa: E402
+
+
+@pytest.fixture
+def client_kwargs(monkeypatch):
+    """จำ kwargs ที่ใช้สร้าง AsyncClient (ยังสร้าง client จริง) และเริ่มจากไม่มี shared client"""
+    created = []
+    real_client = httpx.AsyncClient
+
+    def recording_client(**kwargs):
+        created.append(kwargs)
+        return real_client(**kwargs)
+
+    monkeypatch.setattr(gateway.httpx, "AsyncClient", recording_client)
+    monkeypatch.setattr(gateway, "_client", None)
+    yield created
+    asyncio.run(gateway.close_gateway_client())
+
+
+def test_timeouts_are_per_endpoint():
+    complete = gateway.gateway_timeout("complete")
+    assert (complete.read, complete.connect) == (5.0, gateway.GATEWAY_CONNECT_TIMEOUT)
+    ask_shelf = gateway.gateway_timeout("ask_shelf")
+    assert (ask_shelf.read, ask_shelf.connect) == (15.0, gateway.GATEWAY_CONNECT_TIMEOUT)
+    assert gateway.gateway_timeout("unknown").read == gateway.DEFAULT_GATEWAY_TIMEOUT
+
+
+def test_http2_is_off_without_h2(client_kwargs, monkeypatch):
+    monkeypatch.setattr(gateway, "HTTP2_AVAILABLE", False)
+    client = gateway.get_gateway_client()
+    assert client_kwargs[0]["http2"] is False
+    assert not client.is_closed
+
+
+def test_one_client_is_shared_until_closed(client_kwargs):
+    async def run():
+        opened = await gateway.open_gateway_client()
+        same = [gateway.get_gateway_client() for _ in range(3)]
+        await gateway.close_gateway_client()
+        return opened, same
+
+    opened, same = asyncio.run(run())
+    assert all(client is opened for client in same)
+    assert len(client_kwargs) == 1
+    assert opened.is_closed
+    assert gateway._client is None
+
+    reopened = gateway.get_gateway_client()
+    assert reopened is not opened
+    assert len(client_kwargs) == 2
@@ -0,0 +1,40 @@
+from core.database import JobQueue
+
+
+def job(job_id, lot_no):
+    return {"jobId": job_id, "lot_no": lot_no}
+
+
+def test_lookup_by_id_and_lot_keeps_queue_order():
+    queue = JobQueue([job("job_1", "A"), job("job_2", "B"), job("job_3", "A")])
+    assert queue.get("job_2")["lot_no"] == "B"
+    assert [j["jobId"] for j in queue.find_by_lot("A")] == ["job_1", "job_3"]
+    assert [j["jobId"] for j in queue] == ["job_1", "job_2", "job_3"]
+    assert "job_3" in queue and len(queue) == 3
+
+
+def test_remove_cleans_the_lot_index():
+    queue = JobQueue([job("job_1", "A"), job("job_2", "A")])
+    assert queue.remove("job_1")["jobId"] == "job_1"
+    assert queue.remove("job_1") is None
+    assert queue.has_lot("A")
+    queue.remove("job_2")
+    assert not queue.has_lot("A")
+    assert queue.find_by_lot("A") == []
+
+
+def test_remove_by_lot_and_reappend_same_id():
+    queue = JobQueue([job("job_1", "A"), job("job_2", "B"), job("job_3", "A")])
+    removed = queue.remove_by_lot("A")
+    assert [j["jobId"] for j in removed] == ["job_1", "job_3"]
+    assert queue.to_list() == [job("job_2", "B")]
+
+    queue.append(job("job_2", "C"))
+    assert not queue.has_lot("B")
+    assert queue.find_by_lot("C") == [job("job_2", "C")]
+
+
+def test_plain_list_is_wrapped(db):
+    db.DB["jobs"] = [job("job_9", "Z")]
+    assert db.get_job_by_id("job_9") == job("job_9", "Z")
+    assert isinstance(db.DB["jobs"], JobQueue)
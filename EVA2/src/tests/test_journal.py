@@ -0,0 +1,79 @@
+from core.journal import Journal
+
+
+def open_journal(directory, state, **kwargs):
+    journal = Journal(directory, **kwargs)
+    journal.load()
+    journal.open(lambda: {"n": state["n"]})
+    return journal
+
+
+def test_records_replay_after_close(tmp_path):
+    state = {"n": 0}
+    journal = open_journal(tmp_path, state)
+    for i in range(1, 6):
+        journal.record("inc", {"i": i})
+    journal.close()
+
+    snapshot, records = Journal(tmp_path).load()
+    assert snapshot is None
+    assert [r["data"]["i"] for r in records] == [1, 2, 3, 4, 5]
+    assert [r["seq"] for r in records] == [1, 2, 3, 4, 5]
+
+
+def test_record_only_buffers_until_the_writer_runs(tmp_path):
+    journal = open_journal(tmp_path, {"n": 0}, fsync_interval=60)
+    journal.record("inc", {"i": 1})
+    assert journal.journal_path.read_text(encoding="utf-8") == ""
+    assert journal.get_status()["pending_fsync"] == 1
+
+    journal.sync()
+    assert '"i":1' in journal.journal_path.read_text(encoding="utf-8")
+    assert journal.get_status()["pending_fsync"] == 0
+    journal.close()
+
+
+def test_compaction_keeps_records_after_the_snapshot(tmp_path):
+    state = {"n": 0}
+    journal = open_journal(tmp_path, state, fsync_interval=60, snapshot_every=10)
+    for i in range(1, 26):
+        state["n"] = i
+        journal.record("inc", {"i": i})
+    journal.close()
+    assert journal.stats["snapshots"] == 1
+
+    snapshot, records = Journal(tmp_path).load()
+    assert snapshot == {"n": 20, "seq": 20}
+    assert [r["data"]["i"] for r in records] == [21, 22, 23, 24, 25]
+
+
+def test_truncated_tail_is_ignored(tmp_path):
+    journal = open_journal(tmp_path, {"n": 0})
+    journal.record("inc", {"i": 1})
+    journal.close()
+    with open(journal.journal_path, "a", encoding="utf-8") as f:
+        f.write('{"seq": 2, "op": "in')
+
+    reopened = Journal(tmp_path)
+    _, records = reopened.load()
+    assert [r["seq"] for r in records] == [1]
+    assert reopened.get_status()["seq"] == 1
+
+
+def test_database_state_round_trips_through_the_journal(db, tmp_path):
+    db.open_storage("memory", tmp_path)
+    db.add_lot_to_position(1, 1, "LOT1", 4, "BIZ")
+    db.add_lot_to_position(2, 2, "LOT2", 1)
+    db.remove_lot_from_position(2, 2, "LOT2")
+    db.enqueue_job({"jobId": db.next_job_id(), "lot_no": "LOT1", "level": "1", "block": "1"})
+    db.close_storage()
+
+    db.reset_db()
+    assert db.get_cell(1, 1)[2] == []
+
+    result = db.open_storage("memory", tmp_path)
+    assert result["restored"]
+    assert db.get_cell(1, 1)[2] == [{"lot_no": "LOT1", "tray_count": 4, "biz": "BIZ"}]
+    assert db.get_cell(2, 2)[2] == []
+    assert db.get_job_by_id("job_1")["lot_no"] == "LOT1"
+    assert db.DB["job_counter"] == 1
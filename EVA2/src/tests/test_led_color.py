@@ -0,0 +1,48 @@
+import pytest
+
+from core.led_color import ColorPipeline
+
+
+def test_gamma_and_brightness_use_one_lookup_table():
+    linear = ColorPipeline(gamma=1.0, brightness=1.0, budget_ma=0)
+    assert linear.apply([(0, 128, 255)]) == [(0, 128, 255)]
+
+    corrected = ColorPipeline(gamma=2.2, brightness=0.5, budget_ma=0)
+    (r, g, b), = corrected.apply([(0, 128, 255)])
+    assert (r, b) == (0, 128)
+    assert g < 64
+
+
+def test_out_of_range_channels_are_clamped():
+    pipeline = ColorPipeline(gamma=1.0, brightness=1.0, budget_ma=0)
+    assert pipeline.apply([(300, -5, 12.7)]) == [(255, 0, 12)]
+
+
+def test_frame_over_budget_is_scaled_down_proportionally():
+    pipeline = ColorPipeline(gamma=1.0, brightness=1.0, budget_ma=500, ma_per_channel=20, idle_ma=1)
+    frame = [(255, 255, 255)] * 10          # 10 * 60 mA + 10 mA idle = 610 mA
+    out = pipeline.apply(frame)
+
+    assert pipeline.stats["requested_ma"] == 610.0
+    assert pipeline.stats["estimated_ma"] <= 500
+    assert pipeline.stats["scale"] < 1.0
+    assert pipeline.stats["limited_frames"] == 1
+    r, g, b = out[0]
+    assert r == g == b and 0 < r < 255
+
+
+def test_frame_within_budget_is_untouched():
+    pipeline = ColorPipeline(gamma=1.0, brightness=1.0, budget_ma=500, ma_per_channel=20, idle_ma=1)
+    assert pipeline.apply([(255, 0, 0)] * 2) == [(255, 0, 0)] * 2
+    assert pipeline.stats["scale"] == 1.0
+    assert pipeline.stats["limited_frames"] == 0
+
+
+def test_configure_validates_and_keeps_unset_values():
+    pipeline = ColorPipeline(gamma=2.2, brightness=0.8, budget_ma=1000)
+    config = pipeline.configure(brightness=0.5)
+    assert (config["gamma"], config["brightness"], config["budget_ma"]) == (2.2, 0.5, 1000.0)
+    for bad in ({"gamma": 0}, {"brightness": 1.5}, {"budget_ma": -1}):
+        with pytest.raises(ValueError):
+            pipeline.configure(**bad)
+    assert pipeline.brightness == 0.5
@@ -0,0 +1,119 @@
+import pytest
+
+
+@pytest.fixture
+def leds(db, monkeypatch):
+    """led_controller ตาม layout fallback (framebuffer ว่าง, ไม่มี effect, strip = RecordingDriver)"""
+    from core import led_controller
+    from core.led_drivers import RecordingDriver
+    from core.led_engine import led_engine
+
+    monkeypatch.setattr(led_controller, "_open_strip", RecordingDriver)
+    led_controller.refresh_led_config()
+    yield led_controller
+    db.SHELF_CONFIG.clear()
+    db.SHELF_CONFIG.update(db.FALLBACK_SHELF_CONFIG)
+    led_controller.refresh_led_config()
+    led_controller.stop_effect()
+    led_engine.stop()
+
+
+def test_lookup_table_is_rebuilt_when_the_layout_changes(leds, db):
+    top = max(db.SHELF_CONFIG)
+    assert leds.idx(top, 1) == 0
+    assert leds.validate_expected_mapping()
+
+    db.SHELF_CONFIG.clear()
+    db.SHELF_CONFIG.update({1: 2, 2: 3})
+    leds.refresh_led_config()
+    assert leds._LED_ORDER == [(2, 1), (2, 2), (2, 3), (1, 1), (1, 2)]
+    assert [leds.idx(level, block) for level, block in leds._LED_ORDER] == [0, 1, 2, 3, 4]
+    assert leds.get_led_range_for_level(1) == (3, 4)
+    assert leds.NUM_PIXELS == 5
+    assert leds.validate_expected_mapping()
+
+
+def test_positions_outside_the_layout_are_rejected(leds, db):
+    blocks = db.SHELF_CONFIG[1]
+    for level, block in [(1, 0), (1, blocks + 1), (0, 1), (99, 1)]:
+        assert leds.idx(level, block) == -1
+        assert not leds.set_led(level, block, 255, 0, 0)["ok"]
+    assert leds.get_led_range_for_level(99) == (-1, -1)
+    result = leds.set_led_batch([{"level": 99, "block": 1, "r": 255}, {"level": 1, "block": 1, "r": 255}])
+    assert (result["count"], result["errors"]) == (1, ["L99B1: invalid"])
+
+
+def test_writes_that_change_nothing_do_not_request_a_frame(leds):
+    before = dict(leds._LED_STATS)
+    assert leds.set_led(1, 1, 0, 0, 255)["changed"]
+    assert not leds.set_led(1, 1, 0, 0, 255)["changed"]
+    assert leds._LED_STATS["noop_updates"] == before["noop_updates"] + 1
+
+    result = leds.set_led_batch([{"level": 1, "block": 1, "b": 255}, {"level": 2, "block": 1, "r": 255}])
+    assert result["changed"] == 1
+    assert leds.set_led_batch([{"level": 1, "block": 1, "b": 255}, {"level": 2, "block": 1, "r": 255}])["changed"] == 0
+    assert leds.clear_all_leds()["changed"] == 2
+
+
+BLUE = (0, 0, 255)
+OFF = (0, 0, 0)
+
+
+def compose_at(leds, effect_id, elapsed):
+    """วาด effects ทับ framebuffer copy ที่เวลา started + elapsed (เหมือน render thread)"""
+    from core.led_engine import led_engine
+
+    with led_engine.lock:
+        frame = list(leds._led_state)
+        started = leds._EFFECTS[effect_id]["started"]
+        animating = leds._compose_effects(frame, started + elapsed)
+    return frame, animating
+
+
+def test_blink_alternates_each_half_period(leds):
+    effect_id = leds.start_effect("blink", positions=["L1B1"], color=BLUE, period=1.0)["effect_id"]
+    i = leds.idx(1, 1)
+    frame, animating = compose_at(leds, effect_id, 0.1)
+    assert frame[i] == BLUE and animating
+    frame, _ = compose_at(leds, effect_id, 0.6)
+    assert frame[i] == OFF
+
+
+def test_chase_runs_along_the_level_in_order(leds):
+    effect_id = leds.start_effect("chase", levels=[2], color=BLUE, period=1.0)["effect_id"]
+    start, end = leds.get_led_range_for_level(2)
+    step = 1.0 / (end - start + 1)
+    frame, _ = compose_at(leds, effect_id, 0.0)
+    assert [frame[i] for i in range(start, end + 1)].count(BLUE) == 1 and frame[start] == BLUE
+    frame, _ = compose_at(leds, effect_id, step * 1.5)
+    assert frame[start + 1] == BLUE and frame[start] == OFF
+
+
+def test_ttl_expiry_turns_the_pixel_off(leds):
+    leds.set_led(3, 1, 255, 0, 0)
+    effect_id = leds.start_effect("solid", positions=["L3B1"], color=BLUE, ttl=0.5)["effect_id"]
+    i = leds.idx(3, 1)
+    frame, animating = compose_at(leds, effect_id, 0.1)
+    assert frame[i] == BLUE and animating
+
+    frame, animating = compose_at(leds, effect_id, 0.6)
+    assert frame[i] == OFF and not animating
+    assert leds._led_state[i] == OFF
+    assert leds.list_effects() == []
+
+
+def test_direct_writes_take_pixels_back_from_effects(leds):
+    result = leds.start_effect("breathe", positions=["L1B1", "L1B2"], color=BLUE)
+    leds.set_led(1, 1, 255, 0, 0)
+    assert leds.list_effects()[0]["positions"] == ["L1B2"]
+
+    leds.set_led_batch([])
+    assert leds.list_effects() == []
+    assert leds.stop_effect(result["effect_id"])["stopped"] == 0
+
+
+def test_invalid_effect_requests_are_rejected(leds):
+    assert not leds.start_effect("sparkle", positions=["L1B1"])["ok"]
+    assert not leds.start_effect("blink", positions=["L1B1"], period=0)["ok"]
+    result = leds.start_effect("blink", positions=["L99B1"])
+    assert not result["ok"] and result["errors"] == ["L99B1: invalid"]
@@ -0,0 +1,45 @@
+from core.led_drivers import MockDriver, MultiStripDriver, RecordingDriver, create_driver, parse_strip_spec
+
+
+def test_parse_strip_spec():
+    assert parse_strip_spec("/dev/spidev0.0=4,3; /dev/spidev1.0=2,1;") == [
+        ("/dev/spidev0.0", [4, 3]), ("/dev/spidev1.0", [2, 1])]
+    assert parse_strip_spec("") == []
+
+
+def test_multi_strip_sends_only_to_strips_with_changes():
+    strips = []
+
+    def factory(n):
+        strips.append(RecordingDriver(n))
+        return strips[-1]
+
+    driver = MultiStripDriver(6, [(factory, [0, 1, 2]), (factory, [5, 4, 3])])
+    frame = [(i, 0, 0) for i in range(6)]
+    driver.show(frame)
+    driver.show(frame, dirty=[4])
+    driver.close()
+
+    top, bottom = strips
+    assert [colors for _, colors in top.frames] == [((0, 0, 0), (1, 0, 0), (2, 0, 0))]
+    assert [colors for _, colors in bottom.frames] == [((5, 0, 0), (4, 0, 0), (3, 0, 0))] * 2
+
+
+def test_mock_driver_logs_only_changed_frames_at_a_limited_rate(capsys):
+    driver = MockDriver(4, log_interval=60)
+    capsys.readouterr()
+    for _ in range(50):
+        driver.show([(0, 0, 255)] + [(0, 0, 0)] * 3)
+    for level in range(1, 11):
+        driver.show([(0, 0, level)] + [(0, 0, 0)] * 3)
+
+    assert len(capsys.readouterr().out.splitlines()) == 1
+    assert driver.unlogged == 10
+    assert driver.describe()["frames"] == 60
+
+
+def test_create_driver_wraps_any_driver_with_a_recording(tmp_path):
+    driver = create_driver(4, {1: (0, 3)}, kind="record", strips="", record_file=str(tmp_path / "frames.ledr"))
+    assert isinstance(driver, RecordingDriver) and driver.inner is None
+    driver.close()
+    assert (tmp_path / "frames.ledr").exists()
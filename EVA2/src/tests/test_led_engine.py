@@ -0,0 +1,107 @@
+from core.led_color import ColorPipeline
+from core.led_engine import LedEngine
+
+RED = (10, 0, 0)
+
+
+class CaptureDriver:
+    def __init__(self, num_pixels):
+        self.num_pixels = num_pixels
+        self.shows = []
+        self.closed = False
+
+    def show(self, frame, dirty=None):
+        self.shows.append((list(frame), dirty))
+
+    def close(self):
+        self.closed = True
+
+
+def make_engine(pixels=4, frame_interval=0.05):
+    drivers = []
+
+    def factory(n):
+        drivers.append(CaptureDriver(n))
+        return drivers[-1]
+
+    engine = LedEngine(frame_interval=frame_interval, color_pipeline=ColorPipeline(gamma=1.0, brightness=1.0, budget_ma=0))
+    framebuffer = [(0, 0, 0)] * pixels
+    engine.attach(framebuffer, factory)
+    return engine, framebuffer, drivers
+
+
+def test_requests_within_a_frame_are_coalesced():
+    engine, framebuffer, drivers = make_engine()
+    try:
+        for i in range(4):
+            with engine.lock:
+                framebuffer[i] = RED
+            engine.request_frame()
+        assert engine.flush(timeout=2.0)
+    finally:
+        engine.stop()
+
+    shows = drivers[0].shows
+    assert len(shows) <= 2
+    assert shows[-1][0] == [RED] * 4
+    assert engine.stats["requests"] == 4
+    assert engine.stats["frames"] + engine.stats["coalesced"] == 4
+    assert drivers[0].closed
+
+
+def test_stop_pushes_the_pending_frame():
+    engine, framebuffer, drivers = make_engine(frame_interval=10)
+    engine.request_frame()
+    assert engine.flush(timeout=2.0)
+    with engine.lock:
+        framebuffer[1] = RED
+    engine.request_frame()
+    engine.stop()
+    assert drivers[0].shows[-1][0][1] == RED
+
+
+def test_only_changed_pixels_are_pushed():
+    engine, framebuffer, drivers = make_engine(frame_interval=0.001)
+    try:
+        engine.request_frame()
+        assert engine.flush(timeout=2.0)
+        with engine.lock:
+            framebuffer[2] = RED
+        engine.request_frame()
+        assert engine.flush(timeout=2.0)
+        engine.request_frame()          # ไม่มีอะไรเปลี่ยน
+        assert engine.flush(timeout=2.0)
+    finally:
+        engine.stop()
+
+    assert [dirty for _, dirty in drivers[0].shows] == [None, [2]]
+    assert engine.stats["skipped_frames"] == 1
+    assert engine.stats["pixels_written"] == 4 + 1
+
+
+def test_failed_push_resends_the_whole_frame():
+    engine, framebuffer, drivers = make_engine(frame_interval=0.001)
+    try:
+        engine.request_frame()
+        assert engine.flush(timeout=2.0)
+        driver = drivers[0]
+        original_show = driver.show
+
+        def failing_show(frame, dirty=None):
+            driver.show = original_show
+            raise OSError("SPI write failed")
+
+        driver.show = failing_show
+        with engine.lock:
+            framebuffer[0] = RED
+        engine.request_frame()
+        assert engine.flush(timeout=2.0)
+        with engine.lock:
+            framebuffer[1] = RED
+        engine.request_frame()
+        assert engine.flush(timeout=2.0)
+    finally:
+        engine.stop()
+
+    assert engine.stats["errors"] == 1
+    assert drivers[0].shows[-1] == ([RED, RED, (0, 0, 0), (0, 0, 0)], None)
@@ -0,0 +1,81 @@
+import pytest
+
+from core.led_recording import FrameWriter, read_recording
+
+BLUE = (0, 0, 255)
+OFF = (0, 0, 0)
+LEVELS = {"levels": {"2": [0, 2], "1": [3, 5]}}
+
+
+def record(path, frames, end):
+    """frames: [(t, frame, dirty)]"""
+    writer = FrameWriter(path, 6, LEVELS)
+    for t, frame, dirty in frames:
+        writer.write(frame, dirty, t)
+    writer.close(end)
+
+
+def test_full_and_delta_frames_round_trip(tmp_path):
+    path = tmp_path / "frames.ledr"
+    lit = [OFF] * 6
+    lit[4] = BLUE
+    record(path, [(10.0, [OFF] * 6, None), (10.5, lit, [4]), (11.0, [OFF] * 6, [4])], 12.0)
+
+    recording = read_recording(path)
+    assert [(t, colors) for t, colors, _ in recording.frames] == [
+        (0.0, tuple([OFF] * 6)), (0.5, tuple(lit)), (1.0, tuple([OFF] * 6))]
+    assert recording.end_time == 2.0
+    assert recording.summary()["frames"] == 3
+    assert recording.index_of("L1B2") == 4
+    assert recording.index_of("L1B9") == -1
+
+
+def test_assert_color_checks_duration(tmp_path):
+    path = tmp_path / "frames.ledr"
+    lit = [OFF] * 6
+    lit[4] = BLUE
+    record(path, [(0.0, [OFF] * 6, None), (0.5, lit, [4]), (1.0, [OFF] * 6, [4])], 2.0)
+    recording = read_recording(path)
+
+    assert recording.spans("L1B2") == [(0.0, 0.5, OFF), (0.5, 1.0, BLUE), (1.0, 2.0, OFF)]
+    assert recording.assert_color("L1B2", "blue", at_least_ms=400, at_most_ms=600) == [500.0]
+    with pytest.raises(AssertionError):
+        recording.assert_color("L1B2", "blue", at_least_ms=600)
+    with pytest.raises(AssertionError):
+        recording.assert_color("L2B1", "red")
+
+
+def test_scaled_match_accepts_dimmed_colours(tmp_path):
+    path = tmp_path / "frames.ledr"
+    dimmed = [(0, 0, 100)] * 6
+    record(path, [(0.0, dimmed, None)], 1.0)
+    recording = read_recording(path)
+    with pytest.raises(AssertionError):
+        recording.assert_color(0, "blue")
+    assert recording.assert_color(0, "blue", scaled=True) == [1000.0]
+
+
+def test_purple_after_gamma_needs_scaled(tmp_path):
+    from core.led_color import ColorPipeline
+
+    path = tmp_path / "frames.ledr"
+    frame = ColorPipeline(gamma=2.2, brightness=1.0, budget_ma=0).apply([(128, 0, 128)] * 6)
+    record(path, [(0.0, frame, None)], 1.0)
+    recording = read_recording(path)
+    with pytest.raises(AssertionError):
+        recording.assert_color("L1B1", "purple")
+    assert recording.assert_color("L1B1", "purple", scaled=True) == [1000.0]
+
+
+def test_truncated_file_reads_up_to_the_last_complete_frame(tmp_path):
+    path = tmp_path / "frames.ledr"
+    writer = FrameWriter(path, 6, LEVELS)
+    writer.write([OFF] * 6, None, 0.0)
+    writer.write([BLUE] * 6, None, 0.1)
+    writer._file.close()
+    data = path.read_bytes()
+    path.write_bytes(data[:-4])
+
+    recording = read_recording(path)
+    assert len(recording.frames) == 1
+    assert recording.end_time == 0.0
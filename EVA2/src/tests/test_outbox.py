@@ -0,0 +1,141 @@
+import asyncio
+
+from core.outbox import Outbox, PermanentDeliveryError, is_permanent_http_failure
+
+
+async def wait_until(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.005)
+
+
+def test_permanent_http_failures():
+    assert is_permanent_http_failure(400)
+    assert is_permanent_http_failure(404)
+    assert not is_permanent_http_failure(408)
+    assert not is_permanent_http_failure(429)
+    assert not is_permanent_http_failure(500)
+
+
+def test_delivers_in_order_and_retries_with_backoff(tmp_path):
+    delivered, attempts = [], {"n": 0}
+
+    async def handler(payload):
+        if payload["i"] == 1 and attempts["n"] < 2:
+            attempts["n"] += 1
+            return False
+        delivered.append(payload["i"])
+        return True
+
+    async def run():
+        outbox = Outbox(tmp_path, retry_base=0.01, retry_max=0.02)
+        outbox.register_handler("msg", handler)
+        for i in (1, 2, 3):
+            outbox.enqueue("msg", {"i": i})
+        outbox.start()
+        await wait_until(lambda: len(delivered) == 3)
+        await outbox.stop()
+        return outbox
+
+    outbox = asyncio.run(run())
+    assert delivered == [1, 2, 3]
+    assert outbox.stats["failed_attempts"] == 2
+    assert list(tmp_path.glob("*.json")) == []
+
+
+def test_enqueue_while_running_writes_the_file_off_the_event_loop(tmp_path):
+    delivered = []
+
+    async def handler(payload):
+        delivered.append(payload["i"])
+        return payload["i"] != 2
+
+    async def run():
+        outbox = Outbox(tmp_path, retry_base=30)
+        outbox.register_handler("msg", handler)
+        outbox.start()
+        outbox.enqueue("msg", {"i": 1})
+        outbox.enqueue("msg", {"i": 2})
+        unwritten = outbox.get_status()["unwritten"]
+        await wait_until(lambda: delivered == [1, 2])
+        await outbox.stop()
+        return unwritten
+
+    assert asyncio.run(run()) == 2
+    assert [path.name for path in tmp_path.glob("*.json")] == ["000000000002.json"]
+
+
+def test_pending_messages_survive_restart(tmp_path):
+    Outbox(tmp_path).enqueue("msg", {"i": 1})
+    delivered = []
+
+    async def handler(payload):
+        delivered.append(payload["i"])
+        return True
+
+    async def run():
+        outbox = Outbox(tmp_path)
+        outbox.register_handler("msg", handler)
+        outbox.start()
+        await wait_until(lambda: delivered)
+        await outbox.stop()
+
+    asyncio.run(run())
+    assert delivered == [1]
+
+
+def test_permanent_rejection_is_dead_lettered_without_blocking(tmp_path):
+    delivered = []
+
+    async def handler(payload):
+        if payload["i"] == 1:
+            raise PermanentDeliveryError("HTTP 422")
+        delivered.append(payload["i"])
+        return True
+
+    async def run():
+        outbox = Outbox(tmp_path, retry_base=10)
+        outbox.register_handler("msg", handler)
+        outbox.enqueue("msg", {"i": 1})
+        outbox.enqueue("msg", {"i": 2})
+        outbox.start()
+        await wait_until(lambda: delivered)
+        await outbox.stop()
+        return outbox
+
+    outbox = asyncio.run(run())
+    assert delivered == [2]
+    assert outbox.stats["dead_lettered"] == 1
+    assert outbox.stats["last_dead_letter"]["reason"] == "HTTP 422"
+    assert len(list((tmp_path / "dead").glob("*.json"))) == 1
+
+
+def test_drop_head_unblocks_a_message_in_backoff(tmp_path):
+    delivered = []
+
+    async def handler(payload):
+        if payload["i"] == 1:
+            return False
+        delivered.append(payload["i"])
+        return True
+
+    async def run():
+        outbox = Outbox(tmp_path, retry_base=30, retry_max=30)
+        outbox.register_handler("msg", handler)
+        first = outbox.enqueue("msg", {"i": 1})
+        outbox.enqueue("msg", {"i": 2})
+        outbox.start()
+        await wait_until(lambda: outbox.get_status()["head_attempts"] == 1)
+
+        assert outbox.drop_head(seq=first + 1) is None
+        dropped = outbox.drop_head(seq=first)
+        assert dropped["payload"] == {"i": 1}
+        await wait_until(lambda: delivered)
+        await outbox.stop()
+        return outbox
+
+    outbox = asyncio.run(run())
+    assert delivered == [2]
+    assert outbox.stats["dropped"] == 1
+    assert outbox.drop_head() is None
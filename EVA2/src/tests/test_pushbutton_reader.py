@@ -0,0 +1,138 @@
+import threading
+
+import pytest
+
+from core import pushbutton_reader
+from core.pushbutton_reader import PushButtonReader, SimulatedInterruptSource
+
+
+class Presses:
+    """callback ที่จำการกดไว้ และรอได้จาก test thread"""
+
+    def __init__(self):
+        self.calls = []
+        self.event = threading.Event()
+
+    def __call__(self, index, position):
+        self.calls.append((index, position))
+        self.event.set()
+
+    def wait(self, timeout=1.0):
+        assert self.event.wait(timeout), "no button press delivered"
+        self.event.clear()
+
+
+def test_interrupt_mode_reads_the_port_only_when_int_fires():
+    source = SimulatedInterruptSource()
+    presses = Presses()
+    reader = PushButtonReader(callback=presses, interrupt_source=source)
+    assert reader.mode == "interrupt"
+    reader.start_monitoring()
+    try:
+        source.press(1)
+        presses.wait()
+        reads_after_press = source.reads
+        source.release(1)
+    finally:
+        reader.stop_monitoring()
+
+    assert presses.calls == [(1, "L1B2")]
+    assert reads_after_press == 2          # initial read + one per INT edge
+    assert reader.stats["interrupts"] >= 1
+    assert not reader.monitor_thread.is_alive()
+
+
+def test_without_int_line_the_reader_polls(monkeypatch):
+    monkeypatch.setattr(pushbutton_reader, "BUTTON_INT_LINE", "")
+    assert PushButtonReader(mode="auto").mode == "poll"
+    assert PushButtonReader(mode="interrupt").mode == "poll"
+
+
+def test_debounce_ignores_a_bounce_after_release():
+    presses = Presses()
+    reader = PushButtonReader(callback=presses, interrupt_source=SimulatedInterruptSource())
+    reader._process_states({0: True}, 10.0)
+    reader._process_states({0: False}, 10.05)
+    reader._process_states({0: True}, 10.1)        # bounce
+    reader._process_states({0: False}, 10.15)
+    reader._process_states({0: True}, 10.5)
+    assert presses.calls == [(0, "L1B1"), (0, "L1B1")]
+
+
+def test_failing_interrupt_source_falls_back_to_polling():
+    class BrokenSource(SimulatedInterruptSource):
+        def wait(self, timeout):
+            raise OSError("gpio line released")
+
+    presses = Presses()
+    reader = PushButtonReader(callback=presses, interrupt_source=BrokenSource())
+    reader.start_monitoring()
+    try:
+        reader.monitor_thread.join(0.2)
+        assert reader.mode == "poll"
+        assert reader.interrupt_source is None
+        assert reader.running
+    finally:
+        reader.stop_monitoring()
+
+
+def test_button_index_round_trip_and_address_parsing():
+    assert pushbutton_reader.button_index(0x21, 3) == 11
+    assert pushbutton_reader.button_location(11) == (0x21, 3)
+    assert pushbutton_reader.parse_addresses("auto") == []
+    assert pushbutton_reader.parse_addresses("0x21, 0x20;0x21") == [0x20, 0x21]
+    with pytest.raises(ValueError):
+        pushbutton_reader.parse_addresses("0x28")
+
+
+def test_parse_button_map_accepts_index_and_address_pin():
+    assert pushbutton_reader.parse_button_map("0=l1b1; 0x21:3=L2B4,9=L3B1") == {0: "L1B1", 11: "L2B4", 9: "L3B1"}
+    assert pushbutton_reader.parse_button_map("") == {}
+
+
+def test_build_button_mapping_follows_layout_order_with_overrides():
+    positions = ["L1B1", "L1B2", "L1B3", "L2B1"]
+    assert pushbutton_reader.build_button_mapping(positions, [0, 1, 2, 3, 4]) == {
+        0: "L1B1", 1: "L1B2", 2: "L1B3", 3: "L2B1"}
+
+    mapping = pushbutton_reader.build_button_mapping(positions, [0, 1, 2, 3, 4], {4: "L1B1", 2: "L9B9"})
+    assert mapping == {0: "L1B2", 1: "L1B3", 2: "L2B1", 4: "L1B1"}
+
+    assert pushbutton_reader.build_button_mapping(positions, [0, 1]) == {0: "L1B1", 1: "L1B2"}
+
+
+def test_many_expanders_are_read_in_one_sweep():
+    source = SimulatedInterruptSource(addresses=(0x20, 0x21, 0x27))
+    presses = Presses()
+    reader = PushButtonReader(callback=presses, interrupt_source=source)
+    assert reader.addresses == [0x20, 0x21, 0x27]
+    assert len(reader.button_indices()) == 24
+    reader.update_position_mapping({11: "L4B2", 63: "L8B8"}, replace=True)
+
+    reader.start_monitoring()
+    try:
+        source.press(63)
+        presses.wait()
+        source.press(0)            # ไม่ได้ map กับ cell
+        source.press(11)
+        presses.wait()
+    finally:
+        reader.stop_monitoring()
+
+    assert presses.calls == [(63, "L8B8"), (11, "L4B2")]
+    assert reader.stats["presses"] == 3
+    assert reader.stats["sweeps"] == source.reads
+
+
+def test_update_button_mapping_follows_shelf_config(db, monkeypatch):
+    pytest.importorskip("fastapi")
+    from api import jobs
+
+    reader = PushButtonReader(interrupt_source=SimulatedInterruptSource(addresses=(0x20, 0x21)))
+    monkeypatch.setattr(jobs, "button_reader", reader)
+    monkeypatch.setattr(jobs, "BUTTON_MAP", "0x21:7=L1B1")
+    db.SHELF_CONFIG.clear()
+    db.SHELF_CONFIG.update({1: 2, 2: 3})
+
+    jobs.update_button_mapping()
+    assert reader.position_mapping == {0: "L1B2", 1: "L2B1", 2: "L2B2", 3: "L2B3", 15: "L1B1"}
@@ -0,0 +1,103 @@
+import pytest
+
+
+def synced(db):
+    """จำลองว่า Gateway รับ full sync แรกแล้ว"""
+    db.ack_shelf_delta(db.build_shelf_delta())
+
+
+def test_first_sync_is_full_then_nothing_to_send(db):
+    delta = db.build_shelf_delta()
+    assert delta["mode"] == "full"
+    assert delta["base_version"] is None
+    assert len(delta["cells"]) == len(db.get_shelf_store())
+
+    db.ack_shelf_delta(delta)
+    assert db.build_shelf_delta() is None
+    assert not db.get_shelf_sync_status()["full_resync_pending"]
+
+
+def test_delta_contains_only_changed_cells(db):
+    synced(db)
+    base = db.get_shelf_version()
+    db.add_lot_to_position(2, 1, "LOT1", 1)
+    db.add_lot_to_position(1, 3, "LOT2", 1)
+    db.add_lot_to_position(2, 1, "LOT1", 1)
+
+    delta = db.build_shelf_delta()
+    assert delta["mode"] == "delta"
+    assert delta["base_version"] == base
+    assert delta["version"] == base + 3
+    assert [(c["level"], c["block"]) for c in delta["cells"]] == [(1, 3), (2, 1)]
+    assert delta["cells"][1]["lots"] == [{"lot_no": "LOT1", "tray_count": 2, "biz": "Unknown"}]
+
+
+def test_change_after_build_stays_dirty_after_ack(db):
+    synced(db)
+    db.add_lot_to_position(1, 1, "LOT1", 1)
+    delta = db.build_shelf_delta()
+    db.add_lot_to_position(1, 1, "LOT1", 1)
+
+    db.ack_shelf_delta(delta)
+    pending = db.build_shelf_delta()
+    assert pending["base_version"] == delta["version"]
+    assert [(c["level"], c["block"]) for c in pending["cells"]] == [(1, 1)]
+
+
+def test_reset_and_full_resync_request_send_full(db):
+    synced(db)
+    db.reset_shelf_state()
+    assert db.build_shelf_delta()["mode"] == "full"
+
+    synced(db)
+    db.request_full_resync()
+    assert db.build_shelf_delta()["mode"] == "full"
+
+
+def test_gateway_confirmation_enables_delta(monkeypatch):
+    pytest.importorskip("httpx")
+    from core import gateway
+
+    class Response:
+        def __init__(self, body):
+            self.body = body
+
+        def json(self):
+            return self.body
+
+    monkeypatch.setattr(gateway, "GATEWAY_DELTA_SYNC", "auto")
+    monkeypatch.setitem(gateway._GATEWAY_CAPABILITIES, "delta_sync", None)
+    assert not gateway.delta_sync_enabled()
+
+    gateway.note_shelf_sync_response(Response({"status": "success", "delta_sync": True}))
+    assert gateway.delta_sync_enabled()
+
+    gateway.note_shelf_sync_response(Response({"status": "success"}))
+    assert not gateway.delta_sync_enabled()
+
+    monkeypatch.setattr(gateway, "GATEWAY_DELTA_SYNC", "on")
+    assert gateway.delta_sync_enabled()
+
+
+def test_ack_clears_only_cells_in_the_acked_delta(db):
+    synced(db)
+    db.add_lot_to_position(1, 1, "LOT1", 1)
+    delta = db.build_shelf_delta()
+    db.add_lot_to_position(1, 2, "LOT2", 1)
+
+    db.ack_shelf_delta(delta)
+    pending = db.build_shelf_delta()
+    assert [(c["level"], c["block"]) for c in pending["cells"]] == [(1, 2)]
+
+
+def test_late_ack_does_not_move_synced_version_back(db):
+    synced(db)
+    db.add_lot_to_position(1, 1, "LOT1", 1)
+    older = db.build_shelf_delta()
+    db.add_lot_to_position(1, 2, "LOT2", 1)
+    newer = db.build_shelf_delta()
+
+    db.ack_shelf_delta(newer)
+    db.ack_shelf_delta(older)
+    assert db.get_shelf_sync_status()["synced_version"] == newer["version"]
+    assert db.build_shelf_delta() is None
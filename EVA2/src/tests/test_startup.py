@@ -0,0 +1,78 @@
+import asyncio
+import functools
+import json
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("jinja2")
+
+import main  # noqa: E402
+from api import jobs  # noqa: E402
+
+LAYOUT = {
+    "L1B1": {"level": "1", "block": "1", "capacity": 4},
+    "L1B2": {"level": "1", "block": "2", "capacity": 4},
+}
+
+
+@pytest.fixture
+def boot(db, tmp_path, monkeypatch):
+    """storage ในเครื่องที่มี layout จาก Gateway + lots เดิม และ shelf_info cache ของ shelf เดิม"""
+    monkeypatch.setattr(db, "DYNAMIC_LAYOUT", {})
+    monkeypatch.setattr(db, "CELL_CAPACITIES", dict(db.CELL_CAPACITIES))
+    db.open_storage("memory", tmp_path)
+    db.update_layout_from_gateway(LAYOUT)
+    db.add_lot_to_position(1, 1, "CACHED", 2)
+    db.close_storage()
+
+    cache_file = tmp_path / "shelf_info.json"
+    cache_file.write_text(json.dumps({"shelf_id": "SHELF-OLD"}))
+    monkeypatch.setattr(jobs, "SHELF_INFO_CACHE_FILE", cache_file)
+    monkeypatch.setattr(db, "open_storage", functools.partial(db.open_storage, "memory", tmp_path))
+    monkeypatch.setattr(jobs, "refresh_layout_hardware", lambda: None)
+    monkeypatch.setitem(jobs.GLOBAL_SHELF_INFO, "shelf_id", None)
+    saved_status = dict(jobs.STARTUP_STATUS)
+    yield db
+    jobs.STARTUP_STATUS.update(saved_status)
+
+
+def test_serves_cache_first_then_reconcile_replaces_the_grid(boot, monkeypatch):
+    gateway_answer = None
+
+    async def initialize_shelf_info():
+        await gateway_answer.wait()
+        jobs.GLOBAL_SHELF_INFO["shelf_id"] = "SHELF-NEW"
+        return True
+
+    async def fetch_layout(shelf_id):
+        return {"status": "success", "layout": LAYOUT}
+
+    async def restore_state():
+        return [{"level": 1, "block": 2, "lots": [{"lot_no": "GATEWAY", "tray_count": 1, "biz": "X"}]}]
+
+    monkeypatch.setattr(main, "initialize_shelf_info", initialize_shelf_info)
+    monkeypatch.setattr(jobs, "fetch_layout_from_gateway", fetch_layout)
+    monkeypatch.setattr(jobs, "restore_shelf_state_from_gateway", restore_state)
+
+    async def run():
+        nonlocal gateway_answer
+        gateway_answer = asyncio.Event()
+        await main.startup_event()
+        serving = (dict(jobs.STARTUP_STATUS), jobs.GLOBAL_SHELF_INFO["shelf_id"],
+                   [lot["lot_no"] for lot in boot.get_cell(1, 1)[2]])
+
+        gateway_answer.set()
+        await main._reconcile_task
+        ready = dict(jobs.STARTUP_STATUS)
+        await main.shutdown_event()
+        return serving, ready
+
+    (status, shelf_id, cached_lots), ready = asyncio.run(run())
+    assert (status["phase"], status["source"]) == ("serving", "cache")
+    assert shelf_id == "SHELF-OLD"
+    assert cached_lots == ["CACHED"]
+
+    assert (ready["phase"], ready["state"], ready["layout"]) == ("ready", "gateway", True)
+    assert boot.get_cell(1, 1)[2] == []
+    assert [lot["lot_no"] for lot in boot.get_cell(1, 2)[2]] == ["GATEWAY"]
@@ -0,0 +1,68 @@
+import pytest
+
+from core.storage import MemoryStorage, SQLiteStorage, create_storage
+
+
+def test_create_storage_selects_engine(tmp_path):
+    assert isinstance(create_storage("sqlite", tmp_path / "shelf.db"), SQLiteStorage)
+    assert isinstance(create_storage("memory", tmp_path), MemoryStorage)
+    assert isinstance(create_storage("bogus", tmp_path), MemoryStorage)
+
+
+@pytest.mark.parametrize("engine", ["sqlite", "memory"])
+def test_database_round_trip(db, tmp_path, engine):
+    location = tmp_path / "shelf.db" if engine == "sqlite" else tmp_path
+    db.open_storage(engine, location)
+    db.add_lot_to_position(1, 1, "LOT1", 2)
+    db.add_lot_to_position(1, 1, "LOT1", 3, "BIZ")
+    db.add_lot_to_position(1, 1, "LOT2", 1)
+    db.update_lot_quantity(1, 1, "LOT2", 5)
+    db.set_cell_lots(2, 1, [{"lot_no": "LOT3", "tray_count": 1, "biz": "X"}])
+    db.update_lot_biz("LOT3", "Y")
+    db.enqueue_job({"jobId": db.next_job_id(), "lot_no": "LOT1", "level": 1, "block": 1})
+    db.enqueue_job({"jobId": db.next_job_id(), "lot_no": "LOT4", "level": 2, "block": 2})
+    db.update_job("job_1", {"error": True})
+    db.cancel_jobs_by_lot("LOT4")
+    expected_shelf = [list(cell) for cell in db.get_shelf_store()]
+    db.close_storage()
+
+    db.reset_db()
+    db.open_storage(engine, location)
+    assert [list(cell) for cell in db.get_shelf_store()] == expected_shelf
+    assert db.get_cell(1, 1)[2] == [{"lot_no": "LOT1", "tray_count": 5, "biz": "BIZ"},
+                                    {"lot_no": "LOT2", "tray_count": 5, "biz": "Unknown"}]
+    assert db.get_job_queue().to_list() == [{"jobId": "job_1", "lot_no": "LOT1", "level": 1, "block": 1, "error": True}]
+    assert db.DB["job_counter"] == 2
+    assert db.find_lot_location("LOT3") == (2, 1)
+
+
+def test_sqlite_job_history(db, tmp_path):
+    db.open_storage("sqlite", tmp_path / "shelf.db")
+    db.enqueue_job({"jobId": "job_1", "lot_no": "LOT1", "level": 1, "block": 1})
+    db.complete_job_entry("job_1")
+    history = db.get_job_history(lot_no="LOT1")
+    assert [entry["event"] for entry in history] == ["completed", "created"]
+    assert db.get_storage_status()["jobs"] == 0
+
+
+def test_sqlite_writes_are_queued_for_the_writer_thread(tmp_path):
+    state = {"version": 1, "jobs": [], "shelf_state": [[1, 1, []]], "job_counter": 0, "layout": {}}
+    storage = SQLiteStorage(tmp_path / "shelf.db", write_interval=60)
+    storage.load()
+    storage.open(lambda: state)
+    storage.checkpoint()                # checkpoint ปลุก writer ทันที
+    storage.sync()
+    assert storage.get_status()["commits"] == 1
+
+    storage.record("lot_add", {"level": 1, "block": 1, "lot_no": "LOT1", "tray_count": 2})
+    assert storage.get_status()["pending_writes"] == 1
+    assert storage.get_status()["lots"] == 0
+
+    storage.sync()
+    status = storage.get_status()
+    assert (status["pending_writes"], status["lots"], status["commits"]) == (0, 1, 2)
+
+    storage.record("lot_qty", {"level": 1, "block": 1, "lot_no": "LOT1", "tray_count": 7})
+    storage.close()
+    snapshot, _ = SQLiteStorage(tmp_path / "shelf.db").load()
+    assert snapshot["shelf_state"] == [[1, 1, [{"lot_no": "LOT1", "tray_count": 7, "biz": "Unknown"}]]]
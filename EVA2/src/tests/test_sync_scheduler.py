@@ -0,0 +1,65 @@
+import asyncio
+
+from core.sync_scheduler import SyncScheduler
+
+
+def test_burst_of_changes_flushes_once():
+    flushes = []
+
+    async def run():
+        scheduler = SyncScheduler(window=0.05, max_staleness=1.0)
+        scheduler.set_flush_handler(lambda: flushes.append(scheduler.get_status()["queue_depth"]))
+        scheduler.start()
+        for _ in range(10):
+            scheduler.notify()
+            await asyncio.sleep(0.005)
+        await asyncio.sleep(0.15)
+        await scheduler.stop()
+        return scheduler
+
+    scheduler = asyncio.run(run())
+    assert len(flushes) == 1
+    assert scheduler.stats["max_batch"] == 10
+    assert scheduler.stats["notifications"] == 10
+
+
+def test_continuous_changes_flush_by_max_staleness():
+    flushes = []
+
+    async def run():
+        scheduler = SyncScheduler(window=0.05, max_staleness=0.1)
+
+        async def flush():
+            flushes.append(asyncio.get_running_loop().time())
+
+        scheduler.set_flush_handler(flush)
+        scheduler.start()
+        start = asyncio.get_running_loop().time()
+        while asyncio.get_running_loop().time() - start < 0.35:
+            scheduler.notify()
+            await asyncio.sleep(0.01)
+        await scheduler.stop(flush=False)
+
+    asyncio.run(run())
+    assert 2 <= len(flushes) <= 4
+
+
+def test_stop_flushes_pending_changes_and_survives_handler_errors():
+    calls = []
+
+    def flush():
+        calls.append(1)
+        raise RuntimeError("gateway down")
+
+    async def run():
+        scheduler = SyncScheduler(window=10, max_staleness=10)
+        scheduler.set_flush_handler(flush)
+        scheduler.start()
+        scheduler.notify()
+        await scheduler.stop()
+        return scheduler
+
+    scheduler = asyncio.run(run())
+    assert calls == [1]
+    assert scheduler.stats["flush_errors"] == 1
+    assert scheduler.get_status()["queue_depth"] == 0
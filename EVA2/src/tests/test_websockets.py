@@ -0,0 +1,212 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from api import websockets  # noqa: E402
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.frames = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        self.frames.append(json.loads(text))
+
+    async def send_bytes(self, data):
+        self.frames.append(data)
+
+    async def close(self, code=1000, reason=""):
+        pass
+
+    def types(self):
+        return [frame["type"] for frame in self.frames]
+
+
+async def drain():
+    """ให้ writer task ของทุก client ส่งข้อความที่ค้างใน queue"""
+    await asyncio.sleep(0.02)
+
+
+async def publish_jobs(manager, count):
+    for i in range(count):
+        await manager.broadcast({"type": "new_job", "payload": {"i": i}})
+
+
+def test_resume_replays_only_missed_events(db):
+    async def run():
+        manager = websockets.ConnectionManager()
+        first = FakeWebSocket()
+        await manager.connect(first)
+        await publish_jobs(manager, 3)
+
+        resumed = FakeWebSocket()
+        await manager.connect(resumed, since=1, session=manager.session)
+        await drain()
+        for ws in (first, resumed):
+            manager.disconnect(ws)
+        return first, resumed
+
+    first, resumed = asyncio.run(run())
+    assert first.types() == ["initial_state", "new_job", "new_job", "new_job"]
+    assert [frame["seq"] for frame in first.frames[1:]] == [1, 2, 3]
+    assert resumed.types() == ["resumed", "new_job", "new_job"]
+    assert [frame["seq"] for frame in resumed.frames[1:]] == [2, 3]
+    assert resumed.frames[0]["payload"]["replayed"] == 2
+
+
+def test_shelf_changes_while_nobody_is_connected_are_replayed(db, monkeypatch):
+    manager = websockets.ConnectionManager()
+    monkeypatch.setattr(db, "_SHELF_LISTENERS", [manager.note_shelf_change])
+
+    async def run():
+        first = FakeWebSocket()
+        await manager.connect(first)
+        await publish_jobs(manager, 1)
+        await drain()
+        manager.disconnect(first)
+
+        db.add_lot_to_position(1, 1, "LOT-A", 2)
+        await asyncio.sleep(0)
+        await manager.broadcast({"type": "job_completed", "payload": {}})
+
+        resumed = FakeWebSocket()
+        await manager.connect(resumed, since=first.frames[-1]["seq"], session=manager.session)
+        await drain()
+        manager.disconnect(resumed)
+        return resumed
+
+    resumed = asyncio.run(run())
+    assert resumed.types() == ["resumed", "cell_updated", "job_completed"]
+    assert resumed.frames[0]["payload"]["shelf_version"] == 1
+    cell = resumed.frames[1]["payload"]
+    assert (cell["level"], cell["block"], cell["version"]) == (1, 1, 1)
+    assert [lot["lot_no"] for lot in cell["lots"]] == ["LOT-A"]
+
+
+def test_gap_or_unknown_session_falls_back_to_initial_state(db, monkeypatch):
+    monkeypatch.setattr(websockets, "WS_REPLAY_BUFFER", 2)
+
+    async def run():
+        manager = websockets.ConnectionManager()
+        first = FakeWebSocket()
+        await manager.connect(first)
+        await publish_jobs(manager, 3)
+
+        gap, other_session, current = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        await manager.connect(gap, since=0, session=manager.session)
+        await manager.connect(other_session, since=2, session="old-session")
+        await manager.connect(current, since=3, session=manager.session)
+        await drain()
+        for ws in (first, gap, other_session, current):
+            manager.disconnect(ws)
+        return manager, gap, other_session, current
+
+    manager, gap, other_session, current = asyncio.run(run())
+    assert gap.types() == ["initial_state"]
+    assert gap.frames[0]["payload"]["seq"] == 3
+    assert other_session.types() == ["initial_state"]
+    assert current.types() == ["resumed"]
+    assert manager.stats["snapshot_fallbacks"] == 2
+
+
+def test_topic_and_level_subscriptions_filter_events(db):
+    async def run():
+        manager = websockets.ConnectionManager()
+        jobs_only, level_two = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(jobs_only, topics=["jobs"])
+        await manager.connect(level_two, levels=[2])
+        await manager.broadcast({"type": "new_job", "payload": {"level": 1}})
+        await manager.broadcast({"type": "button_press", "payload": {"level": 2}})
+        await manager.broadcast({"type": "system_notice", "payload": {}})
+        await drain()
+        for ws in (jobs_only, level_two):
+            manager.disconnect(ws)
+        return jobs_only, level_two
+
+    jobs_only, level_two = asyncio.run(run())
+    assert jobs_only.types() == ["initial_state", "new_job", "system_notice"]
+    assert level_two.types() == ["initial_state", "button_press", "system_notice"]
+
+
+def test_unsubscribing_levels_from_all_levels_keeps_the_rest(db):
+    async def run():
+        manager = websockets.ConnectionManager()
+        ws = FakeWebSocket()
+        await manager.connect(ws)
+        subscription = manager.update_subscription(ws, "unsubscribe", {"levels": [2]})
+        manager.disconnect(ws)
+        return subscription
+
+    subscription = asyncio.run(run())
+    assert subscription["levels"] == sorted(level for level in db.SHELF_CONFIG if level != 2)
+
+
+def test_msgpack_clients_get_binary_frames(db):
+    msgpack = pytest.importorskip("msgpack")
+
+    async def run():
+        manager = websockets.ConnectionManager()
+        binary, text = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(binary, encoding="msgpack")
+        await manager.connect(text)
+        await publish_jobs(manager, 1)
+        await drain()
+        for ws in (binary, text):
+            manager.disconnect(ws)
+        return binary, text
+
+    binary, text = asyncio.run(run())
+    assert all(isinstance(frame, bytes) for frame in binary.frames)
+    assert [msgpack.unpackb(frame)["type"] for frame in binary.frames] == ["initial_state", "new_job"]
+    assert msgpack.unpackb(binary.frames[1]) == text.frames[1]
+
+
+def test_queue_lag_is_tracked_per_message():
+    async def run():
+        client = websockets.ClientConnection(FakeWebSocket(), 1)
+        assert client.lag_ms() == 0.0
+        client.put("a")
+        await asyncio.sleep(0.02)
+        client.put("b")
+        lag = client.lag_ms()
+        enqueued_at, frame = await client.get()
+        return lag, frame, client.lag_ms(), len(client.enqueued_at)
+
+    lag, frame, lag_after, remaining = asyncio.run(run())
+    assert lag >= 15 and frame == "a"
+    assert lag_after < lag and remaining == 1
+
+
+def test_client_that_falls_behind_is_closed(db, monkeypatch):
+    monkeypatch.setattr(websockets, "WS_CLIENT_QUEUE_SIZE", 3)
+
+    class StuckWebSocket(FakeWebSocket):
+        closed_with = None
+
+        async def send_text(self, text):
+            await asyncio.sleep(3600)
+
+        async def close(self, code=1000, reason=""):
+            self.closed_with = code
+
+    async def run():
+        manager = websockets.ConnectionManager()
+        stuck, healthy = StuckWebSocket(), FakeWebSocket()
+        await manager.connect(stuck)
+        await manager.connect(healthy)
+        for _ in range(5):
+            await publish_jobs(manager, 1)
+            await drain()
+        manager.disconnect(healthy)
+        return manager, stuck, healthy
+
+    manager, stuck, healthy = asyncio.run(run())
+    assert stuck.closed_with == 1013
+    assert manager.stats["slow_clients_closed"] == 1
+    assert healthy.types().count("new_job") == 5